@@ -22,7 +22,11 @@ class CommandInjectionAgent(HMI):
     def _logic(self):
 
         if datetime.now().timestamp() > self.time +  self.period :
-            value =int( self._receive(self.destination))
+            value = self._receive(self.destination)
+            if value is None:
+                # the PLC cannot be reached, try again next scan
+                return
+            value = int(value)
             if int(value) == 1:
                 value = 0
             elif int(value) ==0:
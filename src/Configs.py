@@ -58,40 +58,45 @@ class TAG:
     PART_DISTANCE_TO_SENSOR_VALUE = 'part_distance_to_sensor_value'
     WAITING_FOR_STICKER = 'waiting_for_sticker'
  
+    # optional 'datatype': 'bool' (a coil, or a discrete input for inputs), 'int16', 'int32', 'float32' or
+    # 'string' with a 'length' in bytes; tags without one are fixed point numbers at register id * 2
     TAG_LIST = {
-        PRINTING_STICKER_TAG: {'id': 22, 'plc': 1, 'type': 'output', 'fault': 0.0, 'default': 1},
-        PART_PRESENT: {'id': 0, 'plc': 1, 'type': 'output', 'fault': 0.0, 'default': 0},
+        PRINTING_STICKER_TAG: {'id': 22, 'plc': 1, 'type': 'output', 'fault': 0.0, 'datatype': 'bool', 'default': 1},
+        PART_PRESENT: {'id': 0, 'plc': 1, 'type': 'output', 'fault': 0.0, 'datatype': 'bool', 'default': 0},
         CUSTOMER_PART_NUMBER: {'id': 1, 'plc': 1, 'type': 'input', 'fault': 0.0, 'default': 0},
         MAHLE_PART_NUMBER: {'id': 2, 'plc': 1, 'type': 'input', 'fault': 0.0, 'default': 0},
         SERIAL_NUMBER: {'id': 3, 'plc': 1, 'type': 'input', 'fault': 0.0, 'default': 0},
-        READ_PN_SN: {'id': 4, 'plc': 1, 'type': 'output', 'fault': 0.0, 'default': 0},
-        CODE_READED: {'id': 5, 'plc': 1, 'type': 'output', 'fault': 0.0, 'default': 0},
+        READ_PN_SN: {'id': 4, 'plc': 1, 'type': 'output', 'fault': 0.0, 'datatype': 'bool', 'default': 0},
+        CODE_READED: {'id': 5, 'plc': 1, 'type': 'output', 'fault': 0.0, 'datatype': 'bool', 'default': 0},
         HMI_PREVIOUS_TEST_RESULT_CODE: {'id': 6, 'plc': 1, 'type': 'output', 'fault': 0.0, 'default': 0},
         HMI_PREVIOUS_TEST_RESULT_MESSAGE: {'id': 7, 'plc': 1, 'type': 'output', 'fault': 0.0, 'default': 0},
-        START_TEST: {'id': 8, 'plc': 1, 'type': 'output', 'fault': 0.0, 'default': 0},
-        BYPASS: {'id': 9, 'plc': 1, 'type': 'output', 'fault': 0.0, 'default': 0},
-        TEST_RESULT: {'id': 10, 'plc': 1, 'type': 'output', 'fault': 0.0, 'default': 0},
+        START_TEST: {'id': 8, 'plc': 1, 'type': 'output', 'fault': 0.0, 'datatype': 'bool', 'default': 0},
+        BYPASS: {'id': 9, 'plc': 1, 'type': 'output', 'fault': 0.0, 'datatype': 'bool', 'default': 0},
+        TEST_RESULT: {'id': 10, 'plc': 1, 'type': 'output', 'fault': 0.0, 'datatype': 'bool', 'default': 0},
         READ_TEST_RESULT: {'id': 11, 'plc': 1, 'type': 'output', 'fault': 0.0, 'default': 0},
-        CONFIRMATION_BIT: {'id': 12, 'plc': 1, 'type': 'output', 'fault': 0.0, 'default': 0},
+        CONFIRMATION_BIT: {'id': 12, 'plc': 1, 'type': 'output', 'fault': 0.0, 'datatype': 'bool', 'default': 0},
         HEARTBEAT: {'id': 13, 'plc': 1, 'type': 'output', 'fault': 0.0, 'default': 0},
-        COM_ERROR: {'id': 14, 'plc': 1, 'type': 'output', 'fault': 0.0, 'default': 0},
-        HMI_STATUSCODE: {'id': 15, 'plc': 1, 'type': 'output', 'fault': 0.0, 'default': 0},
-        HMI_MESSAGE: {'id': 16, 'plc': 1, 'type': 'output', 'fault': 0.0, 'default': 0},
-        MACHINE_RESET: {'id': 17, 'plc': 1, 'type': 'output', 'fault': 0.0, 'default': 0},
-        CONVEYOR_BELT_ENGINE_STATUS:{'id': 18, 'plc': 1, 'type': 'output', 'fault': 0.0, 'default': 1},
+        COM_ERROR: {'id': 14, 'plc': 1, 'type': 'output', 'fault': 0.0, 'datatype': 'bool', 'default': 0},
+        HMI_STATUSCODE: {'id': 15, 'plc': 1, 'type': 'output', 'fault': 0.0, 'datatype': 'int16', 'default': 0},
+        HMI_MESSAGE: {'id': 16, 'plc': 1, 'type': 'output', 'fault': 0.0, 'datatype': 'string', 'length': 40, 'default': ''},
+        MACHINE_RESET: {'id': 17, 'plc': 1, 'type': 'output', 'fault': 0.0, 'datatype': 'bool', 'default': 0},
+        CONVEYOR_BELT_ENGINE_STATUS:{'id': 18, 'plc': 1, 'type': 'output', 'fault': 0.0, 'datatype': 'bool', 'default': 1},
         CONVEYOR_BELT_ENGINE_MODE:{'id': 19, 'plc': 1, 'type': 'output', 'fault': 0.0, 'default': 2},
         PART_DISTANCE_TO_SENSOR_VALUE:{'id': 20, 'plc': 1, 'type': 'input', 'fault': 0.0, 'default': 5},
-        WAITING_FOR_STICKER:{'id': 21, 'plc': 1, 'type': 'input', 'fault': 0.0, 'default': 0},
+        WAITING_FOR_STICKER:{'id': 21, 'plc': 1, 'type': 'input', 'fault': 0.0, 'datatype': 'bool', 'default': 0},
         
-        BARCODE_VERIFICATION_STATUS: {'id': 23, 'plc': 1, 'type': 'output', 'fault': 0.0, 'default': 0},
-        PART_READY: {'id': 24, 'plc': 1, 'type': 'output', 'fault': 0.0, 'default': 1},
-        CONVEYOR_STATUS: {'id': 25, 'plc': 1, 'type': 'output', 'fault': 0.0, 'default': 1},
+        BARCODE_VERIFICATION_STATUS: {'id': 23, 'plc': 1, 'type': 'output', 'fault': 0.0, 'datatype': 'bool', 'default': 0},
+        PART_READY: {'id': 24, 'plc': 1, 'type': 'output', 'fault': 0.0, 'datatype': 'bool', 'default': 1},
+        CONVEYOR_STATUS: {'id': 25, 'plc': 1, 'type': 'output', 'fault': 0.0, 'datatype': 'bool', 'default': 1},
  
     }   
  
  
  
 class Controllers:
+    # optional per PLC: 'server_engine': 'threads' (pyModbusTCP, a thread per client, default), 'asyncio',
+    # 'sharded' (worker processes sharing the port, with 'workers': count and 'cpu_affinity': [cpu, ...]) or
+    # 'process' (like 'sharded' with one worker by default, registers published once per scan)
     PLC_CONFIG = {
         SimulationConfig.EXECUTION_MODE_DOCKER: {
             1: {
@@ -141,6 +146,11 @@ class Connection:
         'path': '127.0.0.1:11211',
         'name': 'fp_table',
     }
+    SHM_CONNECTION = {
+        'type': 'shm',
+        'path': 'storage/PhysicalSimulation1.shm',
+        'name': 'fp_table',
+    }
     File_CONNECTION = {
         'type': 'file',
         'path': 'storage/sensors_actuators.json',
@@ -150,6 +160,7 @@ class Connection:
     CONNECTION_CONFIG = {
         SimulationConfig.EXECUTION_MODE_GNS3: MEMCACHE_DOCKER_CONNECTION,
         SimulationConfig.EXECUTION_MODE_DOCKER: SQLITE_CONNECTION, #todo : return back to sqlite connection
+        # SHM_CONNECTION keeps the storage in shared memory, for devices running on one machine
         SimulationConfig.EXECUTION_MODE_LOCAL: SQLITE_CONNECTION
     }
     CONNECTION = CONNECTION_CONFIG[SimulationConfig.EXECUTION_MODE]
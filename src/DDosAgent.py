@@ -2,9 +2,10 @@ import argparse
 import logging
 import os
 import random
+import time
 
 from time import sleep
-from ics_sim.Device import HMI, Runnable
+from ics_sim.Device import HMI, Runnable, RunnableExecutor
 from Configs import TAG, Controllers
 
 
@@ -26,13 +27,17 @@ class DDosAgent(HMI):
         # set counter and chuck size
         self.__counter = 0
         self.chunk = 10
+        self.__idle_until = 0
 
     def _before_start(self):
         self._set_clear_scr(False)
-        sleep(5)
+        # idle instead of sleeping, agents sharing an executor thread must not block each other
+        self.__idle_until = time.monotonic() + 5
         self.report(f'selected target = {self.__target}', level=logging.INFO)
 
     def _logic(self):
+        if time.monotonic() < self.__idle_until:
+            return
         try:
             for index_counter in range(self.chunk):
                 value = self._receive(self.__target)
@@ -43,6 +48,8 @@ class DDosAgent(HMI):
                         logging.INFO)
 
     def _post_logic_update(self):
+        if time.monotonic() < self.__idle_until:
+            return
         latency = self.get_logic_execution_time() / self.chunk
         if latency > DDosAgent.max:
             DDosAgent.max = latency
@@ -75,6 +82,9 @@ class DDosAgent(HMI):
         parser.add_argument('--timeout', metavar='timeout for attack', type=float, default=60,
                             help='interval to apply attack', required=False)
 
+        parser.add_argument('--executors', metavar='threads', type=int, default=1,
+                            help='threads the agents of this process are spread over', required=False)
+
         return parser.parse_args()
 
 
@@ -94,15 +104,15 @@ if __name__ == '__main__':
 
     attackers_count = 70
 
-    attacker_list = []
+    executors = [RunnableExecutor(f'DDoS_{args.name_prefix}_{i}') for i in range(max(args.executors, 1))]
     for i in range(attackers_count):
-        attacker_list.append(
+        executors[i % len(executors)].add(
             DDosAgent(name=f'DDoS_Agent_{args.name_prefix}_{i}', target_ip=args.target, shared_logger=logger))
 
-    for attacker in attacker_list:
-        attacker.start()
+    for executor in executors:
+        executor.start()
 
     sleep(args.timeout)
 
-    for attacker in attacker_list:
-        attacker.stop()
+    for executor in executors:
+        executor.stop()
@@ -3,9 +3,7 @@ import time
 from ics_sim.Device import HIL
 from Configs import TAG, PHYSICS, Connection
 
-# Setup logging
-logging.basicConfig(level=logging.DEBUG, filename='app.log', filemode='a', 
-                    format='%(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
 class FactorySimulation(HIL):
     def __init__(self):
@@ -16,61 +14,73 @@ class FactorySimulation(HIL):
     def init(self):
         """Initialize the simulation with default tag values."""
         initial_list = []
-        for tag in TAG.TAG_LIST:
+        # keep tag ids as the storage order for slot based connectors (shm); string tags are not stored
+        for tag in sorted(TAG.TAG_LIST, key=lambda name: TAG.TAG_LIST[name]['id']):
+            if TAG.TAG_LIST[tag].get('datatype') == 'string':
+                continue
             initial_value = (tag, TAG.TAG_LIST[tag]['default'])
             initial_list.append(initial_value)
-            logging.debug(f"Initializing tag: {tag} with value {initial_value}")
+            logger.debug("Initializing tag: %s with value %s", tag, initial_value)
         
         self._connector.initialize(initial_list)
-        logging.info("Database initialization completed with initial values.")
+        logger.info("Database initialization completed with initial values.")
 
     def _logic(self):
         """Main logic for simulating factory behavior."""
         elapsed_time = self._current_loop_time - self._last_loop_time
 
-        # Get the current state of the conveyor belt and part presence
-        conveyor_belt_status = self._get(TAG.CONVEYOR_BELT_ENGINE_STATUS)
-        part_present = self._get(TAG.PART_PRESENT)
+        # Get the current state of the conveyor belt, part presence and position in one round-trip
+        values = self._get_many([
+            TAG.CONVEYOR_BELT_ENGINE_STATUS,
+            TAG.PART_PRESENT,
+            TAG.PART_DISTANCE_TO_SENSOR_VALUE,
+        ])
+        conveyor_belt_status = values[TAG.CONVEYOR_BELT_ENGINE_STATUS]
+        part_present = values[TAG.PART_PRESENT]
 
         # Handle cases where the tag values might be None
         if conveyor_belt_status is None:
-            logging.error("CONVEYOR_BELT_ENGINE_STATUS tag value is None.")
+            logger.error("CONVEYOR_BELT_ENGINE_STATUS tag value is None.")
             conveyor_belt_status = 1  # Default to running
 
         if part_present is None:
-            logging.error("PART_PRESENT tag value is None.")
+            logger.error("PART_PRESENT tag value is None.")
             part_present = 0  # Default to no part present
 
         # If the conveyor belt is running and no part is present, move the part closer to the sensor
         if conveyor_belt_status:
-            part_distance_to_sensor = self._get(TAG.PART_DISTANCE_TO_SENSOR_VALUE)
+            part_distance_to_sensor = values[TAG.PART_DISTANCE_TO_SENSOR_VALUE]
             if part_distance_to_sensor is None:
-                logging.error("PART_DISTANCE_TO_SENSOR_VALUE tag value is None.")
+                logger.error("PART_DISTANCE_TO_SENSOR_VALUE tag value is None.")
                 part_distance_to_sensor = PHYSICS.PART_DISTANCE  # Default starting distance
 
             # Update the part's position
             part_distance_to_sensor -= elapsed_time * PHYSICS.CONVEYOR_BELT_SPEED
             if part_distance_to_sensor <= 0:
                 part_distance_to_sensor = 0
-                self._set(TAG.PART_PRESENT, 1)  # Part has arrived at the sensor
-                self._set(TAG.CONVEYOR_BELT_ENGINE_STATUS, 0)  # Stop the conveyor belt
-                logging.debug("Part has arrived at the sensor. Stopping conveyor belt.")
+                self._set_many({
+                    TAG.PART_PRESENT: 1,  # Part has arrived at the sensor
+                    TAG.CONVEYOR_BELT_ENGINE_STATUS: 0,  # Stop the conveyor belt
+                })
+                logger.debug("Part has arrived at the sensor. Stopping conveyor belt.")
             else:
                 self._set(TAG.PART_DISTANCE_TO_SENSOR_VALUE, part_distance_to_sensor)
-                logging.debug(f"Updated part distance to sensor: {part_distance_to_sensor}")
+                logger.debug("Updated part distance to sensor: %s", part_distance_to_sensor)
 
         # If the part is present and the conveyor belt is stopped, wait for PLC to process
         elif part_present:
             # Wait for PLC to process the part
-            logging.debug("Part is present and conveyor belt is stopped. Waiting for PLC to process.")
+            logger.debug("Part is present and conveyor belt is stopped. Waiting for PLC to process.")
 
         # If the part has been processed by the PLC and the conveyor belt is restarted
         else:
             if conveyor_belt_status == 0:
                 # Prepare for the next part
-                self._set(TAG.PART_DISTANCE_TO_SENSOR_VALUE, PHYSICS.PART_DISTANCE)
-                self._set(TAG.CONVEYOR_BELT_ENGINE_STATUS, 1)  # Start the conveyor belt
-                logging.debug("Conveyor belt restarted. Preparing for the next part.")
+                self._set_many({
+                    TAG.PART_DISTANCE_TO_SENSOR_VALUE: PHYSICS.PART_DISTANCE,
+                    TAG.CONVEYOR_BELT_ENGINE_STATUS: 1,  # Start the conveyor belt
+                })
+                logger.debug("Conveyor belt restarted. Preparing for the next part.")
 
     def _simulate_label_application(self):
         """Simulate the label application process."""
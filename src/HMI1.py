@@ -1,5 +1,6 @@
 
-from datetime import datetime
+import logging
+from datetime import datetime, timedelta
 
 from ics_sim.Device import HMI
 from Configs import TAG, Controllers
@@ -56,24 +57,32 @@ class HMI1(HMI):
         self.__update_massages()
 
     def __update_massages(self):
-        self._latency = 0
-
         for row in self._rows:
             self._rows[row]['msg1'] = ''
             self._rows[row]['msg2'] = ''
 
+        # one block read per PLC instead of one request per tag
+        timestamp = datetime.now()
+        try:
+            values = self._receive_many(self.filtered_tags)
+        except Exception as e:
+            self.report('reading the PLCs failed: {}'.format(e), logging.ERROR)
+            values = {}
+        self._latency = (datetime.now() - timestamp) / timedelta(microseconds=1)
+
         for tag in self.filtered_tags:
+            value = values.get(tag)
             pos = tag.rfind('_')
             row = tag[0:pos]
             attribute = tag[pos + 1:]
 
             if attribute == 'value' or attribute == 'status':
-                self._rows[row]['msg2'] += self.__get_formatted_value(tag)
+                self._rows[row]['msg2'] += self.__get_formatted_value(tag, value)
             elif attribute == 'max':
-                self._rows[row]['msg1'] += self.__get_formatted_value(tag)
+                self._rows[row]['msg1'] += self.__get_formatted_value(tag, value)
                 self._rows[row]['msg1'] = self._make_text(self._rows[row]['msg1'].center(self.msg1_length, " "), self.COLOR_GREEN)
             else:
-                self._rows[row]['msg1'] += self.__get_formatted_value(tag)
+                self._rows[row]['msg1'] += self.__get_formatted_value(tag, value)
 
         for row in self._rows:
             if self._rows[row]['msg1'] == '':
@@ -81,20 +90,13 @@ class HMI1(HMI):
             if self._rows[row]['msg2'] == '':
                 self._rows[row]['msg2'] = ''.center(self.msg1_length, ' ')
 
-    def __get_formatted_value(self, tag):
-        timestamp = datetime.now()
+    def __get_formatted_value(self, tag, value):
         pos = tag.rfind('_')
         tag_name = tag[0:pos]
         tag_attribute = tag[pos + 1:]
-        value = "null"
 
-        try:
-            value = self._receive(tag)
-            if value is None:
-                raise ValueError("Received None value for tag: {}".format(tag))
-        except Exception as e:
-           # self.report(str(e), logging.WARNING)  # Use str(e) directly with logging
-            return self._make_text(value.center(self.msg2_length, " "), self.COLOR_RED)
+        if value is None:
+            return self._make_text("null".center(self.msg2_length, " "), self.COLOR_RED)
         
 
         if tag_attribute == 'mode':
@@ -127,10 +129,6 @@ class HMI1(HMI):
         else:
             value = self._make_text(str(value).center(self.msg2_length, " "), self.COLOR_CYAN)
 
-        elapsed = datetime.now() - timestamp
-
-        if elapsed.microseconds > self._latency:
-            self._latency = elapsed.microseconds
         return value
 
     def __show_table(self):
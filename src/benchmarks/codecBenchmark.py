@@ -0,0 +1,81 @@
+"""Microbenchmark of the ModbusBase register codec.
+
+    python -m benchmarks.codecBenchmark --values 64
+
+Compares, per value converted, the original pure-Python loop, the scalar
+encode()/decode() calls and the batch encode_many()/decode_many() calls.
+"""
+import argparse
+import json
+import random
+import sys
+import timeit
+
+from ics_sim.protocol import ModbusBase
+
+
+def loop_encode(number, word_num=2, precision=4):
+    """The original scalar encoder, kept here as the reference point."""
+    number = int(number * pow(10, precision))
+    result = []
+    while number:
+        result.append(number % 65536)
+        number = int(number / 65536)
+    while len(result) < word_num:
+        result.append(0)
+    result.reverse()
+    return result
+
+
+def loop_decode(word_array, precision=4):
+    """The original scalar decoder, kept here as the reference point."""
+    base_holder = 1
+    result = 0
+    for word in word_array:
+        result *= base_holder
+        result += word
+        base_holder *= 65536
+    return result / pow(10, precision)
+
+
+def run(value_count, repeat, seed=0):
+    modbus_base = ModbusBase()
+    rng = random.Random(seed)
+    values = [round(rng.random() * 10000, 4) for _ in range(value_count)]
+    words = modbus_base.encode_many(values)
+    pairs = [words[i:i + 2] for i in range(0, len(words), 2)]
+
+    cases = {
+        'encode/loop': lambda: [loop_encode(value) for value in values],
+        'encode/scalar': lambda: [modbus_base.encode(value) for value in values],
+        'encode/many': lambda: modbus_base.encode_many(values),
+        'decode/loop': lambda: [loop_decode(pair) for pair in pairs],
+        'decode/scalar': lambda: [modbus_base.decode(pair) for pair in pairs],
+        'decode/many': lambda: modbus_base.decode_many(words),
+    }
+
+    results = {}
+    for name, case in cases.items():
+        number = max(1, 20000 // value_count)
+        best = min(timeit.repeat(case, number=number, repeat=repeat)) / number
+        results[name] = {'ns_per_value': round(best / value_count * 1e9, 1)}
+    for direction in ('encode', 'decode'):
+        reference = results[direction + '/loop']['ns_per_value']
+        for kind in ('scalar', 'many'):
+            entry = results['{}/{}'.format(direction, kind)]
+            entry['speedup'] = round(reference / entry['ns_per_value'], 2)
+    return {'config': {'values': value_count, 'repeat': repeat}, 'results': results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ModbusBase codec microbenchmark')
+    parser.add_argument('--values', type=int, default=64, help='values converted per call')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    print(json.dumps(run(args.values, args.repeat), indent=2, sort_keys=True))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,269 @@
+"""Load benchmark for the ConnectorFactory backends.
+
+Run from the src directory, e.g.
+
+    python -m benchmarks.connectorBenchmark --backends sqlite,shm --threads 4 --bulk
+    python -m benchmarks.connectorBenchmark --fake_memcache --baseline benchmarks/baseline.json
+
+Every scenario (backend x single/bulk) is driven by processes x threads workers,
+each with its own connector, doing a random read/write mix over the tag set.
+Throughput and p50/p99/p999 latency are printed as JSON; with --baseline the
+results are compared against a stored run and the exit code is 1 on regression.
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from array import array
+
+from ics_sim.connectors import ConnectorFactory
+
+BACKENDS = ['sqlite', 'memcache', 'file', 'shm', 'hardware']
+PERCENTILES = {'p50': 50.0, 'p99': 99.0, 'p999': 99.9}
+# p99 differences below this are timer and scheduler noise, not regressions
+LATENCY_NOISE_US = 5.0
+
+
+def make_connection(backend, directory, memcache_address):
+    if backend == 'sqlite':
+        path = os.path.join(directory, 'benchmark.sqlite')
+    elif backend == 'memcache':
+        path = memcache_address
+    elif backend == 'file':
+        path = os.path.join(directory, 'benchmark.json')
+    elif backend == 'shm':
+        path = os.path.join(directory, 'benchmark.shm')
+    else:
+        path = directory
+    return {'type': backend, 'path': path, 'name': 'benchmark'}
+
+
+def percentile(sorted_values, percent):
+    """Nearest-rank percentile of an already sorted sequence."""
+    if not sorted_values:
+        return 0.0
+    # rounding first keeps float error (99.9 * 1000 / 100 = 999.0000000000001) out of the ceil
+    rank = math.ceil(round(percent * len(sorted_values) / 100.0, 6))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def summarize(latencies, ops, elapsed, batch):
+    """Turn raw nanosecond latencies into the reported statistics (latencies in microseconds)."""
+    latencies = sorted(latencies)
+    result = {
+        'ops': ops,
+        'seconds': round(elapsed, 6),
+        'ops_per_sec': round(ops / elapsed, 1) if elapsed else 0.0,
+        'values_per_sec': round(ops * batch / elapsed, 1) if elapsed else 0.0,
+    }
+    for name, percent in PERCENTILES.items():
+        result[name + '_us'] = round(percentile(latencies, percent) / 1000.0, 2)
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of human-readable regressions of results against baseline."""
+    regressions = []
+    for scenario, expected in baseline.get('results', {}).items():
+        actual = results.get(scenario)
+        if not actual or 'ops_per_sec' not in expected:
+            continue
+        if actual['ops_per_sec'] < expected['ops_per_sec'] * (1 - tolerance):
+            regressions.append('{}: ops_per_sec {} < baseline {}'.format(
+                scenario, actual['ops_per_sec'], expected['ops_per_sec']))
+        if actual['p99_us'] > expected['p99_us'] * (1 + tolerance) + LATENCY_NOISE_US:
+            regressions.append('{}: p99_us {} > baseline {}'.format(
+                scenario, actual['p99_us'], expected['p99_us']))
+    return regressions
+
+
+def _run_worker(connection, tags, ops, read_ratio, batch, seed, barrier, output):
+    connector = ConnectorFactory.build(connection)
+    rng = random.Random(seed)
+    latencies = array('q')
+    clock = time.perf_counter_ns
+
+    # touch the backend once so lazy connections are not billed to the first op
+    connector.get(tags[0])
+    barrier.wait()
+    started = time.monotonic()
+    for _ in range(ops):
+        is_read = rng.random() < read_ratio
+        if batch > 1:
+            keys = rng.sample(tags, batch)
+            if is_read:
+                begin = clock()
+                connector.get_many(keys)
+            else:
+                values = {key: rng.random() * 100 for key in keys}
+                begin = clock()
+                connector.set_many(values)
+        else:
+            key = rng.choice(tags)
+            if is_read:
+                begin = clock()
+                connector.get(key)
+            else:
+                value = rng.random() * 100
+                begin = clock()
+                connector.set(key, value)
+        latencies.append(clock() - begin)
+    finished = time.monotonic()
+
+    connector.flush()
+    connector.close()
+    output.append((started, finished, latencies))
+
+
+def _run_process(connection, tags, ops, read_ratio, batch, threads, seed, queue=None):
+    output = []
+    barrier = threading.Barrier(threads)
+    workers = [threading.Thread(target=_run_worker,
+                                args=(connection, tags, ops, read_ratio, batch, seed + i, barrier, output))
+               for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    if queue is None:
+        return output
+    queue.put([(started, finished, latencies.tobytes()) for started, finished, latencies in output])
+
+
+def run_scenario(connection, tag_count, ops, read_ratio, batch, threads, processes, seed=0):
+    tags = ['tag{}'.format(i) for i in range(tag_count)]
+    connector = ConnectorFactory.build(connection)
+    connector.initialize([(tag, 0.0) for tag in tags], clear_old=True)
+    connector.flush()
+    connector.close()
+
+    if processes <= 1:
+        output = _run_process(connection, tags, ops, read_ratio, batch, threads, seed)
+    else:
+        queue = multiprocessing.Queue()
+        children = [multiprocessing.Process(target=_run_process,
+                                            args=(connection, tags, ops, read_ratio, batch, threads,
+                                                  seed + i * threads, queue))
+                    for i in range(processes)]
+        for child in children:
+            child.start()
+        output = []
+        for _ in children:
+            for started, finished, raw in queue.get():
+                latencies = array('q')
+                latencies.frombytes(raw)
+                output.append((started, finished, latencies))
+        for child in children:
+            child.join()
+
+    if len(output) != threads * max(processes, 1):
+        raise RuntimeError('{} of {} benchmark workers failed'.format(
+            threads * max(processes, 1) - len(output), threads * max(processes, 1)))
+
+    elapsed = max(item[1] for item in output) - min(item[0] for item in output)
+    latencies = array('q')
+    for item in output:
+        latencies.extend(item[2])
+    return summarize(latencies, len(latencies), elapsed, batch)
+
+
+def run(args):
+    directory = tempfile.mkdtemp(prefix='icssim-benchmark-')
+    fake = None
+    memcache_address = args.memcache
+    if args.fake_memcache:
+        from benchmarks.fakeMemcached import FakeMemcached
+        fake = FakeMemcached(port=0).start()
+        memcache_address = fake.address
+
+    modes = ['bulk'] if args.bulk_only else (['single', 'bulk'] if args.bulk else ['single'])
+    results = {}
+    skipped = {}
+    try:
+        for backend in args.backends:
+            connection = make_connection(backend, directory, memcache_address)
+            for mode in modes:
+                scenario = '{}/{}'.format(backend, mode)
+                batch = min(args.batch, args.tags) if mode == 'bulk' else 1
+                try:
+                    results[scenario] = run_scenario(connection, args.tags, args.ops, args.read_ratio,
+                                                     batch, args.threads, args.processes, args.seed)
+                except Exception as e:
+                    skipped[scenario] = '{}: {}'.format(type(e).__name__, e)
+    finally:
+        if fake:
+            fake.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return {
+        'config': {
+            'tags': args.tags,
+            'ops_per_worker': args.ops,
+            'read_ratio': args.read_ratio,
+            'batch': args.batch,
+            'threads': args.threads,
+            'processes': args.processes,
+            'python': sys.version.split()[0],
+        },
+        'results': results,
+        'skipped': skipped,
+    }
+
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser(description='Connector backend benchmark')
+
+    parser.add_argument('--backends', type=lambda s: s.split(','), default=BACKENDS,
+                        help='comma separated backends to run (default: all)')
+    parser.add_argument('--tags', type=int, default=32, help='number of tags in the store')
+    parser.add_argument('--ops', type=int, default=10000, help='operations per worker')
+    parser.add_argument('--read_ratio', type=float, default=0.8, help='fraction of operations that are reads')
+    parser.add_argument('--threads', type=int, default=1, help='worker threads per process')
+    parser.add_argument('--processes', type=int, default=1, help='worker processes')
+    parser.add_argument('--bulk', action='store_true', help='also run get_many/set_many scenarios')
+    parser.add_argument('--bulk_only', action='store_true', help='only run get_many/set_many scenarios')
+    parser.add_argument('--batch', type=int, default=16, help='tags per bulk operation')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--memcache', default='127.0.0.1:11211', help='memcached address')
+    parser.add_argument('--fake_memcache', action='store_true',
+                        help='run memcache scenarios against an in-process fake memcached')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    parser.add_argument('--baseline', help='baseline JSON report to compare against')
+    parser.add_argument('--update_baseline', action='store_true', help='overwrite --baseline with this run')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='allowed relative slowdown before a scenario counts as a regression')
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = get_args(argv)
+    report = run(args)
+
+    exit_code = 0
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+    elif args.baseline:
+        with open(args.baseline) as file:
+            report['regressions'] = compare(report['results'], json.load(file), args.tolerance)
+        exit_code = 1 if report['regressions'] else 0
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text)
+    print(text)
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
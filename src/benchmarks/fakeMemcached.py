@@ -0,0 +1,104 @@
+import socketserver
+import threading
+
+
+class FakeMemcached(socketserver.ThreadingTCPServer):
+    """In-process stand-in for memcached speaking the subset of the text protocol
+    used by python-memcached (get/gets, set/add/replace, delete, incr/decr,
+    flush_all, version), so memcache benchmarks and tests can run offline.
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=11211):
+        super().__init__((host, port), _Handler)
+        self.data = {}
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def address(self):
+        return '{}:{}'.format(*self.server_address)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    # replies are written line by line, like memcached itself they must not wait for Nagle
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        server = self.server
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+
+            parts = line.split()
+            if not parts:
+                continue
+
+            command = parts[0]
+            if command in (b'get', b'gets'):
+                self.wfile.write(self.__get(server, parts[1:]))
+            elif command in (b'set', b'add', b'replace'):
+                self.__store(server, command, parts)
+            elif command == b'delete':
+                with server.lock:
+                    found = server.data.pop(parts[1], None) is not None
+                if parts[-1] != b'noreply':
+                    self.wfile.write(b'DELETED\r\n' if found else b'NOT_FOUND\r\n')
+            elif command in (b'incr', b'decr'):
+                self.wfile.write(self.__incr(server, command, parts) + b'\r\n')
+            elif command == b'flush_all':
+                with server.lock:
+                    server.data.clear()
+                self.wfile.write(b'OK\r\n')
+            elif command == b'version':
+                self.wfile.write(b'VERSION fake\r\n')
+            else:
+                self.wfile.write(b'ERROR\r\n')
+
+    @staticmethod
+    def __get(server, keys):
+        response = []
+        with server.lock:
+            for key in keys:
+                if key in server.data:
+                    flags, value = server.data[key]
+                    response.append(b'VALUE %s %d %d\r\n%s\r\n' % (key, flags, len(value), value))
+        response.append(b'END\r\n')
+        return b''.join(response)
+
+    def __store(self, server, command, parts):
+        key, flags, size = parts[1], int(parts[2]), int(parts[4])
+        value = self.rfile.read(size + 2)[:-2]
+        with server.lock:
+            exists = key in server.data
+            stored = command == b'set' or (command == b'add') != exists
+            if stored:
+                server.data[key] = (flags, value)
+        if parts[-1] != b'noreply':
+            self.wfile.write(b'STORED\r\n' if stored else b'NOT_STORED\r\n')
+
+    @staticmethod
+    def __incr(server, command, parts):
+        with server.lock:
+            if parts[1] not in server.data:
+                return b'NOT_FOUND'
+            flags, value = server.data[parts[1]]
+            delta = int(parts[2]) if command == b'incr' else -int(parts[2])
+            value = str(max(int(value) + delta, 0)).encode()
+            server.data[parts[1]] = (flags, value)
+            return value
+
+
+if __name__ == '__main__':
+    FakeMemcached().serve_forever()
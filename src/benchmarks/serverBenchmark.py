@@ -0,0 +1,142 @@
+"""Throughput and PLC scan jitter of the Modbus server engines under client load.
+
+    python -m benchmarks.serverBenchmark --clients 4 --connections 16 --seconds 5
+
+For every engine of ProtocolFactory.create_server a server is started in this
+process next to a simulated PLC scan loop (fixed period, a few register
+reads/writes per scan), while client processes hammer it with block reads
+over many connections, the way the DDoS agents do. The scan loop's lateness
+against its deadlines (what Runnable.get_loop_latency() reports for a PLC) is
+reported idle and under load, together with the requests per second the
+server sustained and the server's own request service time (Server.stats()).
+"""
+import argparse
+import json
+import multiprocessing
+import sys
+import threading
+import time
+from array import array
+
+from benchmarks.connectorBenchmark import percentile
+from ics_sim.protocol import ClientModbus, ModbusConnectionPool, ProtocolFactory
+from ics_sim.scheduler import ScanScheduler
+
+PROTOCOL = 'ModbusWriteRequest-TCP'
+ENGINES = [ProtocolFactory.ENGINE_THREADS, ProtocolFactory.ENGINE_ASYNCIO, ProtocolFactory.ENGINE_SHARDED,
+           ProtocolFactory.ENGINE_PROCESS]
+TAGS = list(range(8))
+
+
+def _client_process(ip, port, connections, stop_at, queue):
+    counts = []
+
+    def hammer():
+        # a pool of one per thread, so every thread holds its own socket
+        client = ClientModbus(ip, port, ModbusConnectionPool(max_connections=1))
+        requests = errors = 0
+        while time.monotonic() < stop_at:
+            try:
+                client.receive_many(TAGS)
+                requests += 1
+            except Exception:
+                errors += 1
+        client.close()
+        counts.append((requests, errors))
+
+    threads = [threading.Thread(target=hammer) for _ in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    queue.put((sum(item[0] for item in counts), sum(item[1] for item in counts)))
+
+
+def scan(server, period_ms, seconds):
+    """Run a PLC-like scan loop on server and return the lateness of every scan in nanoseconds."""
+    scheduler = ScanScheduler(period_ms)
+    lateness = array('q')
+    stop_at = scheduler.deadline + int(seconds * 1e9)
+    while scheduler.deadline < stop_at:
+        scheduler.wait()
+        lateness.append(scheduler.begin())
+        server.poll()
+        for tag_id in TAGS:
+            server.set(tag_id, server.get(tag_id) + 1)
+        server.publish()
+        scheduler.end()
+    return lateness
+
+
+def summarize_lateness(lateness):
+    lateness = sorted(lateness)
+    return {
+        'scans': len(lateness),
+        'p50_us': round(percentile(lateness, 50) / 1000, 1),
+        'p99_us': round(percentile(lateness, 99) / 1000, 1),
+        'max_us': round(lateness[-1] / 1000, 1) if lateness else 0.0,
+    }
+
+
+def run_engine(engine, port, clients, connections, seconds, period_ms, workers):
+    server = ProtocolFactory.create_server(PROTOCOL, '127.0.0.1', port, engine, workers)
+    server.start()
+    try:
+        idle = scan(server, period_ms, min(seconds, 1.0))
+
+        queue = multiprocessing.Queue()
+        stop_at = time.monotonic() + seconds
+        children = [multiprocessing.Process(target=_client_process,
+                                            args=('127.0.0.1', port, connections, stop_at, queue))
+                    for _ in range(clients)]
+        for child in children:
+            child.start()
+        loaded = scan(server, period_ms, seconds)
+        totals = [queue.get() for _ in children]
+        for child in children:
+            child.join()
+    finally:
+        server.stop()
+        # after stop() the worker processes of the sharded engines have sent their last report
+        stats = server.stats()
+        server.close()
+
+    requests = sum(item[0] for item in totals)
+    return {
+        'requests_per_sec': round(requests / seconds, 1),
+        'errors': sum(item[1] for item in totals),
+        'scan_idle': summarize_lateness(idle),
+        'scan_loaded': summarize_lateness(loaded),
+        'service_us': stats.get('latency_us', {}),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Modbus server engine benchmark')
+    parser.add_argument('--engines', type=lambda s: s.split(','), default=ENGINES)
+    parser.add_argument('--clients', type=int, default=4, help='client processes')
+    parser.add_argument('--connections', type=int, default=16, help='connections per client process')
+    parser.add_argument('--seconds', type=float, default=5.0, help='load duration per engine')
+    parser.add_argument('--period_ms', type=float, default=10.0, help='simulated PLC scan period')
+    parser.add_argument('--workers', type=int, help='worker processes of the sharded and process engines')
+    parser.add_argument('--port', type=int, default=5020)
+    args = parser.parse_args(argv)
+
+    report = {
+        'config': {
+            'clients': args.clients,
+            'connections': args.connections,
+            'seconds': args.seconds,
+            'period_ms': args.period_ms,
+            'workers': args.workers,
+        },
+        'results': {engine: run_engine(engine, args.port + i, args.clients, args.connections,
+                                       args.seconds, args.period_ms, args.workers)
+                    for i, engine in enumerate(args.engines)},
+    }
+    print(json.dumps(report, indent=2, sort_keys=True))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,10 @@
+import asyncio
+import heapq
 import multiprocessing
 import logging
+import logging.handlers
 import os
+import signal
 import sys
 import threading
 import time
@@ -8,18 +12,21 @@ import random
 from abc import ABC, abstractmethod
 from datetime import datetime
 
-from ics_sim.protocol import ProtocolFactory
+from ics_sim.protocol import ModbusError, ProtocolFactory, RegisterMap
 from ics_sim.configs import SpeedConfig
-from ics_sim.helper import current_milli_time, validate_type, current_milli_cycle_time
+from ics_sim.helper import current_milli_time, validate_type
+from ics_sim.logs import configure_logging, file_logger, flush_logging, forward_logging, is_headless
+from ics_sim.metrics import MetricsLog
+from ics_sim.scheduler import ScanScheduler
+from ics_sim.snapshots import FORMATS, SnapshotRecorder, string_format
 from ics_sim.connectors import ConnectorFactory
+from ics_sim.subscriptions import ChangePublisher, ChangeSubscriber, change_feed_path
+from ics_sim.tags import TagTable
 
 from multiprocessing import Process
-import logging
 
-logging.basicConfig(level=logging.DEBUG,
-                    filename='app.log',  # Specify your log file's path here
-                    filemode='a',  # 'w' will overwrite the log file each run; 'a' will append to the end of the log file
-                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
 
 class Physics(ABC):
     @abstractmethod
@@ -33,6 +40,15 @@ class Physics(ABC):
     def _get(self, tag):
         return self._connector.get(tag)
 
+    def _set_many(self, mapping):
+        return self._connector.set_many(mapping)
+
+    def _get_many(self, tags):
+        return self._connector.get_many(tags)
+
+    def _flush(self):
+        self._connector.flush()
+
 
 class SensorConnector(Physics):
     def __init__(self, connection):
@@ -47,47 +63,35 @@ class SensorConnector(Physics):
         #logging.debug(f"Entered read method in ics_sim/device.py with tag: {tag}")
         #logging.debug(f"Available sensor keys: {list(self._sensors.keys())}")  # Logs all sensor keys
         if tag in self._sensors.keys():
-            try:
-                # Log the initial values and types to identify issues.
-                #logging.debug(f"trying to get tag: {tag}")
-                initial_value = self._get(tag)
-                #logging.debug(f"tag retreived as: {initial_value}")
-                #logging.debug(f"trying to retreive sensor with sensors[tag]")
-                sensor_value = self._sensors[tag]
-                #logging.debug(f"retreived sensor_value: {sensor_value}")
-                #logging.debug(f"Tag: {tag}, Initial value: {initial_value}, Sensor value: {sensor_value}")
-                #logging.debug(f"Initial value type: {type(initial_value)}, Sensor value type: {type(sensor_value)}")
-
-                # Check if the values are numeric and not empty before converting.
-                """
-                if initial_value == '' or not initial_value.replace('.', '', 1).isdigit():
-                    logging.error(f"Invalid initial value for tag '{tag}': {initial_value}")
-                    return None
-                if sensor_value == '' or not sensor_value.replace('.', '', 1).isdigit():
-                    logging.error(f"Invalid sensor value for tag '{tag}': {sensor_value}")
-                    return None
-                """
-                # Convert values to float to ensure arithmetic operations can be performed.
-                #logging.debug(f"converting {initial_value} to float")
-                value = float(initial_value)
-                #logging.debug(f"new value: {value}")
-                #logging.debug(f"converting {sensor_value} to float")
-                sensor_multiplier = float(sensor_value)
-                #logging.debug(f"new value: {sensor_multiplier}")
-                
-                # Perform the calculation.
-                random_factor = random.uniform(-1 * value, value)
-                value += random_factor * sensor_multiplier
-
-                return value
-            except ValueError as e:
-                logging.error(f"ValueError for tag '{tag}': {e}")
-            except TypeError as e:
-                logging.error(f"TypeError for tag '{tag}': {e}")
-                logging.error(f"Attempted to process: Initial value: {initial_value} ({type(initial_value)}), Sensor value: {sensor_value} ({type(sensor_value)})")
+            return self._apply_fault(tag, self._get(tag))
         else:
             raise LookupError(f"Tag '{tag}' not found in sensor dictionary.")
 
+    def read_many(self, tags):
+        for tag in tags:
+            if tag not in self._sensors:
+                raise LookupError(f"Tag '{tag}' not found in sensor dictionary.")
+
+        return {tag: self._apply_fault(tag, value) for tag, value in self._get_many(tags).items()}
+
+    def _apply_fault(self, tag, initial_value):
+        sensor_value = self._sensors[tag]
+        try:
+            # Convert values to float to ensure arithmetic operations can be performed.
+            value = float(initial_value)
+            sensor_multiplier = float(sensor_value)
+
+            # Perform the calculation.
+            random_factor = random.uniform(-1 * value, value)
+            value += random_factor * sensor_multiplier
+
+            return value
+        except ValueError as e:
+            logger.error(f"ValueError for tag '{tag}': {e}")
+        except TypeError as e:
+            logger.error(f"TypeError for tag '{tag}': {e}")
+            logger.error(f"Attempted to process: Initial value: {initial_value} ({type(initial_value)}), Sensor value: {sensor_value} ({type(sensor_value)})")
+
 
 class ActuatorConnector(Physics):
     def __init__(self, connection):
@@ -98,14 +102,71 @@ class ActuatorConnector(Physics):
         self._actuators.append(tag)
 
     def write(self, tag, value):
-        logging.debug(f"Enter write method with tag: {tag} value: {value}")
+        logger.debug("Enter write method with tag: %s value: %s", tag, value)
 
         if tag in self._actuators:
             self._set(tag, value)
         else:
-            logging.error(f"error with tag: {tag} value: {value}")
+            logger.error(f"error with tag: {tag} value: {value}")
             raise LookupError()
 
+    def write_many(self, mapping):
+        for tag in mapping:
+            if tag not in self._actuators:
+                logger.error(f"error with tag: {tag} value: {mapping[tag]}")
+                raise LookupError()
+
+        self._set_many(mapping)
+
+    def flush(self):
+        self._flush()
+
+
+class ProcessImage:
+    """Per-scan snapshot of tag values, like the process image of a real PLC.
+
+    load() fills the image with one bulk read at the start of a scan, logic
+    reads are served from the image (tags not seen before are fetched on
+    first use and then kept in the image), writes update the image and are
+    buffered until commit() hands them to the writer in one bulk write.
+    """
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._values = {}
+        self._pending = {}
+
+    def load(self, tags=None):
+        tags = list(self._values) if tags is None else list(tags)
+        if tags:
+            self._values = self._reader(tags)
+
+    def get(self, tag):
+        if tag not in self._values:
+            self._values.update(self._reader([tag]))
+        return self._values[tag]
+
+    def get_many(self, tags):
+        missing = [tag for tag in tags if tag not in self._values]
+        if missing:
+            self._values.update(self._reader(missing))
+        return {tag: self._values[tag] for tag in tags}
+
+    def set(self, tag, value):
+        self._values[tag] = value
+        self._pending[tag] = value
+        return value
+
+    def set_many(self, mapping):
+        self._values.update(mapping)
+        self._pending.update(mapping)
+        return mapping
+
+    def commit(self):
+        if self._pending:
+            pending, self._pending = self._pending, {}
+            self._writer(pending)
+
 
 class Runnable(ABC):
     COLOR_RED = '\033[91m'
@@ -128,11 +189,15 @@ class Runnable(ABC):
         # self.__loop_process = Process(target=self.do_loop, args=())
         self.stop_event = threading.Event()
         self.__loop_process = threading.Thread(target=self.do_loop, args=(self.stop_event,))
+        # held for a whole scan, so stop() can wait for the scan in progress before releasing what it uses
+        self._scan_lock = threading.Lock()
+        self._scheduler = ScanScheduler(loop)
         self._last_loop_time = 0
         self._current_loop_time = 0
         self._start_time = 0
         self._last_logic_start = 0
         self._last_logic_end = 0
+        configure_logging()
         self._initialize_logger()
         self.__clear_scr = False
         self._std = sys.stdin.fileno()
@@ -153,32 +218,26 @@ class Runnable(ABC):
 
     @staticmethod
     def setup_logger(name, format_str, level=logging.INFO, file_dir ="./logs", file_ext =".log", write_mode="w"):
-        """To setup as many loggers as you want"""
-
-        """
-        logging.basicConfig(filename="./logs/log-" + self.__name +".log",
-                            format='[%(levelname)s] [%(asctime)s] %(message)s ',
-                            filemode='w')
-                            """
-        """To setup as many loggers as you want"""
-        if not os.path.exists(file_dir):
-            os.makedirs(file_dir)
-
-        file_path = os.path.join(file_dir,name) + file_ext
-        handler = logging.FileHandler(file_path, mode=write_mode)
-        handler.setFormatter(format_str)
-
-        # Let us Create an object
-        logger = logging.getLogger(name)
-
-        # Now we are going to Set the threshold of logger to DEBUG
-        logger.setLevel(level)
-        logger.addHandler(handler)
-        return logger
+        """To setup as many loggers as you want; the file is written off the calling thread (see LogPipeline)"""
+        return file_logger(name, format_str, level, file_dir, file_ext, write_mode)
 
     def name(self):
         return self.__name
 
+    def loop_cycle(self):
+        return self.__loop_cycle
+
+    def set_scan_timing(self, overrun=ScanScheduler.SKIP, spin_us=ScanScheduler.SPIN_US, tolerance_us=None):
+        """Choose what happens to deadlines a scan overruns and how close to them the loop busy-waits.
+
+        See ScanScheduler for the policies; spin_us=0 never busy-waits. Call before start().
+        """
+        self._scheduler = ScanScheduler(self.__loop_cycle, overrun, spin_us, tolerance_us)
+
+    def get_scan_stats(self):
+        """Cycle, late, overrun and missed deadline counters of the scan loop."""
+        return self._scheduler.stats()
+
     def start(self):
         self.__loop_process.start()
 
@@ -197,34 +256,37 @@ class Runnable(ABC):
 
     def do_loop(self, stop_event):
         try:
-            self.report("started", logging.INFO)
-            self._before_start()
-
-            self._start_time = self._current_loop_time = current_milli_cycle_time(self.__loop_cycle)
-            while not stop_event.is_set():
-
-                self._last_loop_time = self._current_loop_time
-                wait = self._last_loop_time + self.__loop_cycle - current_milli_time()
-
-                if wait > 0:
-                    time.sleep(wait / 1000)
-
-
-                self._current_loop_time = current_milli_cycle_time(self.__loop_cycle)
-                self._last_logic_start = current_milli_time()
-
-                self._pre_logic_update()
-                self._logic()
-                self._last_logic_end = current_milli_time()
-                self._post_logic_update()
+            self._start_loop()
+            while not stop_event.is_set() and self._scheduler.wait(stop_event):
+                self._scan()
         except Exception as e:
-            self.report(e.__str__(), logging.fatal)
+            self.report(e.__str__(), logging.FATAL)
             raise e
 
-
-        except Exception as e:
-            self.report(e.__str__(), logging.fatal)
-            raise e
+    def _start_loop(self):
+        self.report("started", logging.INFO)
+        self._before_start()
+        self._scheduler.start()
+        self._start_time = self._current_loop_time = current_milli_time()
+
+    def _scan(self):
+        with self._scan_lock:
+            if self.stop_event.is_set():
+                return
+            self._begin_scan()
+            self._pre_logic_update()
+            self._logic()
+            self._last_logic_end = time.monotonic_ns()
+            self._post_logic_update()
+            self._scheduler.end()
+
+    def _begin_scan(self):
+        scheduler = self._scheduler
+        scheduler.begin()
+        self._last_logic_start = scheduler.scan_start
+        # the scheduled (not the actual) start, so scans are exactly loop_cycle apart on this clock
+        self._last_loop_time = self._current_loop_time
+        self._current_loop_time = self._start_time + (scheduler.due - scheduler.origin) // 1000000
 
     def _before_start(self):
         sys.stdin = os.fdopen(self._std)
@@ -241,15 +303,19 @@ class Runnable(ABC):
             os.system('clear')
 
     def get_loop_latency(self):
-        return self._last_logic_start - self._last_loop_time - self.__loop_cycle
+        """Milliseconds the last scan started after its deadline."""
+        return self._scheduler.lateness / 1e6
 
     def get_alive_time(self):
         return self._current_loop_time - self._start_time
 
     def get_logic_execution_time(self):
-        return self._last_logic_end - self._last_logic_start 
+        """Milliseconds the last scan spent in _pre_logic_update and _logic."""
+        return (self._last_logic_end - self._last_logic_start) / 1e6
 
     def report(self, msg, level=logging.NOTSET):
+        if level != logging.NOTSET and not self._logger.isEnabledFor(level):
+            return
         name_msg = "[{}] {}".format(self.name(), msg)
 
         if level == logging.NOTSET:
@@ -278,17 +344,264 @@ class Runnable(ABC):
     def __show_console(self, msg):
         timestamp = self._make_text( datetime.now().strftime("%H:%M:%S"), self.COLOR_PURPLE)
         name = self._make_text(self.name(), self.COLOR_CYAN)
-        print('[{} - {}]\t{}'.format(name, timestamp, msg), flush=True)
+        # headless output goes to files or pipes, let them buffer
+        print('[{} - {}]\t{}'.format(name, timestamp, msg), flush=not is_headless())
 
     @staticmethod
     def _make_text(msg, color):
+        if is_headless():
+            return msg
         return color + msg + '\033[0m'
 
+class AsyncRunnable(Runnable, ABC):
+    """Runnable whose loop is a coroutine, so many devices can share one event loop.
+
+    Await run() (or gather several of them) on an existing loop, or call
+    start() to run the device on its own thread and loop like a Runnable.
+    _logic may be a plain method or a coroutine.
+    """
+
+    def do_loop(self, stop_event):
+        asyncio.run(self.run())
+
+    async def run(self):
+        try:
+            self._start_loop()
+            while not self.stop_event.is_set():
+                # always yield so devices sharing the loop get their turn; never spin, that would block them
+                await asyncio.sleep(max(self._scheduler.remaining(), 0) / 1e9)
+                if self.stop_event.is_set():
+                    break
+
+                self._begin_scan()
+                self._pre_logic_update()
+                result = self._logic()
+                if asyncio.iscoroutine(result):
+                    await result
+                self._last_logic_end = time.monotonic_ns()
+                self._post_logic_update()
+                self._scheduler.end()
+        except Exception as e:
+            self.report(e.__str__(), logging.FATAL)
+            raise e
+
+
+class RunnableExecutor:
+    """Runs many Runnables on one thread instead of a thread each.
+
+    Every device keeps its own loop cycle, overrun policy and lifecycle
+    (_before_start, the per-scan hooks, stop()). A heap ordered by the next
+    deadline picks the scan to run, so the cost of a scan does not grow with
+    the number of devices and there is no thread switching or GIL handover
+    between them. Scans never overlap: a long scan delays the devices due
+    meanwhile, which shows in their get_scan_stats(). A device whose scan
+    raises is reported and dropped, the others keep running.
+
+    Add the devices and start() the executor instead of the devices;
+    AsyncRunnable devices share a loop through run() instead.
+    """
+
+    def __init__(self, name='executor', spin_us=ScanScheduler.SPIN_US):
+        self.name = name
+        self._spin = int(spin_us * 1000)
+        self._devices = []
+        self.stop_event = threading.Event()
+        self._thread = threading.Thread(target=self.run, name=name)
+
+    def add(self, device):
+        self._devices.append(device)
+        return device
+
+    def devices(self):
+        return list(self._devices)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        for device in self._devices:
+            if not device.stop_event.is_set():
+                device.stop()
+        self.stop_event.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def run(self):
+        heap = []
+        for index, device in enumerate(self._devices):
+            try:
+                device._start_loop()
+            except Exception as e:
+                device.report(e.__str__(), logging.FATAL)
+                continue
+            heap.append((device._scheduler.deadline, index, device))
+        heapq.heapify(heap)
+
+        stop_event = self.stop_event
+        while heap and not stop_event.is_set():
+            deadline, index, device = heap[0]
+            if device.stop_event.is_set():
+                heapq.heappop(heap)
+                continue
+
+            wait = deadline - time.monotonic_ns()
+            if wait > self._spin:
+                stop_event.wait((wait - self._spin) / 1e9)
+                continue
+            while time.monotonic_ns() < deadline:
+                pass
+
+            try:
+                device._scan()
+            except Exception as e:
+                device.report(e.__str__(), logging.FATAL)
+                heapq.heappop(heap)
+                continue
+            heapq.heapreplace(heap, (device._scheduler.deadline, index, device))
+
+
+def _run_runnable(factory, args, kwargs, setup, cpus, stop, log_queue, parent_pid):
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    # the parent decides when to stop (Ctrl-C reaches the whole process group)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    forward_logging(log_queue)
+
+    device = factory(*args, **kwargs)
+    if setup is not None:
+        setup(device)
+
+    def watch():
+        while not stop.wait(RunnableProcess.STOP_POLL_INTERVAL):
+            if os.getppid() != parent_pid:
+                break
+        device.stop()
+
+    threading.Thread(target=watch, name='stop-watch', daemon=True).start()
+    try:
+        device.do_loop(device.stop_event)
+    finally:
+        # multiprocessing children skip atexit, write the device's own log files now
+        flush_logging()
+
+
+class _ForwardHandler(logging.Handler):
+    """Hands records that come from a device process to the logger of the same name in this process."""
+    def emit(self, record):
+        target = logging.getLogger(record.name)
+        if target.isEnabledFor(record.levelno):
+            target.handle(record)
+
+
+class RunnableProcess:
+    """Runs a Runnable in a process of its own, optionally pinned to cpu_affinity.
+
+    The device is built in the child by factory(*args, **kwargs), so its
+    sockets, servers and connectors never cross the process boundary;
+    setup(device) (a module level function or a method, it is pickled) runs
+    before the loop, e.g. PLC1.enable_change_feed. stop() signals the child
+    through a multiprocessing Event and waits for device.stop() to finish;
+    the child also stops when this process dies. Log records of the child go
+    through a queue to the loggers of the same name here, so app.log has one
+    writer.
+    """
+    STOP_POLL_INTERVAL = 0.1
+    STOP_TIMEOUT = 10.0
+
+    def __init__(self, factory, args=(), kwargs=None, setup=None, cpu_affinity=None, name=None):
+        self.factory = factory
+        self.args = tuple(args)
+        self.kwargs = dict(kwargs or {})
+        self.setup = setup
+        self.cpu_affinity = list(cpu_affinity or [])
+        self.name = name or getattr(factory, '__name__', 'device')
+        self._process = None
+        self._stop = None
+        self._listener = None
+
+    def start(self):
+        if self._process is not None:
+            return
+        log_queue = multiprocessing.Queue()
+        self._listener = logging.handlers.QueueListener(log_queue, _ForwardHandler())
+        self._listener.start()
+        self._stop = multiprocessing.Event()
+        # not a daemon, devices may start processes of their own (sharded Modbus servers)
+        self._process = multiprocessing.Process(
+            target=_run_runnable, name=self.name,
+            args=(self.factory, self.args, self.kwargs, self.setup, self.cpu_affinity, self._stop, log_queue,
+                  os.getpid()))
+        self._process.start()
+
+    def is_alive(self):
+        return self._process is not None and self._process.is_alive()
+
+    @property
+    def exitcode(self):
+        return None if self._process is None else self._process.exitcode
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        if self._listener is None:
+            return
+        self._stop.set()
+        self._process.join(timeout)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+        self._listener.stop()
+        self._listener = None
+
+
 class HIL(Runnable, Physics, ABC):
     @abstractmethod
     def __init__(self, name, connection, loop=SpeedConfig.PROCESS_PERIOD):
         Runnable.__init__(self, name, loop)
         Physics.__init__(self, connection)
+        self._image = None
+
+    def set_scan_image(self, value):
+        """Serve _get/_set from a per-scan snapshot of the storage (opt-in)."""
+        if value and self._image is None:
+            self._image = ProcessImage(self._connector.get_many, self._connector.set_many)
+        elif not value and self._image is not None:
+            self._image.commit()
+            self._image = None
+
+    def _get(self, tag):
+        if self._image is not None:
+            return self._image.get(tag)
+        return Physics._get(self, tag)
+
+    def _set(self, tag, value):
+        if self._image is not None:
+            return self._image.set(tag, value)
+        return Physics._set(self, tag, value)
+
+    def _get_many(self, tags):
+        if self._image is not None:
+            return self._image.get_many(tags)
+        return Physics._get_many(self, tags)
+
+    def _set_many(self, mapping):
+        if self._image is not None:
+            return self._image.set_many(mapping)
+        return Physics._set_many(self, mapping)
+
+    def _pre_logic_update(self):
+        Runnable._pre_logic_update(self)
+        if self._image is not None:
+            self._image.load()
+
+    def _post_logic_update(self):
+        Runnable._post_logic_update(self)
+        if self._image is not None:
+            self._image.commit()
+        self._flush()
+
+    def _after_stop(self):
+        Runnable._after_stop(self)
+        self._flush()
 
 
 class DcsComponent(Runnable):
@@ -297,7 +610,12 @@ class DcsComponent(Runnable):
         Runnable.__init__(self, name,  loop)
         self.plcs = plcs
         self.tags = tags
+        self._tag_table = TagTable(tags)
+        self._tag_index = self._tag_table.index
         self.clients = {}
+        self.register_maps = {}
+        self._change_feeds = {}
+        self._write_buffer = None
         self.__init_clients()
 
     def __init_clients(self):
@@ -308,31 +626,152 @@ class DcsComponent(Runnable):
             #logging.debug(f"retreived plc id {plc}")
             #logging.debug(f"Attempting to create Modbus client at IP: {plc['ip']} and Port: {plc['port']}")
 
-            self.clients[plc_id] = (ProtocolFactory.create_client(plc['protocol'], plc['ip'], plc['port']))
+            self.register_maps[plc_id] = RegisterMap(self.tags, plc_id)
+            self.clients[plc_id] = ProtocolFactory.create_client(plc['protocol'], plc['ip'], plc['port'],
+                                                                 register_map=self.register_maps[plc_id])
 
     def _send(self, tag, value):
-        tag_id = self.tags[tag]['id']
-        plc_id = self.tags[tag]['plc']
-        self.clients[plc_id].send(tag_id, value)
+        if self._write_buffer is not None:
+            self._write_buffer[tag] = value
+            return
+
+        index = self._tag_index[tag]
+        tag_id = self._tag_table.ids[index]
+        plc_id = self._tag_table.plcs[index]
+        try:
+            self.clients[plc_id].send(tag_id, value)
+        except (OSError, ModbusError) as e:
+            # an unreachable peer must not stop the scan loop
+            self.report('writing {} to PLC {} failed: {}'.format(tag, plc_id, e), logging.ERROR)
+
+    def _send_many(self, mapping):
+        """Send many remote tags with one coalesced block write per PLC."""
+        requests = {}
+        for tag, value in mapping.items():
+            index = self._tag_index[tag]
+            requests.setdefault(self._tag_table.plcs[index], {})[self._tag_table.ids[index]] = value
+
+        for plc_id, values in requests.items():
+            self.clients[plc_id].send_many(values)
+
+    def set_write_batching(self, value):
+        """Buffer remote writes during _logic and send them as block writes at the end of the scan.
+
+        Reads of a buffered tag return the buffered value until it is flushed.
+        Writes to a PLC that cannot be reached stay buffered and are retried
+        the next scan. Turning batching off flushes the buffer first.
+        """
+        if value:
+            if self._write_buffer is None:
+                self._write_buffer = {}
+            return
+        if self._write_buffer:
+            self._flush_writes()
+            if self._write_buffer:
+                self.report('dropping unsent writes of {}'.format(sorted(self._write_buffer)), logging.ERROR)
+        self._write_buffer = None
+
+    def _flush_writes(self):
+        if not self._write_buffer:
+            return
+        pending, self._write_buffer = self._write_buffer, {}
+        table = self._tag_table
+        requests = {}
+        for tag, value in pending.items():
+            requests.setdefault(table.plcs[self._tag_index[tag]], {})[tag] = value
+
+        for plc_id, mapping in requests.items():
+            try:
+                self._send_many(mapping)
+            except OSError as e:
+                self.report('writing {} to PLC {} failed, retrying next scan: {}'.format(sorted(mapping), plc_id, e),
+                            logging.ERROR)
+                for tag, value in mapping.items():
+                    # values written during the scan are newer
+                    self._write_buffer.setdefault(tag, value)
+            except (ModbusError, ValueError) as e:
+                self.report('writing {} to PLC {} failed: {}'.format(sorted(mapping), plc_id, e), logging.ERROR)
+
+    def _post_logic_update(self):
+        Runnable._post_logic_update(self)
+        self._flush_writes()
 
     def _receive(self, tag):
+        if self._write_buffer and tag in self._write_buffer:
+            return self._write_buffer[tag]
 
-        tag_id = self.tags[tag]['id']
-        plc_id = self.tags[tag]['plc']
+        index = self._tag_index[tag]
+        tag_id = self._tag_table.ids[index]
+        plc_id = self._tag_table.plcs[index]
 
-        return self.clients[plc_id].receive(tag_id)
+        feed = self._change_feeds.get(plc_id)
+        if feed is not None and feed.is_fresh():
+            value = feed.get(tag_id)
+            if value is not None:
+                return value
+
+        try:
+            return self.clients[plc_id].receive(tag_id)
+        except (OSError, ModbusError) as e:
+            self.report('reading {} from PLC {} failed: {}'.format(tag, plc_id, e), logging.ERROR)
+            return None
+
+    def _receive_many(self, tags):
+        """Receive many remote tags with one coalesced block read per PLC."""
+        table = self._tag_table
+        values = {}
+        requests = {}
+        for tag in tags:
+            if self._write_buffer and tag in self._write_buffer:
+                values[tag] = self._write_buffer[tag]
+                continue
+            index = self._tag_index[tag]
+            plc_id = table.plcs[index]
+            feed = self._change_feeds.get(plc_id)
+            if feed is not None and feed.is_fresh():
+                value = feed.get(table.ids[index])
+                if value is not None:
+                    values[tag] = value
+                    continue
+            requests.setdefault(plc_id, []).append(tag)
+
+        for plc_id, plc_tags in requests.items():
+            received = self.clients[plc_id].receive_many([self._get_tag_id(tag) for tag in plc_tags])
+            for tag in plc_tags:
+                values[tag] = received[self._get_tag_id(tag)]
+
+        return {tag: values[tag] for tag in tags}
+
+    def follow_change_feed(self, plc_id, path=None, callback=None):
+        """Serve _receive for the tags of plc_id from the PLC's local change feed.
+
+        callback(seq, {tag_id: value}) is called for every received delta. While
+        the feed is not fresh (not yet subscribed, PLC gone) _receive falls back
+        to polling the PLC over the network.
+        """
+        if path is None:
+            path = change_feed_path(self.plcs[plc_id]['name'])
+        feed = ChangeSubscriber(path, callback)
+        feed.start()
+        self._change_feeds[plc_id] = feed
+
+    def _after_stop(self):
+        Runnable._after_stop(self)
+        for feed in self._change_feeds.values():
+            feed.stop()
+        self._change_feeds = {}
 
     def _is_input_tag(self, tag):
-        return self.tags[tag]['type'] == 'input'
+        return self._tag_table.inputs[self._tag_index[tag]]
 
     def _is_output_tag(self, tag):
-        return self.tags[tag]['type'] == 'output'
+        return self._tag_table.outputs[self._tag_index[tag]]
 
     def _get_tag_id(self, tag):
-        return self.tags[tag]['id']
+        return self._tag_table.ids[self._tag_index[tag]]
 
     def _get_tag_fault(self, tag):
-        return self.tags[tag]['fault']
+        return self._tag_table.faults[self._tag_index[tag]]
 
 
 class PLC(DcsComponent):
@@ -355,90 +794,176 @@ class PLC(DcsComponent):
         self.port = plcs[plc_id]['port']
         self.protocol = plcs[plc_id]['protocol']
 
+        table = self._tag_table
+        self._local_indices = table.local(plc_id)
+        self._local_input_indices = [i for i in table.local_inputs(plc_id) if table.stored[i]]
+        self._local_output_indices = table.local_outputs(plc_id)
+        # outputs mirrored to the actuators, the others only live in the server
+        self._stored_output_indices = [i for i in self._local_output_indices if table.stored[i]]
+        self._local_names = [table.names[i] for i in self._local_indices]
+        self._local_input_names = [table.names[i] for i in self._local_input_indices]
+        self._local_tags = frozenset(self._local_names)
+        self._stored_tags = frozenset(table.names[i] for i in self._local_indices if table.stored[i])
+        self.__local_outputs = {table.ids[i]: table.names[i] for i in self._stored_output_indices}
+
         self.__init_sensors()
         self.__init_actuators()
 
-        self.server = ProtocolFactory.create_server(self.protocol, self.ip, self.port)
+        plc = plcs[plc_id]
+        self.server = ProtocolFactory.create_server(
+            self.protocol, self.ip, self.port, plc.get('server_engine', ProtocolFactory.ENGINE_THREADS),
+            plc.get('workers'), plc.get('cpu_affinity'), self.register_maps[plc_id])
         self.report('creating the server on IP = {}:{}'.format(self.ip, self.port), logging.INFO)
 
-        self._snapshot_recorder = self.setup_logger("snapshots_" + self.name(), logging.Formatter('%(message)s'), file_ext=".csv")
-        self.__record_variables = False;
+        self._snapshot_recorder = None
+        self.__record_variables = False
+        self._image = None
+        self._change_publisher = None
+        self._output_seq = None
+        self._metrics_log = None
 
     def set_record_variables(self, value):
+        """Record timing and local tag values every scan to logs/snapshots_<name>/ (see ics_sim.snapshots)."""
         self.__record_variables = value
 
+    def set_scan_image(self, value):
+        """Serve local tags from a snapshot taken once per scan and write them back once per scan (opt-in).
+
+        A scan then costs one bulk read of the storage (loading the image) and
+        one bulk write (the outputs, in _store_received_values): committing the
+        image only updates the server, and the inputs the server gets at the
+        end of the scan are the ones already in the image.
+        """
+        if value and self._image is None:
+            self._image = ProcessImage(self._get_local_many, self._set_server_many)
+        elif not value and self._image is not None:
+            self._image.commit()
+            self._image = None
+
+    def set_delta_outputs(self, value):
+        """Only forward output registers that changed since the previous scan to the actuators.
+
+        Output tags written to the storage by other processes are then no
+        longer overwritten with the register value on every scan.
+        """
+        self._output_seq = 0 if value else None
+
+    def enable_change_feed(self, path=None):
+        """Publish register bank deltas once per scan on a local Unix socket (see DcsComponent.follow_change_feed)."""
+        if path is None:
+            path = change_feed_path(self.name())
+        self._change_publisher = ChangePublisher(self.server.changes, path)
+
+    def enable_server_metrics(self, interval=10.0, path=None):
+        """Append the Modbus server's request metrics (see ServerMetrics) to logs/ as JSON lines every interval seconds."""
+        if self._metrics_log is not None:
+            return
+        if path is None:
+            path = os.path.join('./logs', 'metrics-{}.jsonl'.format(self.name()))
+        self._metrics_log = MetricsLog(self.server.stats, path, interval, self.name())
+        self._metrics_log.start()
+
+    def _pre_logic_update(self):
+        DcsComponent._pre_logic_update(self)
+        self.server.poll()
+        if self._image is not None:
+            self._image.load(self._local_names)
 
     def _post_logic_update(self):
         DcsComponent._post_logic_update(self)
+        if self._image is not None:
+            self._image.commit()
         self._store_received_values()
+        self.server.publish()
+        if self._change_publisher is not None:
+            self._change_publisher.publish()
         if self.__record_variables:
             self._record_variables()
 
     def _store_received_values(self):
-        for tag_name, tag_data in self.tags.items():
-            if not self._is_local_tag(tag_name):
-                continue
+        names = self._tag_table.names
+        ids = self._tag_table.ids
 
-            if tag_data['type'] == 'output':
-                self._set(tag_name, self.server.get(tag_data['id']))
-            elif tag_data['type'] == 'input':
-                self.server.set(tag_data['id'], self._get(tag_name))
+        if self._output_seq is None:
+            outputs = {names[i]: self.server.get(ids[i]) for i in self._stored_output_indices}
+        else:
+            self._output_seq, changes = self.server.get_changes_since(self._output_seq)
+            outputs = {self.__local_outputs[tag_id]: value
+                       for tag_id, value in changes.items() if tag_id in self.__local_outputs}
 
-    def _record_variables(self, header=False):
-        snapshot = ""
+        if outputs:
+            self._actuator_connector.write_many(outputs)
 
-        if header:
-            snapshot += "time, current_loop, loop_latency, logic_execution_time, "
-        else:
-            snapshot += "{}, {}, {}, {}, ".format(
-                datetime.now(),
-                self._current_loop_time,
-                self.get_loop_latency(),
-                self.get_logic_execution_time()
-            )
-
-        for tag_name, tag_data in self.tags.items():
-            if not self._is_local_tag(tag_name):
-                continue
-            if header:
-                snapshot += "{}({}), ".format(tag_name, tag_data['id'])
+        if self._local_input_names:
+            if self._image is not None:
+                values = self._image.get_many(self._local_input_names)
             else:
-                snapshot += "{}, ".format(self._get(tag_name))
+                values = self._sensor_connector.read_many(self._local_input_names)
+            for i in self._local_input_indices:
+                self.server.set(ids[i], values[names[i]])
 
-        self._snapshot_recorder.info(snapshot)
+        self._actuator_connector.flush()
+
+    def _record_variables(self, header=False):
+        if header or self._snapshot_recorder is None:
+            self._snapshot_recorder = SnapshotRecorder(
+                os.path.join('./logs', 'snapshots_' + self.name()), self.__snapshot_columns(), name=self.name())
+            self.__snapshot_row = [0] * (4 + len(self._local_indices))
+            if header:
+                return
+
+        # the values the scan just left in the server, not another read of the storage
+        row = self.__snapshot_row
+        row[0] = time.time()
+        row[1] = self._current_loop_time
+        row[2] = self.get_loop_latency()
+        row[3] = self.get_logic_execution_time()
+        get = self.server.get
+        ids = self._tag_table.ids
+        for column, i in enumerate(self._local_indices, 4):
+            row[column] = get(ids[i])
+        self._snapshot_recorder.append(row)
+
+    def __snapshot_columns(self):
+        table = self._tag_table
+        columns = [('time', 'float64'), ('current_loop', 'int64'), ('loop_latency', 'float64'),
+                   ('logic_execution_time', 'float64')]
+        for i in self._local_indices:
+            tag = self.tags[table.names[i]]
+            datatype = tag.get('datatype')
+            if datatype == RegisterMap.STRING:
+                column_format = string_format(tag['length'])
+            elif datatype in FORMATS:
+                column_format = datatype
+            else:
+                # fixed point registers read back as floats
+                column_format = 'float64'
+            columns.append(('{}({})'.format(table.names[i], table.ids[i]), column_format))
+        return columns
 
     def __init_sensors(self):
-        for tag in self.tags:
-            if self._is_input_tag(tag):
-                logging.debug(f"adding sensor {tag}")
-                self._sensor_connector.add_sensor(tag, self._get_tag_fault(tag))
+        table = self._tag_table
+        for i, tag in enumerate(table.names):
+            if table.inputs[i] and table.stored[i]:
+                logger.debug("adding sensor %s", tag)
+                self._sensor_connector.add_sensor(tag, table.faults[i])
 
     def __init_actuators(self):
-        for tag in self.tags:
-            
-            if self._is_output_tag(tag):
-                logging.debug(f"adding actuator {tag}")
+        table = self._tag_table
+        for i, tag in enumerate(table.names):
+            if table.outputs[i] and table.stored[i]:
+                logger.debug("adding actuator %s", tag)
                 self._actuator_connector.add_actuator(tag)
 
-    import logging
-
     def _get(self, tag):
         #logging.debug(f"entered method _get on file ics_sim/Device.py ")
         #logging.debug(f"Attempting to retrieve value for tag: {tag}")
 
         if self._is_local_tag(tag):
             #logging.debug(f"Tag {tag} is a local tag.")
-            
-            if self._is_input_tag(tag):
-                #logging.debug(f"Tag {tag} is an input tag.")
-                value = self._sensor_connector.read(tag)
-                #logging.debug(f"Read value {value} from sensor for tag: {tag}")
-                return value
-            else:
-                tag_id = self._get_tag_id(tag)
-                value = self.server.get(tag_id)
-                #logging.debug(f"Retrieved value {value} from server for tag ID {tag_id} (Tag: {tag})")
-                return value
+            if self._image is not None:
+                return self._image.get(tag)
+            return self._get_local(tag)
         else:
             try:
                 value = self._receive(tag)
@@ -448,33 +973,104 @@ class PLC(DcsComponent):
                 #logging.warning(f"Failed to receive value for tag {tag}: {e}")
                 return None
 
+    def _get_local(self, tag):
+        if self._is_input_tag(tag) and tag in self._stored_tags:
+            #logging.debug(f"Tag {tag} is an input tag.")
+            value = self._sensor_connector.read(tag)
+            #logging.debug(f"Read value {value} from sensor for tag: {tag}")
+            return value
+        else:
+            tag_id = self._get_tag_id(tag)
+            value = self.server.get(tag_id)
+            #logging.debug(f"Retrieved value {value} from server for tag ID {tag_id} (Tag: {tag})")
+            return value
+
+    def _get_local_many(self, tags):
+        """Read local tags, fetching sensor inputs with a single bulk read."""
+        table = self._tag_table
+        values = dict.fromkeys(tags)
+        inputs = []
+        for tag in values:
+            index = self._tag_index[tag]
+            if table.inputs[index] and table.stored[index]:
+                inputs.append(tag)
+            else:
+                values[tag] = self.server.get(table.ids[index])
+
+        if inputs:
+            values.update(self._sensor_connector.read_many(inputs))
+        return values
+
+    def _get_many(self, tags):
+        local_tags = [tag for tag in tags if tag in self._local_tags]
+        if self._image is not None:
+            local_values = self._image.get_many(local_tags)
+        else:
+            local_values = self._get_local_many(local_tags)
+
+        remote_tags = [tag for tag in tags if tag not in local_values]
+        remote_values = {}
+        if remote_tags:
+            try:
+                remote_values = self._receive_many(remote_tags)
+            except Exception as e:
+                # like _get, remote tags that cannot be received read as None
+                self.report('reading {} failed: {}'.format(remote_tags, e), logging.ERROR)
+
+        return {tag: local_values[tag] if tag in local_values else remote_values.get(tag) for tag in tags}
 
     def _set(self, tag, value):
         #logging.debug(f"DEVICE Setting value for {tag}...")
         if self._is_local_tag(tag):
             #logging.debug("is local tag")
-            tagId = self._get_tag_id(tag)
-            logging.debug(f" INSERTING TEST tagid: {tagId} value: {value}")
-            self.server.set(self._get_tag_id(tag), value)
-            logging.debug(f"server.set successfull")
-            return self._actuator_connector.write(tag, value)
+            if self._image is not None:
+                return self._image.set(tag, value)
+            return self._set_local(tag, value)
         else:
             self._send(tag, value)
 
+    def _set_local(self, tag, value):
+        tagId = self._get_tag_id(tag)
+        logger.debug(" INSERTING TEST tagid: %s value: %s", tagId, value)
+        self.server.set(tagId, value)
+        logger.debug("server.set successfull")
+        if tag in self._stored_tags:
+            return self._actuator_connector.write(tag, value)
+
+    def _set_server_many(self, mapping):
+        """Set local tags in the server only; _store_received_values hands the outputs to the actuators."""
+        for tag, value in mapping.items():
+            self.server.set(self._get_tag_id(tag), value)
 
     def _is_local_tag(self, tag):
-        return self.tags[tag]['plc'] == self.id
+        if tag in self._local_tags:
+            return True
+        elif tag in self._tag_index:
+            return False
+        raise KeyError(tag)
 
     def _before_start(self):
         self.server.start()
-        for tag, value in self.tags.items():
-            if self._is_output_tag(tag) and self._is_local_tag(tag):
-                self._set(tag, value['default'])
-        self._record_variables(True)
+        for i in self._local_output_indices:
+            self._set(self._tag_table.names[i], self._tag_table.defaults[i])
+        self.server.publish()
+        if self.__record_variables:
+            self._record_variables(True)
 
     def stop(self):
         self.server.stop()
+        metrics_log, self._metrics_log = self._metrics_log, None
+        if metrics_log is not None:
+            metrics_log.stop()
         DcsComponent.stop(self)
+        with self._scan_lock:
+            # after the last scan: the shared memory of the sharded and process engines goes away
+            self.server.close()
+        if self._snapshot_recorder is not None:
+            self._snapshot_recorder.close()
+        publisher, self._change_publisher = self._change_publisher, None
+        if publisher is not None:
+            publisher.close()
 
     def _check_manual_input(self, control_tag, actuator_tag):
 
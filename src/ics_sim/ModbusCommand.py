@@ -1,11 +1,12 @@
+import logging
 from datetime import datetime
 
-from protocol import ClientModbus
+from protocol import ClientModbus, ModbusError
 
+logger = logging.getLogger(__name__)
 
-class ModbusCommand:
-    clients = dict()
 
+class ModbusCommand:
     command_write_multiple_registers = 16
     command_read_holding_registers = 3
 
@@ -25,14 +26,15 @@ class ModbusCommand:
             self.sip, self.dip, self.port, self.command, self.address, self.value, self.new_value ,self.time)
 
     def send_fake(self):
-        if not ModbusCommand.clients.keys().__contains__((self.dip, self.port)):
-            ModbusCommand.clients[(self.dip, self.port)] = ClientModbus(self.dip, self.port)
-
-        client = ModbusCommand.clients[(self.dip, self.port)]
+        # the connection itself comes from the process-wide pool
+        client = ClientModbus(self.dip, self.port)
 
-        if self.command == ModbusCommand.command_read_holding_registers:
-            client.receive(self.tag)
+        try:
+            if self.command == ModbusCommand.command_read_holding_registers:
+                client.receive(self.tag)
 
-        if self.command == ModbusCommand.command_write_multiple_registers:
-            client.send(self.tag, self.value)
+            if self.command == ModbusCommand.command_write_multiple_registers:
+                client.send(self.tag, self.value)
+        except (OSError, ModbusError) as e:
+            logger.warning('replaying %s to %s:%s failed: %s', self.command, self.dip, self.port, e)
 
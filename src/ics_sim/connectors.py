@@ -1,6 +1,13 @@
+import asyncio
+import fcntl
+import functools
 import os
 import logging
+import mmap
 import sqlite3
+import struct
+import threading
+import time
 import memcache
 from abc import abstractmethod, ABC
 from os.path import splitext
@@ -11,6 +18,9 @@ from ics_sim.helper import debug, error, validate_type
 import json
 
 from ics_sim.protocol import ClientModbus
+from ics_sim.subscriptions import ChangeLog
+
+logger = logging.getLogger(__name__)
 
 # Setup logging configuration
 #logging.basicConfig(level=logging.DEBUG,
@@ -25,6 +35,9 @@ class Connector(ABC):
         self._name = connection['name']
         self._path = connection['path']
         self._connection = connection
+        self._change_log = None
+        self._subscribers = []
+        self._polled_seq = 0
 
     @abstractmethod
     def initialize(self, values, clear_old=False):
@@ -38,40 +51,169 @@ class Connector(ABC):
     def get(self, key):
         pass
 
+    def get_many(self, keys):
+        """Return a dict of key -> value for all the given keys."""
+        return {key: self.get(key) for key in keys}
+
+    def set_many(self, mapping):
+        """Write all key -> value pairs of the mapping."""
+        for key, value in mapping.items():
+            self.set(key, value)
+
+    def flush(self):
+        """Push buffered writes to the backing store (no-op for write-through connectors)."""
+        pass
+
+    def keys(self):
+        """Return the names of all tags in the store."""
+        raise NotImplementedError()
+
+    def get_changes_since(self, seq):
+        """Return (latest_seq, {key: value}) for the tags changed after seq.
+
+        The default implementation diffs a bulk read of all tags against the
+        previous one; backends with a native change sequence override it.
+        """
+        if self._change_log is None:
+            self._change_log = ChangeLog()
+        self._change_log.record_many(self.get_many(self.keys()))
+        return self._change_log.get_changes_since(seq)
+
+    def subscribe(self, callback):
+        """Register callback(seq, changes), called by poll_changes() when tags changed."""
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def poll_changes(self):
+        seq, changes = self.get_changes_since(self._polled_seq)
+        self._polled_seq = seq
+        if changes:
+            for callback in list(self._subscribers):
+                callback(seq, changes)
+        return changes
+
+    def close(self):
+        pass
+
 
 class SQLiteConnector(Connector):
-    def __init__(self, connection):
+    """SQLite backed connector.
+
+    Every thread keeps one long-lived connection (WAL journal, autocommit) so a
+    tag access is a single statement execution; the query strings are built once
+    and served from sqlite3's prepared statement cache. A table created before
+    the change sequence existed gets its seq column when it is first opened.
+    """
+    BUSY_TIMEOUT = 1.0
+    STATEMENT_CACHE_SIZE = 32
+    MAX_QUERY_VARIABLES = 500
+
+    def __init__(self, connection, timeout=BUSY_TIMEOUT):
         Connector.__init__(self, connection)
         self._key = 'name'
         self._value = 'value'
+        self._timeout = timeout
+
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._generation = 0
+        self._migrated = False
+
+        self._seq = 'seq'
+
+        next_seq = '(SELECT COALESCE(MAX({0}), 0) + 1 FROM {1})'.format(self._seq, self._name)
+        self._get_query = 'SELECT {} FROM {} WHERE {} = ?'.format(self._value, self._name, self._key)
+        # only real changes advance the change sequence
+        self._set_query = 'UPDATE {0} SET {1} = ?, {2} = {3} WHERE {4} = ? AND {1} IS NOT ?'.format(
+            self._name, self._value, self._seq, next_seq, self._key)
+        self._insert_query = 'INSERT INTO {}({}, {}, {}) VALUES (?, ?, {})'.format(
+            self._name, self._key, self._value, self._seq, next_seq)
+        self._changes_query = 'SELECT {}, {}, {} FROM {} WHERE {} > ? ORDER BY {}'.format(
+            self._key, self._value, self._seq, self._name, self._seq, self._seq)
+        self._keys_query = 'SELECT {} FROM {}'.format(self._key, self._name)
+        self._get_many_queries = {}
         #logging.debug(f"Initializing SQLiteConnector with database path: {self._path}")
 
-        
+    def _get_connection(self):
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        if conn is not None and local.generation == self._generation and local.pid == os.getpid():
+            return conn
+
+        conn = sqlite3.connect(
+            self._path,
+            timeout=self._timeout,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self.STATEMENT_CACHE_SIZE)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout={}'.format(int(self._timeout * 1000)))
+        if not self._migrated:
+            self._migrate(conn)
+
+        with self._connections_lock:
+            self._connections.append(conn)
+            local.conn = conn
+            local.generation = self._generation
+            local.pid = os.getpid()
+        return conn
+
+    def _migrate(self, conn):
+        columns = [row[1] for row in conn.execute('PRAGMA table_info({})'.format(self._name))]
+        if columns and self._seq not in columns:
+            logger.debug("Adding the %s column to %s", self._seq, self._name)
+            try:
+                conn.execute('ALTER TABLE {} ADD COLUMN {} INTEGER NOT NULL DEFAULT 0'.format(self._name, self._seq))
+                conn.execute('CREATE INDEX IF NOT EXISTS {0}_{1} ON {0}({1})'.format(self._name, self._seq))
+            except sqlite3.OperationalError as e:
+                # another process added it first
+                if 'duplicate column' not in str(e):
+                    raise
+        # a table that does not exist yet is created with the column by initialize()
+        self._migrated = bool(columns)
+
+    def close(self):
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+            self._generation += 1
+
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.debug("Error closing sqlite connection: %s", e)
+
     def initialize(self, values, clear_old=True):
-        logging.debug("Initializing database schema...")
-        if clear_old and os.path.isfile(self._path):
-            os.remove(self._path)
+        logger.debug("Initializing database schema...")
+        if clear_old:
+            self.close()
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.isfile(self._path + suffix):
+                    os.remove(self._path + suffix)
             #logging.debug("Existing database file removed.")
-            
-            
 
         schema = """
-        CREATE TABLE IF NOT EXISTS {} (
-            {} TEXT NOT NULL,
-            {} REAL,
-            PRIMARY KEY({})
+        CREATE TABLE IF NOT EXISTS {0} (
+            {1} TEXT NOT NULL,
+            {2} REAL,
+            {3} INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY({1})
         );
-        """.format(self._name, self._key, self._value, self._key)
+        CREATE INDEX IF NOT EXISTS {0}_{3} ON {0}({3});
+        """.format(self._name, self._key, self._value, self._seq)
 
         try:
-            with sqlite3.connect(self._path) as conn:
-                conn.executescript(schema)
-                logging.debug("Database schema created.")
-                if values:
-                    init_template = "INSERT INTO {}({},{}) VALUES (?, ?);".format(self._name, self._key, self._value)
-                    cursor = conn.cursor()
-                    cursor.executemany(init_template, values)
-                    conn.commit()
+            conn = self._get_connection()
+            conn.executescript(schema)
+            logger.debug("Database schema created.")
+            if values:
+                with conn:
+                    conn.execute('BEGIN')
+                    conn.executemany(self._insert_query, values)
         except sqlite3.Error as e:
             error(f'Error initializing database: {e}')
             # Consider adding more sophisticated error handling here.
@@ -79,63 +221,210 @@ class SQLiteConnector(Connector):
 
     def set(self, key, value):
         #logging.debug(f"CONNECTORS Setting value for {key}...")
-        set_query = 'UPDATE {} SET {} = ? WHERE {} = ?'.format(
-            self._name,
-            self._value,
-            self._key)
-        with sqlite3.connect(self._path) as conn:
-            try:
-                cursor = conn.cursor()
-                cursor.execute(set_query, [value, key])
-                conn.commit()
-                #logging.debug(f"CONNECTORS Set value for {key} successfuly")
-                return value
+        try:
+            self._get_connection().execute(self._set_query, (value, key, value))
+            #logging.debug(f"CONNECTORS Set value for {key} successfuly")
+            return value
 
-            except sqlite3.Error as e:
-                logging.debug(f"Error Setting value for {key}")
-                error(f'_set in ICSSIM connection {e.args[0]} for setting tag {key}')
+        except sqlite3.Error as e:
+            logger.debug("Error Setting value for %s", key)
+            error(f'_set in ICSSIM connection {e.args[0]} for setting tag {key}')
 
-    
     def get(self, key):
-        get_query = """SELECT {} FROM {} WHERE {} = ?""".format(
-            self._value,
-            self._name,
-            self._key)
-        with sqlite3.connect(self._path) as conn:
-            try:
-                cursor = conn.cursor()
-                #logging.debug(f"cursor: {cursor}")
-                cursor.execute(get_query, [key])
-                record = cursor.fetchone()
-                return record[0]
-               
-            except sqlite3.Error as e:
-                logging.error(f"_get in ICSSIM connection {e.args[0]} for getting tag {key}")
-                
-        
+        try:
+            record = self._get_connection().execute(self._get_query, (key,)).fetchone()
+            return record[0]
+
+        except sqlite3.Error as e:
+            logger.error(f"_get in ICSSIM connection {e.args[0]} for getting tag {key}")
+
+    def _get_many_query(self, count):
+        query = self._get_many_queries.get(count)
+        if query is None:
+            query = 'SELECT {}, {} FROM {} WHERE {} IN ({})'.format(
+                self._key, self._value, self._name, self._key, ','.join('?' * count))
+            self._get_many_queries[count] = query
+        return query
+
+    def get_many(self, keys):
+        keys = list(keys)
+        result = dict.fromkeys(keys)
+        try:
+            conn = self._get_connection()
+            for start in range(0, len(keys), self.MAX_QUERY_VARIABLES):
+                chunk = keys[start:start + self.MAX_QUERY_VARIABLES]
+                result.update(conn.execute(self._get_many_query(len(chunk)), chunk).fetchall())
+        except sqlite3.Error as e:
+            logger.error(f"_get_many in ICSSIM connection {e.args[0]} for getting tags {keys}")
+        return result
+
+    def set_many(self, mapping):
+        if not mapping:
+            return mapping
+        try:
+            conn = self._get_connection()
+            with conn:
+                conn.execute('BEGIN')
+                conn.executemany(self._set_query, [(value, key, value) for key, value in mapping.items()])
+            return mapping
+
+        except sqlite3.Error as e:
+            logger.debug("Error Setting values for %s", list(mapping))
+            error(f'_set_many in ICSSIM connection {e.args[0]} for setting tags {list(mapping)}')
+
+    def keys(self):
+        return [record[0] for record in self._get_connection().execute(self._keys_query)]
+
+    def get_changes_since(self, seq):
+        changes = {}
+        try:
+            for key, value, key_seq in self._get_connection().execute(self._changes_query, (seq,)):
+                changes[key] = value
+                seq = key_seq
+        except sqlite3.Error as e:
+            logger.error(f"_get_changes_since in ICSSIM connection {e.args[0]}")
+        return seq, changes
+
+
 class MemcacheConnector(Connector):
+    """Memcached backed connector.
+
+    All connectors of a process share one client per server (python-memcache
+    clients keep their sockets per thread, so sharing is thread-safe), bulk
+    access is pipelined through get_multi/set_multi, and numbers are stored as
+    a type byte and a packed int64 or float64 instead of pickles, so ints come
+    back as ints (bools as ints). Keys live in a versioned namespace so
+    clearing the store is a counter bump instead of a daemon restart. The
+    namespace keeps a directory of its keys for keys(); the first write of a
+    key a connector has not seen yet adds it to the directory.
+    """
+    INT_FORMAT = struct.Struct('<cq')
+    FLOAT_FORMAT = struct.Struct('<cd')
+    INT_TYPE = b'q'
+    FLOAT_TYPE = b'd'
+    NAMESPACE_REFRESH = 1.0
+    KEYS_DIRECTORY = '__keys__'
+    DIRECTORY_RETRIES = 5
+
+    _clients = {}
+    _clients_lock = threading.Lock()
+
     def __init__(self, connection):
         Connector.__init__(self, connection)
         self._key = 'name'
         self._value = 'value'
-        self.memcached_client = memcache.Client([self._path], debug=0)
-
+        self.memcached_client = self._shared_client(self._path)
+        self._namespace_key = '{}:namespace'.format(self._name)
+        self._prefix = None
+        self._prefix_time = 0
+        # keys known to be in the directory of _directory_prefix
+        self._directory_keys = set()
+        self._directory_prefix = None
+
+    @classmethod
+    def _shared_client(cls, path):
+        key = (path, os.getpid())
+        with cls._clients_lock:
+            client = cls._clients.get(key)
+            if client is None:
+                client = memcache.Client([path], debug=0)
+                cls._clients[key] = client
+        return client
+
+    def _get_prefix(self, refresh=False):
+        now = time.monotonic()
+        if refresh or self._prefix is None or now - self._prefix_time > self.NAMESPACE_REFRESH:
+            version = self.memcached_client.get(self._namespace_key)
+            if version is None:
+                self.memcached_client.add(self._namespace_key, 1)
+                version = self.memcached_client.get(self._namespace_key) or 1
+            self._prefix = '{}:{}:'.format(self._name, version)
+            self._prefix_time = now
+        return self._prefix
+
+    def _encode(self, value):
+        if isinstance(value, float):
+            return self.FLOAT_FORMAT.pack(self.FLOAT_TYPE, value)
+        if isinstance(value, int):
+            try:
+                return self.INT_FORMAT.pack(self.INT_TYPE, value)
+            except struct.error:
+                # beyond int64, left to the client's pickling
+                pass
+        return value
+
+    def _decode(self, value):
+        if isinstance(value, bytes) and len(value) == self.FLOAT_FORMAT.size:
+            if value[:1] == self.FLOAT_TYPE:
+                return self.FLOAT_FORMAT.unpack(value)[1]
+            if value[:1] == self.INT_TYPE:
+                return self.INT_FORMAT.unpack(value)[1]
+        return value
 
     def initialize(self, values, clear_old=False):
+        values = dict(values)
         if clear_old:
-            os.system('/etc/init.d/memcached restart')
-
-        for key, value in values:
-            self.memcached_client.set(key, value)
+            old_prefix = self._get_prefix(refresh=True)
+            if self.memcached_client.incr(self._namespace_key) is None:
+                self.memcached_client.add(self._namespace_key, 1)
+            # readers still on the old namespace miss and refresh their prefix
+            self.memcached_client.delete_multi(list(values), key_prefix=old_prefix)
+            self._get_prefix(refresh=True)
+
+        self.set_many(values)
+
+    def keys(self):
+        return self._read_directory(self._get_prefix())
+
+    def _read_directory(self, prefix):
+        directory = self.memcached_client.get(prefix + self.KEYS_DIRECTORY)
+        return json.loads(directory) if directory else []
+
+    def _register_keys(self, prefix, keys):
+        if prefix != self._directory_prefix:
+            self._directory_keys = set()
+            self._directory_prefix = prefix
+        new_keys = set(keys) - self._directory_keys
+        if not new_keys:
+            return
+
+        # without cas a concurrent writer can replace the directory, so write until it is seen to hold the keys
+        for _ in range(self.DIRECTORY_RETRIES):
+            known = set(self._read_directory(prefix))
+            if new_keys <= known:
+                break
+            self.memcached_client.set(prefix + self.KEYS_DIRECTORY, json.dumps(sorted(known | new_keys)))
+        self._directory_keys |= known | new_keys
 
     def set(self, key, value):
-        self.memcached_client.set(key, value)
+        prefix = self._get_prefix()
+        self.memcached_client.set(prefix + key, self._encode(value))
+        if key not in self._directory_keys or prefix != self._directory_prefix:
+            self._register_keys(prefix, [key])
+        return value
 
     def get(self, key):
-        return self.memcached_client.get(key)
-
-    def __del__(self):
-        self.memcached_client.disconnect_all()
+        prefix = self._get_prefix()
+        value = self.memcached_client.get(prefix + key)
+        if value is None and self._get_prefix(refresh=True) != prefix:
+            value = self.memcached_client.get(self._prefix + key)
+        return self._decode(value)
+
+    def get_many(self, keys):
+        keys = list(keys)
+        prefix = self._get_prefix()
+        values = self.memcached_client.get_multi(keys, key_prefix=prefix)
+        if len(values) < len(keys) and self._get_prefix(refresh=True) != prefix:
+            values = self.memcached_client.get_multi(keys, key_prefix=self._prefix)
+        return {key: self._decode(values.get(key)) for key in keys}
+
+    def set_many(self, mapping):
+        prefix = self._get_prefix()
+        self.memcached_client.set_multi(
+            {key: self._encode(value) for key, value in mapping.items()},
+            key_prefix=prefix)
+        self._register_keys(prefix, mapping)
+        return mapping
 
 
 class HardwareConnector(Connector, ABC):
@@ -147,36 +436,304 @@ class HardwareConnector(Connector, ABC):
         self.__clientModbus = ClientModbus(self.__IP, self.__port)
 
     def get(self, key):
-        self.__clientModbus.receive(key)
+        return self.__clientModbus.receive(key)
 
     def set(self, key, value):
         self.__clientModbus.send(key, value)
 
 
 class FileConnector(Connector):
+    """JSON file connector with an in-memory, write-behind tag dictionary.
+
+    Writes are coalesced in memory and flushed atomically (temp file + rename)
+    at most every ``flush_interval`` seconds, or when flush() is called at a
+    cycle boundary. Reads only re-parse the file when its inode/mtime changed,
+    i.e. when another process flushed its own writes.
+    """
+    FLUSH_INTERVAL = 0.5
+
+    def __init__(self, connection, flush_interval=FLUSH_INTERVAL):
+        Connector.__init__(self, connection)
+        self._flush_interval = flush_interval
+        self._data = {}
+        self._pending = {}
+        self._file_stamp = None
+        self._last_flush = 0
+        self._lock = threading.RLock()
+
+    def initialize(self, values, clear_old=True):
+        with self._lock:
+            if clear_old or not os.path.isfile(self._path):
+                self._data = dict(values)
+                self._write()
+            else:
+                self._refresh()
+
+    def _stamp(self):
+        try:
+            stat = os.stat(self._path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _refresh(self):
+        stamp = self._stamp()
+        if stamp is None or stamp == self._file_stamp:
+            return
+
+        with open(self._path) as f:
+            data = json.load(f)
+        # our own writes that are not flushed yet win over the file content
+        data.update(self._pending)
+        self._data = data
+        self._file_stamp = stamp
+
+    def _write(self):
+        temp_path = '{}.{}.{}.tmp'.format(self._path, os.getpid(), id(self))
+        with open(temp_path, 'w') as f:
+            json.dump(self._data, f)
+        os.replace(temp_path, self._path)
+
+        self._file_stamp = self._stamp()
+        self._pending = {}
+        self._last_flush = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            self._refresh()
+            self._write()
+
+    def close(self):
+        self.flush()
+
+    def set(self, key, value):
+        self.set_many({key: value})
+        return value
+
+    def get(self, key):
+        with self._lock:
+            self._refresh()
+            return self._data[key]
+
+    def get_many(self, keys):
+        with self._lock:
+            self._refresh()
+            return {key: self._data[key] for key in keys}
+
+    def keys(self):
+        with self._lock:
+            self._refresh()
+            return list(self._data)
+
+    def set_many(self, mapping):
+        with self._lock:
+            self._data.update(mapping)
+            self._pending.update(mapping)
+            if time.monotonic() - self._last_flush >= self._flush_interval:
+                self.flush()
+        return mapping
+
+
+class SharedMemoryConnector(Connector):
+    """Memory mapped tag store for processes running on the same host.
+
+    Every tag owns a fixed float64 slot guarded by a sequence counter
+    (seqlock): writers make the counter odd while updating the value, readers
+    retry until they see the same even counter before and after the read.
+    Writers of all connectors and processes are serialized by an flock on
+    the store file (a seqlock allows one writer at a time), and a reader
+    gives up with TimeoutError after READ_RETRIES attempts. A counter left
+    odd by a writer that died mid-update is repaired by the next write.
+    Only numbers can be stored. Slots follow the order of the values given
+    to initialize().
+
+    Layout: header | JSON list of tag names | uint64 sequences | float64 values
+    """
+    MAGIC = b'ICSSHM01'
+    HEADER = struct.Struct('<8sIII12x')
+    STATE_LIVE = 1
+    STATE_RETIRED = 2
+    READ_RETRIES = 10000
+
     def __init__(self, connection):
         Connector.__init__(self, connection)
+        self._file = None
+        self._mm = None
+        self._state = None
+        self._seqs = None
+        self._values = None
+        self._slots = {}
+        self._write_lock = threading.Lock()
+
+    @staticmethod
+    def _layout(names):
+        directory = json.dumps(names).encode('utf-8')
+        directory += b' ' * (-len(directory) % 8)
+        seq_offset = SharedMemoryConnector.HEADER.size + len(directory)
+        value_offset = seq_offset + 8 * len(names)
+        return directory, seq_offset, value_offset, value_offset + 8 * len(names)
 
     def initialize(self, values, clear_old=True):
-        if not os.path.isfile(self._path):
-            f = open(self._path, "x")
-            obj = json.dumps(values)
-            f.write(obj)
+        values = list(values)
+        names = [key for key, value in values]
+        directory, seq_offset, value_offset, size = self._layout(names)
+
+        self._attach(required=False)
+        if self._mm is None or list(self._slots) != names:
+            if self._mm is not None:
+                # Tell processes still mapping the old file to re-attach
+                self._state[0] = self.STATE_RETIRED
+                self.close()
+
+            temp_path = self._path + '.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(self.HEADER.pack(self.MAGIC, self.STATE_LIVE, len(names), len(directory)))
+                f.write(directory)
+                f.write(bytes(size - self.HEADER.size - len(directory)))
+            os.replace(temp_path, self._path)
+            self._attach()
+        elif not clear_old:
+            return
+
+        self.set_many(dict(values))
+
+    def _attach(self, required=True):
+        if self._mm is not None:
+            if self._state[0] == self.STATE_LIVE:
+                return True
+            self.close()
+
+        try:
+            # kept open: writers lock it
+            f = open(self._path, 'r+b')
+        except FileNotFoundError:
+            if required:
+                logger.error(f"shared memory store {self._path} is not initialized")
+            return False
+        try:
+            mm = mmap.mmap(f.fileno(), 0)
+        except ValueError:
+            f.close()
+            if required:
+                logger.error(f"shared memory store {self._path} is not initialized")
+            return False
+
+        magic, state, count, directory_size = self.HEADER.unpack_from(mm, 0)
+        if magic != self.MAGIC:
+            mm.close()
             f.close()
+            raise ValueError(f'{self._path} is not an ICSSIM shared memory store')
+
+        names = json.loads(bytes(mm[self.HEADER.size:self.HEADER.size + directory_size]).decode('utf-8'))
+        directory, seq_offset, value_offset, size = self._layout(names)
+
+        buffer = memoryview(mm)
+        self._file = f
+        self._mm = mm
+        self._state = buffer[8:12].cast('I')
+        self._seqs = buffer[seq_offset:value_offset].cast('Q')
+        self._values = buffer[value_offset:size].cast('d')
+        self._slots = {name: slot for slot, name in enumerate(names)}
+        buffer.release()
+        return True
+
+    def _slot(self, key):
+        slot = self._slots.get(key)
+        if slot is None or self._state[0] != self.STATE_LIVE:
+            # the store may have been (re)initialized by another process
+            self.close()
+            self._attach()
+            slot = self._slots.get(key)
+        return slot
+
+    def keys(self):
+        self._attach()
+        return list(self._slots)
+
+    def close(self):
+        if self._mm is None:
+            return
+        self._state.release()
+        self._seqs.release()
+        self._values.release()
+        self._mm.close()
+        self._file.close()
+        self._file = self._mm = self._state = self._seqs = self._values = None
+        self._slots = {}
+
+    def _prepare(self, key, value):
+        slot = self._slot(key)
+        if slot is None:
+            error(f'_set in ICSSIM shared memory for unknown tag {key}')
+            return None, None
+
+        try:
+            return slot, float(value)
+        except (TypeError, ValueError):
+            error(f'_set in ICSSIM shared memory: {value!r} is not numeric for tag {key}')
+            return None, None
+
+    def _write(self, updates):
+        seqs = self._seqs
+        values = self._values
+        with self._write_lock:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                for slot, value in updates:
+                    # an odd counter here was left by a writer that died mid-update
+                    seq = seqs[slot] | 1
+                    seqs[slot] = seq
+                    values[slot] = value
+                    seqs[slot] = seq + 1
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def __updates(self, mapping):
+        updates = []
+        for key, value in mapping.items():
+            slot, value = self._prepare(key, value)
+            if slot is not None:
+                updates.append((slot, value))
+        return updates
 
     def set(self, key, value):
-        f = open(self._path, 'w')
-        data = json.load(f)
-        data[key] = value
-        obj = json.dumps(data)
-        f.write(obj)
-        f.close()
+        slot, value = self._prepare(key, value)
+        if slot is None:
+            return
+        self._write([(slot, value)])
+        return value
+
+    def set_many(self, mapping):
+        mm = self._mm
+        updates = self.__updates(mapping)
+        if self._mm is not mm:
+            # re-attached to a re-initialized store on the way, slots of the old one are stale
+            updates = self.__updates(mapping)
+        if updates:
+            self._write(updates)
+        return mapping
 
     def get(self, key):
-        f = open(self._path)
-        data = json.load(f)
-        f.close()
-        return data[key]
+        slot = self._slot(key)
+        if slot is None:
+            logger.error(f"_get in ICSSIM shared memory for unknown tag {key}")
+            return None
+
+        seqs = self._seqs
+        values = self._values
+        for _ in range(self.READ_RETRIES):
+            seq = seqs[slot]
+            if seq & 1:
+                # a writer is updating the slot, let it finish
+                time.sleep(0)
+                continue
+            value = values[slot]
+            if seqs[slot] == seq:
+                return value
+        raise TimeoutError(f'_get in ICSSIM shared memory: tag {key} is still being written '
+                           f'after {self.READ_RETRIES} reads')
 
 
 class ConnectorFactory:
@@ -208,6 +765,56 @@ class ConnectorFactory:
         elif connection['type'] == 'memcache':
             return MemcacheConnector(connection)
 
+        elif connection['type'] == 'shm':
+            return SharedMemoryConnector(connection)
+
         else:
             raise ValueError('Connection type is not supported')
 
+
+class AsyncConnector:
+    """asyncio facade over a Connector.
+
+    Blocking backends run in an executor so they never stall the event loop;
+    in-memory backends (shm) are fast enough to be called inline.
+    """
+    INLINE_CONNECTORS = (SharedMemoryConnector,)
+
+    def __init__(self, connector, executor=None):
+        self.connector = connector
+        self._executor = executor
+        self._inline = isinstance(connector, self.INLINE_CONNECTORS)
+
+    @staticmethod
+    def build(connection, executor=None):
+        return AsyncConnector(ConnectorFactory.build(connection), executor)
+
+    async def _call(self, function, *args):
+        if self._inline:
+            return function(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(function, *args))
+
+    async def initialize(self, values, clear_old=False):
+        return await self._call(self.connector.initialize, values, clear_old)
+
+    async def set(self, key, value):
+        return await self._call(self.connector.set, key, value)
+
+    async def get(self, key):
+        return await self._call(self.connector.get, key)
+
+    async def set_many(self, mapping):
+        return await self._call(self.connector.set_many, mapping)
+
+    async def get_many(self, keys):
+        return await self._call(self.connector.get_many, list(keys))
+
+    async def get_changes_since(self, seq):
+        return await self._call(self.connector.get_changes_since, seq)
+
+    async def flush(self):
+        return await self._call(self.connector.flush)
+
+    async def close(self):
+        return await self._call(self.connector.close)
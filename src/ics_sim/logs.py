@@ -0,0 +1,181 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LEVELS_VARIABLE = 'ICSSIM_LOG_LEVELS'
+HEADLESS_VARIABLE = 'ICSSIM_HEADLESS'
+
+
+class _RouteHandler(logging.handlers.QueueHandler):
+    """Queues (route, record) for the listener thread without formatting it; the listener formats."""
+    def __init__(self, records, route):
+        logging.handlers.QueueHandler.__init__(self, records)
+        self.route = route
+
+    def prepare(self, record):
+        return self.route, record
+
+
+class _RouteListener(logging.handlers.QueueListener):
+    def __init__(self, records, routes):
+        logging.handlers.QueueListener.__init__(self, records)
+        self.routes = routes
+
+    def handle(self, item):
+        route, record = item
+        if route is None:
+            # flush() marker
+            record.set()
+            return
+        for handler in self.routes.get(route, ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+class LogPipeline:
+    """Log files written by one background thread per process instead of the logging thread.
+
+    Loggers get a handler that only puts the record on an in-process queue;
+    formatting and file I/O happen in a QueueListener thread, so a log call
+    on a scan costs a queue put (and nothing if the logger's level drops
+    it, hence the %-style arguments instead of f-strings). Files are keyed
+    by path: asking for the same logger or the same file again reuses the
+    handler instead of adding another one.
+
+    Levels of single components (logger names such as 'logs-PLC1' or
+    'ics_sim.connectors', or 'root') can be set with configure(levels=...)
+    or the ICSSIM_LOG_LEVELS variable, e.g. 'root=INFO,logs-PLC1=DEBUG'.
+    Headless mode (configure(headless=True) or ICSSIM_HEADLESS=1) makes
+    Runnable.report print plain unflushed lines without colours.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.headless = _headless_environment()
+        self._configured = False
+        # route (absolute file path) -> [handler]
+        self._routes = {}
+        # (logger name, route) -> _RouteHandler
+        self._handlers = {}
+        self._start()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _start(self):
+        self._queue = queue.SimpleQueue()
+        self._listener = _RouteListener(self._queue, self._routes)
+        self._listener.start()
+        atexit.register(self._listener.stop)
+
+    def _after_fork(self):
+        # the listener thread of the parent does not exist in the child
+        self._start()
+        for handler in self._handlers.values():
+            handler.queue = self._queue
+
+    def configure(self, filename='app.log', level=logging.DEBUG, levels=None, headless=None, fmt=FORMAT):
+        """Send the root logger to filename (once, like logging.basicConfig) and apply component levels."""
+        with self._lock:
+            if headless is not None:
+                self.headless = headless
+            levels = dict(levels or {})
+            if not self._configured:
+                self._configured = True
+                root = logging.getLogger()
+                if not root.handlers:
+                    root.setLevel(level)
+                    self._attach(root, filename, logging.Formatter(fmt), 'a')
+                # explicit levels win over the environment
+                levels = dict(self.__parse_levels(os.environ.get(LEVELS_VARIABLE, '')), **levels)
+            for name, value in levels.items():
+                logging.getLogger(None if name == 'root' else name).setLevel(value)
+
+    def file_logger(self, name, formatter, level=logging.INFO, file_dir='./logs', file_ext='.log', write_mode='w'):
+        """Return logger name writing to file_dir/name + file_ext through the pipeline."""
+        if not os.path.exists(file_dir):
+            os.makedirs(file_dir, exist_ok=True)
+        logger = logging.getLogger(name)
+        logger.setLevel(level)
+        with self._lock:
+            self._attach(logger, os.path.join(file_dir, name) + file_ext, formatter, write_mode)
+        return logger
+
+    def forward(self, records):
+        """Send every record of this process to records (a multiprocessing queue) instead of the log files."""
+        with self._lock:
+            self._configured = True
+            root = logging.getLogger()
+            for handler in list(root.handlers):
+                root.removeHandler(handler)
+            root.addHandler(logging.handlers.QueueHandler(records))
+
+    def flush(self, timeout=5.0):
+        """Wait until the records logged so far are written."""
+        done = threading.Event()
+        self._queue.put_nowait((None, done))
+        return done.wait(timeout)
+
+    def _attach(self, logger, path, formatter, write_mode):
+        route = os.path.abspath(path)
+        if (logger.name, route) in self._handlers:
+            return
+        if route not in self._routes:
+            handler = logging.FileHandler(route, mode=write_mode)
+            handler.setFormatter(formatter)
+            self._routes[route] = [handler]
+        handler = self._handlers[(logger.name, route)] = _RouteHandler(self._queue, route)
+        logger.addHandler(handler)
+
+    @staticmethod
+    def __parse_levels(text):
+        for item in text.split(','):
+            if '=' in item:
+                name, value = item.split('=', 1)
+                value = value.strip().upper()
+                yield name.strip(), int(value) if value.isdigit() else logging.getLevelName(value)
+
+
+def _headless_environment():
+    return os.environ.get(HEADLESS_VARIABLE, '') not in ('', '0')
+
+
+# created on first use, so processes that never log to files (server workers) do not start a listener thread
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def _get_pipeline():
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = LogPipeline()
+        return _pipeline
+
+
+def configure_logging(filename='app.log', level=logging.DEBUG, levels=None, headless=None, fmt=FORMAT):
+    _get_pipeline().configure(filename, level, levels, headless, fmt)
+
+
+def file_logger(name, formatter, level=logging.INFO, file_dir='./logs', file_ext='.log', write_mode='w'):
+    return _get_pipeline().file_logger(name, formatter, level, file_dir, file_ext, write_mode)
+
+
+def forward_logging(records):
+    _get_pipeline().forward(records)
+
+
+def flush_logging(timeout=5.0):
+    if _pipeline is None:
+        # nothing was logged through the pipeline
+        return True
+    return _pipeline.flush(timeout)
+
+
+def is_headless():
+    if _pipeline is None:
+        return _headless_environment()
+    return _pipeline.headless
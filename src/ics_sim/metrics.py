@@ -0,0 +1,247 @@
+import json
+import logging
+import math
+import os
+import struct
+import threading
+import time
+from array import array
+
+
+class LatencyHistogram:
+    """Log-linear (HDR style) histogram of non-negative integers, typically nanoseconds.
+
+    Values below 2**SUB_BUCKET_BITS are counted exactly; above that every
+    power of two is split into 2**(SUB_BUCKET_BITS - 1) equal buckets, so a
+    percentile is reported within 1/32 of the recorded value at any
+    magnitude, from a fixed array of counters and an O(1) record().
+    """
+    SUB_BUCKET_BITS = 6
+
+    def __init__(self):
+        self._exact = 1 << self.SUB_BUCKET_BITS
+        self._half = self._exact >> 1
+        self._counts = array('Q', bytes(8 * (64 - self.SUB_BUCKET_BITS + 2) * self._half))
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        if value < self._exact:
+            return value
+        shift = value.bit_length() - self.SUB_BUCKET_BITS
+        return shift * self._half + (value >> shift)
+
+    def _highest_value(self, index):
+        """The largest value counted in bucket index."""
+        if index < self._exact:
+            return index
+        shift = index // self._half - 1
+        return ((index - shift * self._half + 1) << shift) - 1
+
+    def record(self, value):
+        value = max(int(value), 0)
+        self._counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        if not self.count:
+            return 0
+        # rounding first keeps float error out of the ceil, as in connectorBenchmark.percentile
+        rank = min(max(math.ceil(round(percent * self.count / 100.0, 6)), 1), self.count)
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= rank:
+                return min(self._highest_value(index), self.max)
+        return self.max
+
+    def merge(self, other):
+        for index, count in enumerate(other._counts):
+            if count:
+                self._counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def export(self):
+        """Return the histogram as plain data that from_export() (possibly in another process) restores."""
+        return {
+            'counts': [(index, count) for index, count in enumerate(self._counts) if count],
+            'count': self.count,
+            'total': self.total,
+            'min': self.min,
+            'max': self.max,
+        }
+
+    @classmethod
+    def from_export(cls, data):
+        histogram = cls()
+        for index, count in data['counts']:
+            histogram._counts[index] = count
+        histogram.count = data['count']
+        histogram.total = data['total']
+        histogram.min = data['min']
+        histogram.max = data['max']
+        return histogram
+
+    def summary(self, scale=1000.0):
+        """Count, mean and percentiles, divided by scale (ns to us by default)."""
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'min': round(self.min / scale, 2),
+            'mean': round(self.total / self.count / scale, 2),
+            'p50': round(self.percentile(50) / scale, 2),
+            'p90': round(self.percentile(90) / scale, 2),
+            'p99': round(self.percentile(99) / scale, 2),
+            'p999': round(self.percentile(99.9) / scale, 2),
+            'max': round(self.max / scale, 2),
+        }
+
+
+class ServerMetrics:
+    """Request counters and service time histograms of a Modbus server.
+
+    The server engines call record() with the raw request and response PDU
+    of every request they answer. Requests are counted per function code
+    (with its own latency histogram), per client address and per block of
+    RANGE_SIZE addresses of the table the request touched; exception
+    responses are counted per function code. stats() summarizes it all in
+    microseconds.
+    """
+    RANGE_SIZE = 100
+    TABLES = {1: 'coils', 2: 'discrete_inputs', 3: 'holding_registers', 4: 'input_registers',
+              5: 'coils', 6: 'holding_registers', 15: 'coils', 16: 'holding_registers'}
+    ADDRESS = struct.Struct('>HH')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self._latency = LatencyHistogram()
+        # function code -> [requests, exceptions, LatencyHistogram]
+        self._function_codes = {}
+        self._clients = {}
+        self._ranges = {}
+
+    def record(self, request, response, client, elapsed_ns):
+        function_code = request[0] if request else 0
+        table = self.TABLES.get(function_code)
+        blocks = ()
+        if table is not None and len(request) >= 5:
+            address, count = self.ADDRESS.unpack_from(request, 1)
+            if function_code in (5, 6):
+                count = 1
+            blocks = range(address // self.RANGE_SIZE, (address + max(count, 1) - 1) // self.RANGE_SIZE + 1)
+        is_exception = bool(response) and response[0] & 0x80
+
+        with self._lock:
+            self._latency.record(elapsed_ns)
+            entry = self._function_codes.get(function_code)
+            if entry is None:
+                entry = self._function_codes[function_code] = [0, 0, LatencyHistogram()]
+            entry[0] += 1
+            if is_exception:
+                entry[1] += 1
+            entry[2].record(elapsed_ns)
+            self._clients[client] = self._clients.get(client, 0) + 1
+            for block in blocks:
+                key = (table, block)
+                self._ranges[key] = self._ranges.get(key, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            function_codes = {
+                str(function_code): {'requests': requests, 'exceptions': exceptions, 'latency_us': latency.summary()}
+                for function_code, (requests, exceptions, latency) in sorted(self._function_codes.items())}
+            return {
+                'since': self.started,
+                'requests': self._latency.count,
+                'exceptions': sum(entry[1] for entry in self._function_codes.values()),
+                'latency_us': self._latency.summary(),
+                'function_codes': function_codes,
+                'clients': dict(self._clients),
+                'ranges': {'{}:{}-{}'.format(table, block * self.RANGE_SIZE, (block + 1) * self.RANGE_SIZE - 1): count
+                           for (table, block), count in sorted(self._ranges.items())},
+            }
+
+    def export(self):
+        """Return the raw counters as plain (picklable) data for merge()."""
+        with self._lock:
+            return {
+                'started': self.started,
+                'latency': self._latency.export(),
+                'function_codes': {function_code: [requests, exceptions, latency.export()]
+                                   for function_code, (requests, exceptions, latency) in self._function_codes.items()},
+                'clients': dict(self._clients),
+                'ranges': dict(self._ranges),
+            }
+
+    def merge(self, data):
+        """Add the counters of an export() of another ServerMetrics, e.g. of a worker process."""
+        with self._lock:
+            self.started = min(self.started, data['started'])
+            self._latency.merge(LatencyHistogram.from_export(data['latency']))
+            for function_code, (requests, exceptions, latency) in data['function_codes'].items():
+                entry = self._function_codes.get(function_code)
+                if entry is None:
+                    entry = self._function_codes[function_code] = [0, 0, LatencyHistogram()]
+                entry[0] += requests
+                entry[1] += exceptions
+                entry[2].merge(LatencyHistogram.from_export(latency))
+            for client, count in data['clients'].items():
+                self._clients[client] = self._clients.get(client, 0) + count
+            for key, count in data['ranges'].items():
+                self._ranges[key] = self._ranges.get(key, 0) + count
+
+
+class MetricsLog:
+    """Appends stats() of a server as one JSON line to path every interval seconds.
+
+    Lines carry a Unix timestamp ('time') like the attack history CSV of
+    AttackerBase, so both can be lined up. stop() writes a last line.
+    """
+    def __init__(self, stats, path, interval=10.0, name=None):
+        self._stats = stats
+        self._path = path
+        self._interval = interval
+        self._name = name
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.__run, name='metrics-log', daemon=True)
+
+    def start(self):
+        directory = os.path.dirname(self._path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._thread.start()
+
+    def stop(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.write()
+
+    def write(self):
+        line = {'time': time.time(), 'name': self._name}
+        line.update(self._stats())
+        try:
+            with open(self._path, 'a') as file:
+                file.write(json.dumps(line) + '\n')
+        except OSError as e:
+            logging.warning('cannot write server metrics to %s: %s', self._path, e)
+
+    def __run(self):
+        while not self._stop.wait(self._interval):
+            self.write()
@@ -1,6 +1,23 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections import deque, namedtuple
+from contextlib import contextmanager
+
 from pyModbusTCP.client import ModbusClient
+from pyModbusTCP.constants import MB_EXCEPT_ERR
 from pyModbusTCP.server import ModbusServer, DataBank
 
+from ics_sim.metrics import ServerMetrics
+from ics_sim.registers import SharedRegisterBank, register_bank_path
+from ics_sim.subscriptions import ChangeLog
+
 
 class Client:
     def __init__(self, ip, port):
@@ -10,9 +27,16 @@ class Client:
     def receive(self, tag_id):
         pass
 
+    def receive_many(self, tag_ids):
+        return {tag_id: self.receive(tag_id) for tag_id in tag_ids}
+
     def send(self, tag_id, value):
         pass
 
+    def send_many(self, mapping):
+        for tag_id, value in mapping.items():
+            self.send(tag_id, value)
+
 
 class Server:
     def __init__(self, ip, port):
@@ -25,6 +49,22 @@ class Server:
     def stop(self):
         pass
 
+    def poll(self):
+        """Apply pending client writes that are not applied as they arrive; called once per scan."""
+        pass
+
+    def publish(self):
+        """Make values set since the last publish visible to clients; called once per scan after the logic."""
+        pass
+
+    def close(self):
+        """Release what outlives stop(), such as shared memory."""
+        pass
+
+    def stats(self):
+        """Request counters and latency histograms (see ServerMetrics.stats), empty when not collected."""
+        return {}
+
     def set(self, tag_id, value):
         pass
 
@@ -33,78 +73,688 @@ class Server:
 
 
 class ModbusBase:
+    """Fixed point codec between tag values and holding register words.
+
+    A value is scaled by 10**precision, truncated towards zero and stored as a
+    signed (two's complement) integer spread over word_num big-endian words, so
+    with the defaults the range is +-214748.3647 in steps of 0.0001. Values
+    outside the range raise ValueError instead of wrapping around.
+    """
+    INTEGER_FORMATS = {1: 'h', 2: 'i', 4: 'q'}
+
     def __init__(self, word_num=2, precision=4):
+        if word_num not in self.INTEGER_FORMATS:
+            raise ValueError('word_num must be one of {}'.format(sorted(self.INTEGER_FORMATS)))
+
         self._precision = precision
         self._word_num = word_num
         self._precision_factor = pow(10, precision)
         self._base = pow(2, 16)
-        self._max_int = pow(self._base, word_num)
+        self._max_int = pow(self._base, word_num) // 2 - 1
+        self._min_int = -pow(self._base, word_num) // 2
+        self._integer_format = self.INTEGER_FORMATS[word_num]
+        self._value_struct = struct.Struct('>' + self._integer_format)
+        self._words_struct = struct.Struct('>{}H'.format(word_num))
 
     def decode(self, word_array):
+        try:
+            return self._value_struct.unpack(self._words_struct.pack(*word_array))[0] / self._precision_factor
+        except struct.error:
+            if len(word_array) != self._word_num:
+                raise ValueError('word array length is not correct')
+            raise ValueError('register words must be in range 0..65535')
 
-        if len(word_array) != self._word_num:
-            raise ValueError('word array length is not correct')
+    def encode(self, number):
+        try:
+            return list(self._words_struct.unpack(self._value_struct.pack(int(number * self._precision_factor))))
+        except struct.error:
+            raise self.__overflow()
 
-        base_holder = 1
-        result = 0
+    def decode_many(self, words):
+        """Decode a flat sequence of register words into a list of values, word_num words per value."""
+        count, remainder = divmod(len(words), self._word_num)
+        if remainder:
+            raise ValueError('word array length is not correct')
 
-        for word in word_array:
-            result *= base_holder
-            result += word
-            base_holder *= self._base
+        try:
+            raw = struct.pack('>{}H'.format(len(words)), *words)
+        except struct.error:
+            raise ValueError('register words must be in range 0..65535')
 
-        return result / self._precision_factor
+        factor = self._precision_factor
+        return [number / factor for number in struct.unpack('>{}{}'.format(count, self._integer_format), raw)]
 
-    def encode(self, number):
+    def encode_many(self, numbers):
+        """Encode values into one flat list of register words, word_num words per value."""
+        factor = self._precision_factor
+        numbers = [int(number * factor) for number in numbers]
 
-        number = int(number * self._precision_factor)
+        try:
+            raw = struct.pack('>{}{}'.format(len(numbers), self._integer_format), *numbers)
+        except struct.error:
+            raise self.__overflow()
 
-        if number > self._max_int:
-            raise ValueError('input number exceed max limit')
+        return list(struct.unpack('>{}H'.format(len(numbers) * self._word_num), raw))
 
-        result = []
-        while number:
-            result.append(number % self._base)
-            number = int(number / self._base)
+    def quantize(self, number):
+        """Return number as decode(encode(number)) would, without building the register words."""
+        return self._scale(number) / self._precision_factor
 
-        while len(result) < self._word_num:
-            result.append(0)
+    def _scale(self, number):
+        scaled = int(number * self._precision_factor)
+        if not self._min_int <= scaled <= self._max_int:
+            raise self.__overflow()
+        return scaled
 
-        result.reverse()
-        return result
+    def __overflow(self):
+        return ValueError('input number exceed limits [{}, {}]'.format(
+            self._min_int / self._precision_factor, self._max_int / self._precision_factor))
 
     def get_registers(self, index):
         return index * self._word_num
 
+    def plan_ranges(self, tag_ids, max_registers=None):
+        """Cover tag_ids with the fewest (first_tag_id, tag_count) ranges of at most max_registers registers.
+
+        Gaps between requested tags are read along, one request costs far more
+        than a few unused registers.
+        """
+        if max_registers is None:
+            max_registers = ModbusFrame.MAX_READ_REGISTERS
+        max_tags = max_registers // self._word_num
+
+        ranges = []
+        for tag_id in sorted(set(tag_ids)):
+            if ranges and tag_id - ranges[-1][0] < max_tags:
+                ranges[-1][1] = tag_id - ranges[-1][0] + 1
+            else:
+                ranges.append([tag_id, 1])
+        return [(first, count) for first, count in ranges]
+
+    def plan_writes(self, mapping, max_registers=None):
+        """Merge {tag_id: value} into (first_tag_id, [values]) runs of adjacent tags of at most max_registers.
+
+        Unlike reads, writes never span gaps: that would overwrite the tags in between.
+        """
+        if max_registers is None:
+            max_registers = ModbusFrame.MAX_WRITE_REGISTERS
+        max_tags = max_registers // self._word_num
+
+        runs = []
+        for tag_id in sorted(mapping):
+            if runs and tag_id == runs[-1][0] + len(runs[-1][1]) and len(runs[-1][1]) < max_tags:
+                runs[-1][1].append(mapping[tag_id])
+            else:
+                runs.append((tag_id, [mapping[tag_id]]))
+        return runs
+
+    def _pick(self, tag_ids, first, words):
+        """Map the tags of tag_ids that fall in a range read from tag first to their decoded values."""
+        values = self.decode_many(words)
+        return {tag_id: values[tag_id - first] for tag_id in tag_ids if 0 <= tag_id - first < len(values)}
+
+
+class StructCodec:
+    """Codec of a value packed with a struct format into big-endian holding registers."""
+    def __init__(self, value_format, convert):
+        self._value_struct = struct.Struct('>' + value_format)
+        self._convert = convert
+        self.count = self._value_struct.size // 2
+        self._words_struct = struct.Struct('>{}H'.format(self.count))
+
+    def encode(self, value):
+        try:
+            return list(self._words_struct.unpack(self._value_struct.pack(self._convert(value))))
+        except (struct.error, OverflowError):
+            raise ValueError('{!r} does not fit in {} register(s)'.format(value, self.count))
+
+    def decode(self, words):
+        return self._value_struct.unpack(self._words_struct.pack(*words))[0]
+
+
+class StringCodec:
+    """Codec of a UTF-8 string of at most length bytes, NUL padded to whole registers."""
+    def __init__(self, length):
+        if not 0 < length <= 2 * ModbusFrame.MAX_WRITE_REGISTERS:
+            raise ValueError('string length must be in range 1..{}'.format(2 * ModbusFrame.MAX_WRITE_REGISTERS))
+        self.length = length
+        self.count = (length + 1) // 2
+        self._words_struct = struct.Struct('>{}H'.format(self.count))
+
+    def encode(self, value):
+        data = str(value).encode('utf-8')
+        if len(data) > self.length:
+            raise ValueError('{!r} is longer than {} bytes'.format(value, self.length))
+        return list(self._words_struct.unpack(data.ljust(2 * self.count, b'\0')))
+
+    def decode(self, words):
+        return self._words_struct.pack(*words).rstrip(b'\0').decode('utf-8', 'replace')
+
+
+class BoolCodec:
+    """Codec of a bool stored in one coil or discrete input."""
+    count = 1
+
+    def encode(self, value):
+        return [1 if value else 0]
+
+    def decode(self, bits):
+        return bool(bits[0])
+
+
+Register = namedtuple('Register', ['tag_id', 'table', 'address', 'count', 'codec'])
+
+
+class RegisterMap:
+    """Where every tag of a PLC lives in the Modbus data model and how its value is encoded.
+
+    Tags without a 'datatype' keep the fixed point layout of ModbusBase at
+    register tag_id * word_num, so clients that only know tag ids (attacks,
+    ModbusCommand) stay valid; tag ids missing from the map are read that way
+    too. Typed tags are laid out after the fixed point registers of all tag
+    ids, in tag id order: 'bool' tags take one coil (outputs) or discrete
+    input (inputs), 'int16', 'int32' and 'float32' one or two holding
+    registers and 'string' (with a 'length' in bytes) as many registers as
+    the length needs.
+
+    The fixed point register a 'bool' or 'int16' tag had before it got a
+    datatype stays its alias: servers mirror the tag's value there and apply
+    client writes to it to the tag. The old registers of the other typed tags
+    (whose values need not fit the fixed point range) belong to no tag.
+    """
+    HOLDING_REGISTERS = 'holding_registers'
+    COILS = 'coils'
+    DISCRETE_INPUTS = 'discrete_inputs'
+    TABLES = (HOLDING_REGISTERS, COILS, DISCRETE_INPUTS)
+    TABLE_SIZE = 0x10000
+
+    BOOL = 'bool'
+    INT16 = 'int16'
+    INT32 = 'int32'
+    FLOAT32 = 'float32'
+    STRING = 'string'
+    ALIASED = (BOOL, INT16)
+
+    def __init__(self, tags=None, plc_id=None, word_num=2, precision=4):
+        self.fixed_point = ModbusBase(word_num, precision)
+        self._word_num = word_num
+        self._registers = {}
+        self._owners = {table: {} for table in self.TABLES}
+        self._aliases = {}
+        self._alias_owners = {}
+
+        tags = [tag for tag in (tags or {}).values() if plc_id is None or tag['plc'] == plc_id]
+        next_address = dict.fromkeys(self.TABLES, 0)
+        next_address[self.HOLDING_REGISTERS] = max([(tag['id'] + 1) * word_num for tag in tags], default=0)
+
+        for tag in sorted(tags, key=lambda tag: tag['id']):
+            datatype = tag.get('datatype')
+            if datatype is None:
+                continue
+            codec = self.create_codec(datatype, tag.get('length'))
+            if datatype != self.BOOL:
+                table = self.HOLDING_REGISTERS
+            elif tag.get('type') == 'input':
+                table = self.DISCRETE_INPUTS
+            else:
+                table = self.COILS
+
+            address = next_address[table]
+            if address + codec.count > self.TABLE_SIZE:
+                raise ValueError('tag {} does not fit in the {}'.format(tag['id'], table))
+            next_address[table] = address + codec.count
+            self._registers[tag['id']] = Register(tag['id'], table, address, codec.count, codec)
+            for offset in range(codec.count):
+                self._owners[table][address + offset] = tag['id']
+            if datatype in self.ALIASED:
+                alias = Register(tag['id'], self.HOLDING_REGISTERS, tag['id'] * word_num, word_num, self.fixed_point)
+                self._aliases[tag['id']] = alias
+                for offset in range(word_num):
+                    self._alias_owners[alias.address + offset] = alias
+
+    @classmethod
+    def create_codec(cls, datatype, length=None):
+        if datatype == cls.BOOL:
+            return BoolCodec()
+        elif datatype == cls.INT16:
+            return StructCodec('h', int)
+        elif datatype == cls.INT32:
+            return StructCodec('i', int)
+        elif datatype == cls.FLOAT32:
+            return StructCodec('f', float)
+        elif datatype == cls.STRING:
+            if not length:
+                raise ValueError('string tags need a length')
+            return StringCodec(length)
+        raise ValueError('{} is not a valid datatype'.format(datatype))
+
+    def __getitem__(self, tag_id):
+        register = self._registers.get(tag_id)
+        if register is None:
+            register = Register(tag_id, self.HOLDING_REGISTERS, tag_id * self._word_num, self._word_num,
+                                self.fixed_point)
+        return register
+
+    def alias(self, tag_id):
+        """Return the fixed point Register aliasing typed tag_id, None if it has none."""
+        return self._aliases.get(tag_id)
+
+    def tags_at(self, table, address, count):
+        """Return the ids of the tags stored in table[address:address + count] (aliases not included)."""
+        owners = self._owners[table]
+        tag_ids = []
+        for current in range(address, address + count):
+            tag_id = owners.get(current)
+            if tag_id is None and table == self.HOLDING_REGISTERS:
+                tag_id = current // self._word_num
+                if tag_id in self._registers:
+                    # the old register of a typed tag, see aliases_at()
+                    tag_id = None
+            if tag_id is not None:
+                tag_ids.append(tag_id)
+        return list(dict.fromkeys(tag_ids))
+
+    def aliases_at(self, address, count):
+        """Return the alias Registers among holding registers[address:address + count]."""
+        owners = self._alias_owners
+        aliases = [owners[current] for current in range(address, address + count) if current in owners]
+        return list(dict.fromkeys(aliases))
+
+    def plan_reads(self, tag_ids):
+        """Cover tag_ids with the fewest (table, address, count, [registers]) block reads.
+
+        Like ModbusBase.plan_ranges, gaps between requested tags are read along.
+        """
+        tables = {}
+        for tag_id in dict.fromkeys(tag_ids):
+            register = self[tag_id]
+            tables.setdefault(register.table, []).append(register)
+
+        reads = []
+        for table, registers in tables.items():
+            limit = ModbusFrame.MAX_READ_REGISTERS if table == self.HOLDING_REGISTERS else ModbusFrame.MAX_READ_BITS
+            current = None
+            for register in sorted(registers, key=lambda register: register.address):
+                end = register.address + register.count
+                if current is not None and end - current[1] <= limit:
+                    current[2] = max(current[2], end - current[1])
+                    current[3].append(register)
+                else:
+                    current = [table, register.address, register.count, [register]]
+                    reads.append(current)
+        return [tuple(read) for read in reads]
+
+    def plan_writes(self, mapping):
+        """Encode {tag_id: value} into (table, address, [words or bits]) block writes of adjacent tags.
+
+        Everything is encoded before anything is returned, so a value that
+        does not fit fails the whole write. Discrete inputs cannot be written.
+        """
+        tables = {}
+        for tag_id, value in mapping.items():
+            register = self[tag_id]
+            if register.table == self.DISCRETE_INPUTS:
+                raise ValueError('tag {} is a discrete input and cannot be written'.format(tag_id))
+            tables.setdefault(register.table, []).append((register, value))
+
+        writes = []
+        for table, items in tables.items():
+            limit = ModbusFrame.MAX_WRITE_REGISTERS if table == self.HOLDING_REGISTERS else ModbusFrame.MAX_WRITE_BITS
+            current = None
+            for register, value in sorted(items, key=lambda item: item[0].address):
+                data = register.codec.encode(value)
+                if current is not None and register.address == current[1] + len(current[2]) \
+                        and len(current[2]) + len(data) <= limit:
+                    current[2].extend(data)
+                else:
+                    current = (table, register.address, data)
+                    writes.append(current)
+        return writes
+
+    @staticmethod
+    def pick(registers, address, data):
+        """Decode the registers of a block read from address into {tag_id: value}."""
+        return {register.tag_id: register.codec.decode(data[register.address - address:
+                                                             register.address - address + register.count])
+                for register in registers}
+
+
+class ModbusConnectionPool:
+    """Thread-safe pool of pyModbusTCP connections shared per (ip, port) endpoint.
+
+    At most max_connections sockets are open to an endpoint; acquire() hands
+    out an idle connection (most recently used first) or opens a new one, and
+    waits up to acquire_timeout when all are busy. Connections found closed
+    on checkout or release are dropped and ones idle for longer than
+    idle_timeout are evicted. A failed connect puts the endpoint in
+    exponential backoff (backoff_initial doubling up to backoff_max), during
+    which acquire() fails fast instead of hammering a dead PLC.
+    shared() returns the process-wide pool used by ClientModbus.
+    """
+    MAX_CONNECTIONS = 4
+    IDLE_TIMEOUT = 60.0
+    ACQUIRE_TIMEOUT = 5.0
+    BACKOFF_INITIAL = 0.1
+    BACKOFF_MAX = 5.0
+
+    # pid -> pool, so forked processes never share sockets with their parent
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    class _Endpoint:
+        def __init__(self, lock):
+            self.idle = deque()
+            self.members = set()
+            self.in_use = 0
+            self.available = threading.Condition(lock)
+            self.failures = 0
+            self.retry_at = 0
+            self.stats = dict.fromkeys(('opened', 'reused', 'closed', 'evicted', 'connect_failures', 'waits'), 0)
+
+    def __init__(self, max_connections=MAX_CONNECTIONS, idle_timeout=IDLE_TIMEOUT, acquire_timeout=ACQUIRE_TIMEOUT,
+                 backoff_initial=BACKOFF_INITIAL, backoff_max=BACKOFF_MAX, timeout=None):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    @classmethod
+    def shared(cls):
+        pid = os.getpid()
+        with cls._shared_lock:
+            if pid not in cls._shared:
+                cls._shared.clear()
+                cls._shared[pid] = cls()
+            return cls._shared[pid]
+
+    def acquire(self, ip, port):
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._lock:
+            endpoint = self._endpoints.get((ip, port))
+            if endpoint is None:
+                endpoint = self._endpoints[(ip, port)] = self._Endpoint(self._lock)
+
+            while True:
+                now = time.monotonic()
+                self.__evict_idle(endpoint, now)
+                while endpoint.idle:
+                    client, last_used = endpoint.idle.pop()
+                    if client.is_open:
+                        endpoint.in_use += 1
+                        endpoint.stats['reused'] += 1
+                        return client
+                    self.__drop(endpoint, client, 'closed')
+
+                if endpoint.in_use + len(endpoint.idle) < self.max_connections:
+                    if now < endpoint.retry_at:
+                        raise ConnectionError('{}:{} is unreachable, next connect attempt in {:.2f}s'.format(
+                            ip, port, endpoint.retry_at - now))
+                    endpoint.in_use += 1
+                    break
+
+                endpoint.stats['waits'] += 1
+                if deadline <= now or not endpoint.available.wait(deadline - now):
+                    raise ConnectionError('no free connection to {}:{} within {}s'.format(
+                        ip, port, self.acquire_timeout))
+
+        # connect outside the lock, other endpoints and idle connections stay available meanwhile
+        if self.timeout is None:
+            client = ModbusClient(host=ip, port=port, auto_open=False)
+        else:
+            client = ModbusClient(host=ip, port=port, timeout=self.timeout, auto_open=False)
+        opened = client.open()
+
+        with self._lock:
+            if opened:
+                endpoint.failures = 0
+                endpoint.retry_at = 0
+                endpoint.members.add(client)
+                endpoint.stats['opened'] += 1
+                return client
+
+            endpoint.in_use -= 1
+            endpoint.failures += 1
+            endpoint.retry_at = time.monotonic() + min(
+                self.backoff_initial * 2 ** (endpoint.failures - 1), self.backoff_max)
+            endpoint.stats['connect_failures'] += 1
+            endpoint.available.notify()
+        raise ConnectionError('cannot connect to {}:{}'.format(ip, port))
+
+    def release(self, ip, port, client):
+        with self._lock:
+            endpoint = self._endpoints[(ip, port)]
+            endpoint.in_use -= 1
+            if client.is_open and client in endpoint.members:
+                endpoint.idle.append((client, time.monotonic()))
+            else:
+                self.__drop(endpoint, client, 'closed')
+            endpoint.available.notify()
+
+    @contextmanager
+    def connection(self, ip, port):
+        client = self.acquire(ip, port)
+        try:
+            yield client
+        finally:
+            self.release(ip, port, client)
+
+    def close(self, ip=None, port=None):
+        """Close the idle connections of one endpoint (or all); busy ones are closed when released."""
+        with self._lock:
+            for key, endpoint in self._endpoints.items():
+                if ip is not None and key != (ip, port):
+                    continue
+                while endpoint.idle:
+                    self.__drop(endpoint, endpoint.idle.pop()[0], 'closed')
+                endpoint.members.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'{}:{}'.format(*key): dict(endpoint.stats, in_use=endpoint.in_use, idle=len(endpoint.idle),
+                                               failures=endpoint.failures)
+                    for key, endpoint in self._endpoints.items()}
+
+    def __evict_idle(self, endpoint, now):
+        # idle connections are ordered by release time, the oldest are on the left
+        while endpoint.idle and now - endpoint.idle[0][1] > self.idle_timeout:
+            self.__drop(endpoint, endpoint.idle.popleft()[0], 'evicted')
+
+    @staticmethod
+    def __drop(endpoint, client, reason):
+        client.close()
+        endpoint.members.discard(client)
+        endpoint.stats[reason] += 1
+
 
 class ClientModbus(Client, ModbusBase):
-    def __init__(self, ip, port):
+    """Modbus/TCP client whose requests run on connections borrowed from a ModbusConnectionPool.
+
+    Many clients of the same endpoint (and threads using one client) share the
+    pool's sockets. A request that fails on a connection is retried once on a
+    fresh one, as pooled connections may have been closed by the server while
+    idle; exception responses of the server raise ModbusError.
+    """
+    def __init__(self, ip, port, pool=None, register_map=None):
         ModbusBase.__init__(self)
         Client.__init__(self, ip, port)
-        self.client = ModbusClient(host=self.ip, port=self.port)
+        self.pool = ModbusConnectionPool.shared() if pool is None else pool
+        self.register_map = RegisterMap() if register_map is None else register_map
+
+    def _request(self, function_code, request, description):
+        for attempt in range(2):
+            with self.pool.connection(self.ip, self.port) as client:
+                result = request(client)
+                if result is not None and result is not False:
+                    return result
+                if client.last_error == MB_EXCEPT_ERR:
+                    raise ModbusError(function_code, client.last_except)
+                # keep a connection in an unknown state out of the pool
+                client.close()
+            # the other idle connections to the endpoint are most likely just as dead
+            self.pool.close(self.ip, self.port)
+        raise ConnectionError('{} {}:{} failed'.format(description, self.ip, self.port))
+
+    def _read(self, table, address, count):
+        description = 'reading {} {}..{} from'.format(table, address, address + count - 1)
+        if table == RegisterMap.COILS:
+            return self._request(ModbusFrame.READ_COILS,
+                                 lambda client: client.read_coils(address, count), description)
+        elif table == RegisterMap.DISCRETE_INPUTS:
+            return self._request(ModbusFrame.READ_DISCRETE_INPUTS,
+                                 lambda client: client.read_discrete_inputs(address, count), description)
+        return self._request(ModbusFrame.READ_HOLDING_REGISTERS,
+                             lambda client: client.read_holding_registers(address, count), description)
+
+    def _write(self, table, address, values):
+        description = 'writing {} {}..{} to'.format(table, address, address + len(values) - 1)
+        if table == RegisterMap.COILS:
+            self._request(ModbusFrame.WRITE_MULTIPLE_COILS,
+                          lambda client: client.write_multiple_coils(address, values), description)
+        else:
+            self._request(ModbusFrame.WRITE_MULTIPLE_REGISTERS,
+                          lambda client: client.write_multiple_registers(address, values), description)
 
     def receive(self, tag_id):
-        self.open()
-        return self.decode(self.client.read_holding_registers(self.get_registers(tag_id), self._word_num))
+        register = self.register_map[tag_id]
+        return register.codec.decode(self._read(register.table, register.address, register.count))
+
+    def receive_many(self, tag_ids):
+        """Read many tags with one read request per planned block."""
+        values = {}
+        for table, address, count, registers in self.register_map.plan_reads(tag_ids):
+            values.update(self.register_map.pick(registers, address, self._read(table, address, count)))
+        return {tag_id: values[tag_id] for tag_id in tag_ids}
 
     def send(self, tag_id, value):
-        self.open()
-        self.client.write_multiple_registers(self.get_registers(tag_id), self.encode(value))
+        self.send_many({tag_id: value})
+
+    def send_many(self, mapping):
+        """Write many tags with one write request per run of adjacent tags."""
+        for table, address, values in self.register_map.plan_writes(mapping):
+            self._write(table, address, values)
 
     def open(self):
-        if not self.client.is_open:
-            self.client.open()
+        with self.pool.connection(self.ip, self.port):
+            pass
 
     def close(self):
-        if self.client.is_open:
-            self.client.close()
+        self.pool.close(self.ip, self.port)
 
 
-class ServerModbus(Server, ModbusBase):
-    def __init__(self, ip, port):
+class TagServer(Server, ModbusBase):
+    """Tag level set/get and change tracking over the register tables of a Modbus server engine.
+
+    Engines implement _read() and _write() on their storage, call
+    _record_client_write() for what clients write and time every request
+    into metrics; the register_map decides where every tag lives and how it
+    is encoded.
+    """
+    def __init__(self, ip, port, register_map=None):
         ModbusBase.__init__(self)
         Server.__init__(self, ip, port)
-        self.server = ModbusServer(ip, port, no_block=True)
+        self.register_map = RegisterMap() if register_map is None else register_map
+        self.changes = ChangeLog()
+        self.metrics = ServerMetrics()
+
+    def stats(self):
+        return self.metrics.stats()
+
+    def set(self, tag_id, value):
+        register = self.register_map[tag_id]
+        data = register.codec.encode(value)
+        value = register.codec.decode(data)
+        self._write(register.table, register.address, data)
+        alias = self.register_map.alias(tag_id)
+        if alias is not None:
+            self._write(alias.table, alias.address, alias.codec.encode(value))
+        self.changes.record(tag_id, value)
+
+    def get(self, tag_id):
+        return self._load(tag_id)
+
+    def get_changes_since(self, seq):
+        """Return (latest_seq, {tag_id: value}) for the tags changed after seq."""
+        return self.changes.get_changes_since(seq)
+
+    def subscribe(self, callback):
+        self.changes.subscribe(callback)
+
+    def _record_client_write(self, table, address, count):
+        """Record the tags a client write changed and return {tag_id: value} of them."""
+        register_map = self.register_map
+        written = {}
+        for tag_id in register_map.tags_at(table, address, count):
+            written[tag_id] = value = self._load(tag_id)
+            alias = register_map.alias(tag_id)
+            if alias is not None:
+                self._write(alias.table, alias.address, alias.codec.encode(value))
+        if table == RegisterMap.HOLDING_REGISTERS:
+            for alias in register_map.aliases_at(address, count):
+                written[alias.tag_id] = self.__apply_alias(alias)
+        return self.changes.record_many(written)
+
+    def __apply_alias(self, alias):
+        # a client that only knows tag ids wrote the old register of a typed tag: move the value to the tag
+        register = self.register_map[alias.tag_id]
+        try:
+            data = register.codec.encode(alias.codec.decode(self._read(alias.table, alias.address, alias.count)))
+        except ValueError:
+            # out of the tag's range, the tag keeps its value
+            data = list(self._read(register.table, register.address, register.count))
+        value = register.codec.decode(data)
+        self._write(register.table, register.address, data)
+        self._write(alias.table, alias.address, alias.codec.encode(value))
+        return value
+
+    def _load(self, tag_id):
+        register = self.register_map[tag_id]
+        return register.codec.decode(self._read(register.table, register.address, register.count))
+
+    def _read(self, table, address, count):
+        """Return count words (or bits) of table from address."""
+        raise NotImplementedError
+
+    def _write(self, table, address, values):
+        raise NotImplementedError
+
+
+class ChangeTrackingDataBank(DataBank):
+    """DataBank that reports holding registers and coils written by Modbus clients."""
+    def __init__(self, on_change):
+        DataBank.__init__(self)
+        self._on_change = on_change
+
+    def on_holding_registers_change(self, address, from_value, to_value, srv_info):
+        self._on_change(RegisterMap.HOLDING_REGISTERS, address, 1)
+
+    def on_coils_change(self, address, from_value, to_value, srv_info):
+        self._on_change(RegisterMap.COILS, address, 1)
+
+
+class MeteredModbusServer(ModbusServer):
+    """pyModbusTCP ModbusServer that times every request into a ServerMetrics."""
+    def __init__(self, metrics, *args, **kwargs):
+        ModbusServer.__init__(self, *args, **kwargs)
+        self.metrics = metrics
+
+    def _engine(self, session_data):
+        started = time.perf_counter_ns()
+        try:
+            ModbusServer._engine(self, session_data)
+        finally:
+            self.metrics.record(session_data.request.pdu.raw, session_data.response.pdu.raw,
+                                session_data.client.address, time.perf_counter_ns() - started)
+
+
+class ServerModbus(TagServer):
+    def __init__(self, ip, port, register_map=None):
+        TagServer.__init__(self, ip, port, register_map)
+        self.server = MeteredModbusServer(self.metrics, ip, port, no_block=True,
+                                          data_bank=ChangeTrackingDataBank(self._record_client_write))
 
     def start(self):
         self.server.start()
@@ -112,27 +762,754 @@ class ServerModbus(Server, ModbusBase):
     def stop(self):
         self.server.stop()
 
+    def _read(self, table, address, count):
+        if table == RegisterMap.COILS:
+            return self.server.data_bank.get_coils(address, count)
+        elif table == RegisterMap.DISCRETE_INPUTS:
+            return self.server.data_bank.get_discrete_inputs(address, count)
+        return self.server.data_bank.get_holding_registers(address, count)
+
+    def _write(self, table, address, values):
+        if table == RegisterMap.COILS:
+            self.server.data_bank.set_coils(address, values)
+        elif table == RegisterMap.DISCRETE_INPUTS:
+            self.server.data_bank.set_discrete_inputs(address, values)
+        else:
+            self.server.data_bank.set_holding_registers(address, values)
+
+
+
+class ModbusError(Exception):
+    """Raised by the Modbus clients on exception responses and malformed frames."""
+    def __init__(self, function_code, exception_code):
+        Exception.__init__(self, 'function {} failed with exception code {}'.format(function_code, exception_code))
+        self.function_code = function_code
+        self.exception_code = exception_code
+
+
+class ModbusFrame:
+    """Modbus/TCP framing helpers shared by the asyncio client and server."""
+    MBAP = struct.Struct('>HHHB')
+    READ_REQUEST = struct.Struct('>BHH')
+    WRITE_REQUEST = struct.Struct('>BHHB')
+    WRITE_RESPONSE = struct.Struct('>BHH')
+
+    READ_COILS = 1
+    READ_DISCRETE_INPUTS = 2
+    READ_HOLDING_REGISTERS = 3
+    WRITE_SINGLE_COIL = 5
+    WRITE_SINGLE_REGISTER = 6
+    WRITE_MULTIPLE_COILS = 15
+    WRITE_MULTIPLE_REGISTERS = 16
+
+    ILLEGAL_FUNCTION = 1
+    ILLEGAL_DATA_ADDRESS = 2
+    ILLEGAL_DATA_VALUE = 3
+    SERVER_DEVICE_FAILURE = 4
+
+    MAX_READ_REGISTERS = 125
+    MAX_WRITE_REGISTERS = 123
+    MAX_READ_BITS = 2000
+    MAX_WRITE_BITS = 1968
+    COIL_ON = 0xFF00
+
+    @staticmethod
+    def words_to_bytes(words):
+        words = array('H', words)
+        if sys.byteorder == 'little':
+            words.byteswap()
+        return words.tobytes()
+
+    @staticmethod
+    def bytes_to_words(data):
+        words = array('H', data)
+        if sys.byteorder == 'little':
+            words.byteswap()
+        return words
+
+    @staticmethod
+    def bits_to_bytes(bits):
+        """Pack bits LSB first into bytes, as coils and discrete inputs travel on the wire."""
+        data = bytearray((len(bits) + 7) // 8)
+        for i, bit in enumerate(bits):
+            if bit:
+                data[i >> 3] |= 1 << (i & 7)
+        return bytes(data)
+
+    @staticmethod
+    def bytes_to_bits(data, count):
+        return [(data[i >> 3] >> (i & 7)) & 1 for i in range(count)]
+
+    @staticmethod
+    def exception(function_code, exception_code):
+        return bytes((function_code | 0x80, exception_code))
+
+
+class AsyncClientModbus(Client, ModbusBase):
+    """Pipelined asyncio Modbus/TCP client with the receive/send semantics of ClientModbus.
+
+    Any number of coroutines may issue requests concurrently over the one
+    connection (up to max_in_flight outstanding); a background reader task
+    hands every response to its request by MBAP transaction id, so responses
+    may arrive in any order. timeout applies per request: a timed out request
+    fails alone and its late response is dropped, while a broken connection
+    fails every outstanding request and is reopened by the next one.
+    """
+    def __init__(self, ip, port, timeout=5.0, unit_id=1, max_in_flight=256, register_map=None):
+        ModbusBase.__init__(self)
+        Client.__init__(self, ip, port)
+        self.register_map = RegisterMap() if register_map is None else register_map
+        self.timeout = timeout
+        self.unit_id = unit_id
+        self.max_in_flight = max_in_flight
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._pending = {}
+        self._transaction_id = 0
+        # asyncio primitives are created on first use, inside the loop that uses the client
+        self._open_lock = None
+        self._drain_lock = None
+        self._in_flight = None
+
+    @property
+    def is_open(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def open(self):
+        if self._open_lock is None:
+            self._open_lock = asyncio.Lock()
+            self._drain_lock = asyncio.Lock()
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+
+        async with self._open_lock:
+            if not self.is_open:
+                self._reader, self._writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.ip, self.port), self.timeout)
+                self._reader_task = asyncio.ensure_future(self.__read_responses(self._reader))
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+            self._reader = self._writer = None
+        self.__fail_pending(ConnectionError('connection to {}:{} closed'.format(self.ip, self.port)))
+
+    async def _request(self, pdu, timeout=None):
+        await self.open()
+        async with self._in_flight:
+            if not self.is_open:
+                # lost while waiting for a free slot
+                await self.open()
+            transaction_id = self.__next_transaction_id()
+            future = asyncio.get_running_loop().create_future()
+            self._pending[transaction_id] = future
+            try:
+                self._writer.write(ModbusFrame.MBAP.pack(transaction_id, 0, len(pdu) + 1, self.unit_id) + pdu)
+                async with self._drain_lock:
+                    await self._writer.drain()
+                response = await asyncio.wait_for(future, self.timeout if timeout is None else timeout)
+            finally:
+                self._pending.pop(transaction_id, None)
+
+        if response[0] & 0x80:
+            raise ModbusError(response[0] & 0x7F, response[1])
+        return response
+
+    def __next_transaction_id(self):
+        # skip ids that are still waiting for a response after a 16 bit wrap-around
+        while True:
+            self._transaction_id = (self._transaction_id + 1) & 0xFFFF
+            if self._transaction_id not in self._pending:
+                return self._transaction_id
+
+    async def __read_responses(self, reader):
+        try:
+            while True:
+                transaction_id, protocol_id, length, unit_id = ModbusFrame.MBAP.unpack(
+                    await reader.readexactly(ModbusFrame.MBAP.size))
+                pdu = await reader.readexactly(length - 1)
+                future = self._pending.get(transaction_id)
+                if future is not None and not future.done():
+                    future.set_result(pdu)
+        except asyncio.CancelledError:
+            raise
+        except (OSError, asyncio.IncompleteReadError) as e:
+            # the stream is out of sync after any I/O problem
+            if self._reader is reader:
+                self._writer.close()
+                self._reader = self._writer = self._reader_task = None
+            self.__fail_pending(ConnectionError('connection to {}:{} lost: {!r}'.format(self.ip, self.port, e)))
+
+    def __fail_pending(self, error):
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    async def read_holding_registers(self, address, count, timeout=None):
+        response = await self._request(
+            ModbusFrame.READ_REQUEST.pack(ModbusFrame.READ_HOLDING_REGISTERS, address, count), timeout)
+        return ModbusFrame.bytes_to_words(response[2:2 + response[1]]).tolist()
+
+    async def write_multiple_registers(self, address, words, timeout=None):
+        data = ModbusFrame.words_to_bytes(words)
+        await self._request(ModbusFrame.WRITE_REQUEST.pack(
+            ModbusFrame.WRITE_MULTIPLE_REGISTERS, address, len(words), len(data)) + data, timeout)
+
+    async def read_coils(self, address, count, timeout=None):
+        return await self.__read_bits(ModbusFrame.READ_COILS, address, count, timeout)
+
+    async def read_discrete_inputs(self, address, count, timeout=None):
+        return await self.__read_bits(ModbusFrame.READ_DISCRETE_INPUTS, address, count, timeout)
+
+    async def __read_bits(self, function_code, address, count, timeout):
+        response = await self._request(ModbusFrame.READ_REQUEST.pack(function_code, address, count), timeout)
+        return ModbusFrame.bytes_to_bits(response[2:2 + response[1]], count)
+
+    async def write_multiple_coils(self, address, bits, timeout=None):
+        data = ModbusFrame.bits_to_bytes(bits)
+        await self._request(ModbusFrame.WRITE_REQUEST.pack(
+            ModbusFrame.WRITE_MULTIPLE_COILS, address, len(bits), len(data)) + data, timeout)
+
+    def _read(self, table, address, count):
+        if table == RegisterMap.COILS:
+            return self.read_coils(address, count)
+        elif table == RegisterMap.DISCRETE_INPUTS:
+            return self.read_discrete_inputs(address, count)
+        return self.read_holding_registers(address, count)
+
+    def _write(self, table, address, values):
+        if table == RegisterMap.COILS:
+            return self.write_multiple_coils(address, values)
+        return self.write_multiple_registers(address, values)
+
+    async def receive(self, tag_id):
+        register = self.register_map[tag_id]
+        return register.codec.decode(await self._read(register.table, register.address, register.count))
+
+    async def receive_many(self, tag_ids):
+        """Read many tags, the block reads of all planned ranges are in flight at the same time."""
+        reads = self.register_map.plan_reads(tag_ids)
+        blocks = await asyncio.gather(*[self._read(table, address, count) for table, address, count, _ in reads])
+
+        values = {}
+        for (table, address, count, registers), data in zip(reads, blocks):
+            values.update(self.register_map.pick(registers, address, data))
+        return {tag_id: values[tag_id] for tag_id in tag_ids}
+
+    async def send(self, tag_id, value):
+        await self.send_many({tag_id: value})
+
+    async def send_many(self, mapping):
+        await asyncio.gather(*[self._write(table, address, values)
+                               for table, address, values in self.register_map.plan_writes(mapping)])
+
+
+class AsyncServerModbus(TagServer):
+    """asyncio Modbus/TCP server serving FC1/FC2/FC3/FC5/FC6/FC15/FC16 from in-process register tables.
+
+    start()/stop() are coroutines; set()/get() are plain calls meant to be
+    used from the event loop that runs the server (or, as EventLoopServerModbus
+    does, from other threads: a tag is read and written as one array slice).
+    At most max_connections clients are served, further connections are
+    closed right after they are accepted.
+    """
+    REGISTER_COUNT = 0x10000
+    MAX_CONNECTIONS = 1024
+
+    def __init__(self, ip, port, max_connections=MAX_CONNECTIONS, reuse_port=False, register_map=None):
+        TagServer.__init__(self, ip, port, register_map)
+        self.max_connections = max_connections
+        self.reuse_port = reuse_port
+        self.registers = array('H', bytes(2 * self.REGISTER_COUNT))
+        self.bits = {RegisterMap.COILS: bytearray(self.REGISTER_COUNT),
+                     RegisterMap.DISCRETE_INPUTS: bytearray(self.REGISTER_COUNT)}
+        self.rejected_connections = 0
+        self._server = None
+        self._connections = set()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve_client, self.ip, self.port,
+                                                  reuse_port=self.reuse_port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._connections):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    @property
+    def connection_count(self):
+        return len(self._connections)
+
+    def _read(self, table, address, count):
+        if table == RegisterMap.HOLDING_REGISTERS:
+            return self.registers[address:address + count]
+        return self.bits[table][address:address + count]
+
+    def _write(self, table, address, values):
+        if table == RegisterMap.HOLDING_REGISTERS:
+            self.registers[address:address + len(values)] = array('H', values)
+        else:
+            self.bits[table][address:address + len(values)] = bytes(values)
+
+    async def _serve_client(self, reader, writer):
+        if len(self._connections) >= self.max_connections:
+            self.rejected_connections += 1
+            writer.close()
+            return
+
+        self._connections.add(writer)
+        peer = writer.get_extra_info('peername')
+        client = peer[0] if peer else ''
+        try:
+            while True:
+                header = await reader.readexactly(ModbusFrame.MBAP.size)
+                transaction_id, protocol_id, length, unit_id = ModbusFrame.MBAP.unpack(header)
+                if protocol_id != 0 or not 2 < length < 256:
+                    break
+                request = await reader.readexactly(length - 1)
+                started = time.perf_counter_ns()
+                response = self.handle_request(request)
+                self.metrics.record(request, response, client, time.perf_counter_ns() - started)
+                writer.write(ModbusFrame.MBAP.pack(transaction_id, 0, len(response) + 1, unit_id) + response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    def handle_request(self, pdu):
+        function_code = pdu[0]
+        try:
+            if function_code == ModbusFrame.READ_HOLDING_REGISTERS:
+                return self.__read_holding_registers(pdu)
+            elif function_code == ModbusFrame.WRITE_MULTIPLE_REGISTERS:
+                return self.__write_multiple_registers(pdu)
+            elif function_code == ModbusFrame.WRITE_SINGLE_REGISTER:
+                return self.__write_single_register(pdu)
+            elif function_code == ModbusFrame.READ_COILS:
+                return self.__read_bits(pdu, RegisterMap.COILS)
+            elif function_code == ModbusFrame.READ_DISCRETE_INPUTS:
+                return self.__read_bits(pdu, RegisterMap.DISCRETE_INPUTS)
+            elif function_code == ModbusFrame.WRITE_MULTIPLE_COILS:
+                return self.__write_multiple_coils(pdu)
+            elif function_code == ModbusFrame.WRITE_SINGLE_COIL:
+                return self.__write_single_coil(pdu)
+        except struct.error:
+            return ModbusFrame.exception(function_code, ModbusFrame.ILLEGAL_DATA_VALUE)
+        except TimeoutError:
+            # the register tables stayed locked by their writer
+            return ModbusFrame.exception(function_code, ModbusFrame.SERVER_DEVICE_FAILURE)
+        return ModbusFrame.exception(function_code, ModbusFrame.ILLEGAL_FUNCTION)
+
+    def __read_holding_registers(self, pdu):
+        function_code, address, count = ModbusFrame.READ_REQUEST.unpack_from(pdu)
+        if not 1 <= count <= ModbusFrame.MAX_READ_REGISTERS:
+            return ModbusFrame.exception(function_code, ModbusFrame.ILLEGAL_DATA_VALUE)
+        if address + count > self.REGISTER_COUNT:
+            return ModbusFrame.exception(function_code, ModbusFrame.ILLEGAL_DATA_ADDRESS)
+        data = self._load_registers(address, count)
+        return bytes((function_code, len(data))) + data
+
+    def __write_multiple_registers(self, pdu):
+        function_code, address, count, byte_count = ModbusFrame.WRITE_REQUEST.unpack_from(pdu)
+        if not 1 <= count <= ModbusFrame.MAX_WRITE_REGISTERS or byte_count != 2 * count \
+                or len(pdu) != ModbusFrame.WRITE_REQUEST.size + byte_count:
+            return ModbusFrame.exception(function_code, ModbusFrame.ILLEGAL_DATA_VALUE)
+        if address + count > self.REGISTER_COUNT:
+            return ModbusFrame.exception(function_code, ModbusFrame.ILLEGAL_DATA_ADDRESS)
+        self._store_registers(address, ModbusFrame.bytes_to_words(pdu[ModbusFrame.WRITE_REQUEST.size:]))
+        return ModbusFrame.WRITE_RESPONSE.pack(function_code, address, count)
+
+    def __write_single_register(self, pdu):
+        function_code, address, value = ModbusFrame.READ_REQUEST.unpack_from(pdu)
+        if address >= self.REGISTER_COUNT:
+            return ModbusFrame.exception(function_code, ModbusFrame.ILLEGAL_DATA_ADDRESS)
+        self._store_registers(address, array('H', [value]))
+        return bytes(pdu[:5])
+
+    def __read_bits(self, pdu, table):
+        function_code, address, count = ModbusFrame.READ_REQUEST.unpack_from(pdu)
+        if not 1 <= count <= ModbusFrame.MAX_READ_BITS:
+            return ModbusFrame.exception(function_code, ModbusFrame.ILLEGAL_DATA_VALUE)
+        if address + count > self.REGISTER_COUNT:
+            return ModbusFrame.exception(function_code, ModbusFrame.ILLEGAL_DATA_ADDRESS)
+        data = ModbusFrame.bits_to_bytes(self._load_bits(table, address, count))
+        return bytes((function_code, len(data))) + data
+
+    def __write_multiple_coils(self, pdu):
+        function_code, address, count, byte_count = ModbusFrame.WRITE_REQUEST.unpack_from(pdu)
+        if not 1 <= count <= ModbusFrame.MAX_WRITE_BITS or byte_count != (count + 7) // 8 \
+                or len(pdu) != ModbusFrame.WRITE_REQUEST.size + byte_count:
+            return ModbusFrame.exception(function_code, ModbusFrame.ILLEGAL_DATA_VALUE)
+        if address + count > self.REGISTER_COUNT:
+            return ModbusFrame.exception(function_code, ModbusFrame.ILLEGAL_DATA_ADDRESS)
+        self._store_coils(address, ModbusFrame.bytes_to_bits(pdu[ModbusFrame.WRITE_REQUEST.size:], count))
+        return ModbusFrame.WRITE_RESPONSE.pack(function_code, address, count)
+
+    def __write_single_coil(self, pdu):
+        function_code, address, value = ModbusFrame.READ_REQUEST.unpack_from(pdu)
+        if value not in (0, ModbusFrame.COIL_ON):
+            return ModbusFrame.exception(function_code, ModbusFrame.ILLEGAL_DATA_VALUE)
+        if address >= self.REGISTER_COUNT:
+            return ModbusFrame.exception(function_code, ModbusFrame.ILLEGAL_DATA_ADDRESS)
+        self._store_coils(address, [1 if value else 0])
+        return bytes(pdu[:5])
+
+    def _load_registers(self, address, count):
+        """Return count registers from address as big-endian bytes."""
+        return ModbusFrame.words_to_bytes(self.registers[address:address + count])
+
+    def _store_registers(self, address, words):
+        self.registers[address:address + len(words)] = words
+        self._record_client_write(RegisterMap.HOLDING_REGISTERS, address, len(words))
+
+    def _load_bits(self, table, address, count):
+        """Return count coils or discrete inputs from address as a sequence of 0/1."""
+        return self.bits[table][address:address + count]
+
+    def _store_coils(self, address, bits):
+        self.bits[RegisterMap.COILS][address:address + len(bits)] = bytes(bits)
+        self._record_client_write(RegisterMap.COILS, address, len(bits))
+
+
+class EventLoopServerModbus(Server):
+    """ServerModbus compatible server running an AsyncServerModbus on its own event loop thread.
+
+    Unlike pyModbusTCP's ModbusServer, which starts a thread per client, all
+    clients are served by one thread, so a flood of connections cannot crowd
+    the scan loop out of the GIL; max_connections caps them.
+    """
+    def __init__(self, ip, port, max_connections=AsyncServerModbus.MAX_CONNECTIONS, register_map=None):
+        Server.__init__(self, ip, port)
+        self.engine = AsyncServerModbus(ip, port, max_connections, register_map=register_map)
+        self.changes = self.engine.changes
+        self._loop = None
+        self._thread = None
+
+    def start(self):
+        if self._loop is not None:
+            return
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='modbus-{}'.format(self.port), daemon=True)
+        self._thread.start()
+        try:
+            asyncio.run_coroutine_threadsafe(self.engine.start(), self._loop).result()
+        except Exception:
+            self.__stop_loop()
+            raise
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.engine.stop(), self._loop).result()
+        self.__stop_loop()
+
+    def __stop_loop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = self._thread = None
+
     def set(self, tag_id, value):
-        self.server.data_bank.set_holding_registers(self.get_registers(tag_id),self.encode(value))
-        #DataBank.set_words(self.get_registers(tag_id), self.encode(value))
+        self.engine.set(tag_id, value)
 
     def get(self, tag_id):
-        return self.decode(self.server.data_bank.get_holding_registers(self.get_registers(tag_id), self._word_num))
-        #return self.decode(DataBank.get_words(self.get_registers(tag_id), self._word_num))
+        return self.engine.get(tag_id)
+
+    def get_changes_since(self, seq):
+        return self.engine.get_changes_since(seq)
+
+    def subscribe(self, callback):
+        self.engine.subscribe(callback)
+
+    def stats(self):
+        return self.engine.stats()
+
+
+class SharedBankServerModbus(AsyncServerModbus):
+    """Worker side of ShardedServerModbus: serves reads from the shared register bank and forwards writes.
+
+    The worker exits once its PLC process has gone; until then, reads of a
+    bank the PLC left locked answer SERVER_DEVICE_FAILURE.
+    """
+    def __init__(self, ip, port, bank, writes, max_connections=AsyncServerModbus.MAX_CONNECTIONS):
+        AsyncServerModbus.__init__(self, ip, port, max_connections, reuse_port=True)
+        self.bank = bank
+        self.writes = writes
+
+    def _load_registers(self, address, count):
+        return self.bank.read(address, count)
+
+    def _store_registers(self, address, words):
+        # the PLC process is the only writer of the bank, it applies the write on its next poll()
+        self.writes.put((RegisterMap.HOLDING_REGISTERS, address, ModbusFrame.words_to_bytes(words)))
+
+    def _load_bits(self, table, address, count):
+        return self.bank.read_bits(table, address, count)
+
+    def _store_coils(self, address, bits):
+        self.writes.put((RegisterMap.COILS, address, bytes(bits)))
+
+    async def serve(self, stop, status, parent_pid):
+        await self.start()
+        status.put(('ready', os.getpid()))
+        last_report = time.monotonic()
+        while not stop.is_set() and os.getppid() == parent_pid:
+            await asyncio.sleep(ShardedServerModbus.STOP_POLL_INTERVAL)
+            if time.monotonic() - last_report >= ShardedServerModbus.METRICS_INTERVAL:
+                status.put(('metrics', os.getpid(), self.metrics.export()))
+                last_report = time.monotonic()
+        await self.stop()
+        status.put(('metrics', os.getpid(), self.metrics.export()))
+
+
+def _serve_shard(ip, port, path, writes, status, stop, parent_pid, cpus, max_connections):
+    try:
+        if cpus:
+            os.sched_setaffinity(0, cpus)
+        server = SharedBankServerModbus(ip, port, SharedRegisterBank(path), writes, max_connections)
+        asyncio.run(server.serve(stop, status, parent_pid))
+    except Exception as e:
+        status.put(('error', '{}: {}'.format(type(e).__name__, e)))
+
+
+class ShardedServerModbus(TagServer):
+    """Modbus server whose clients are served by worker processes sharing the port through SO_REUSEPORT.
+
+    The register tables live in a SharedRegisterBank owned by this (the PLC)
+    process, the only writer of the bank; workers answer reads straight from
+    the shared memory, so reads scale over cores instead of sharing one GIL.
+    Client writes are queued to this process and applied by poll(), which the
+    PLC calls once per scan. Worker i is pinned to cpu_affinity[i % len] when
+    cpu_affinity is given. Workers report their request metrics every
+    METRICS_INTERVAL seconds, stats() adds them up.
+    """
+    START_TIMEOUT = 10.0
+    STOP_POLL_INTERVAL = 0.1
+    METRICS_INTERVAL = 1.0
 
+    def __init__(self, ip, port, workers=2, cpu_affinity=None,
+                 max_connections=AsyncServerModbus.MAX_CONNECTIONS, path=None, register_map=None):
+        TagServer.__init__(self, ip, port, register_map)
+        self.workers = workers
+        self.cpu_affinity = list(cpu_affinity or [])
+        self.max_connections = max_connections
+        self.path = path or register_bank_path('{}-{}'.format(ip, port))
+        self.bank = SharedRegisterBank(self.path, create=True)
+        self._writes = None
+        self._status = None
+        self._stop = None
+        self._processes = []
+        # worker pid -> its latest ServerMetrics.export(), which is cumulative
+        self._worker_metrics = {}
+
+    def start(self):
+        if self._processes:
+            return
+
+        self._writes = multiprocessing.Queue()
+        self._status = multiprocessing.Queue()
+        self._stop = multiprocessing.Event()
+        for i in range(self.workers):
+            cpus = [self.cpu_affinity[i % len(self.cpu_affinity)]] if self.cpu_affinity else None
+            process = multiprocessing.Process(
+                target=_serve_shard, name='modbus-{}-{}'.format(self.port, i), daemon=True,
+                args=(self.ip, self.port, self.path, self._writes, self._status, self._stop, os.getpid(), cpus,
+                      self.max_connections))
+            process.start()
+            self._processes.append(process)
+
+        try:
+            ready = 0
+            while ready < self.workers:
+                message = self._status.get(timeout=self.START_TIMEOUT)
+                if message[0] == 'error':
+                    raise OSError('Modbus worker failed to start: {}'.format(message[1]))
+                elif message[0] == 'ready':
+                    ready += 1
+                else:
+                    self.__take_status(message)
+        except Exception:
+            self.stop()
+            raise
+
+    def stop(self):
+        if not self._processes:
+            return
+        self._stop.set()
+        deadline = time.monotonic() + self.START_TIMEOUT
+        for process in self._processes:
+            # keep draining the status queue, a worker cannot exit with its last report unsent
+            while process.is_alive() and time.monotonic() < deadline:
+                self.__drain_status()
+                process.join(self.STOP_POLL_INTERVAL)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+        self.__drain_status()
+        self.poll()
+
+    def stats(self):
+        self.__drain_status()
+        metrics = ServerMetrics()
+        metrics.merge(self.metrics.export())
+        for data in list(self._worker_metrics.values()):
+            metrics.merge(data)
+        return metrics.stats()
+
+    def __drain_status(self):
+        if self._status is None:
+            return
+        while True:
+            try:
+                message = self._status.get_nowait()
+            except queue.Empty:
+                return
+            self.__take_status(message)
+
+    def __take_status(self, message):
+        if message[0] == 'metrics':
+            self._worker_metrics[message[1]] = message[2]
+
+    def close(self):
+        self.stop()
+        self.bank.unlink()
+
+    def poll(self):
+        """Apply the queued client writes to the bank and return {tag_id: value} of the tags they touched."""
+        written = {}
+        if self._writes is None:
+            return written
+        self.__drain_status()
+        while True:
+            try:
+                table, address, data = self._writes.get_nowait()
+            except queue.Empty:
+                break
+            if table == RegisterMap.HOLDING_REGISTERS:
+                self.bank.write(address, data)
+                count = len(data) // 2
+            else:
+                self.bank.write_bits(table, address, data)
+                count = len(data)
+            written.update(self._record_client_write(table, address, count))
+        return written
+
+    def _read(self, table, address, count):
+        if table == RegisterMap.HOLDING_REGISTERS:
+            return ModbusFrame.bytes_to_words(self.bank.read(address, count))
+        return self.bank.read_bits(table, address, count)
+
+    def _write(self, table, address, values):
+        if table == RegisterMap.HOLDING_REGISTERS:
+            self.bank.write(address, ModbusFrame.words_to_bytes(values))
+        else:
+            self.bank.write_bits(table, address, bytes(values))
+
+
+class ProcessServerModbus(ShardedServerModbus):
+    """Modbus server running in its own process, fed with a register image published once per scan.
+
+    The PLC keeps the authoritative tag values in a local dict, so get() and
+    set() never go through the codec or take a lock the server side holds:
+    set() only marks the tag dirty. publish(), called after the scan logic,
+    encodes the dirty tags run by run and copies them into the shared register
+    bank inside a single seqlock window, so clients always read a consistent
+    end-of-scan image and a flood of client requests costs the scan nothing
+    but the queue of their writes, applied by poll() at the start of the next
+    scan. One worker process serves all clients unless workers says otherwise.
+    """
+    def __init__(self, ip, port, workers=1, cpu_affinity=None,
+                 max_connections=AsyncServerModbus.MAX_CONNECTIONS, path=None, register_map=None):
+        ShardedServerModbus.__init__(self, ip, port, workers, cpu_affinity, max_connections, path, register_map)
+        self._values = {}
+        # fixed point tags as scaled integers, packed run by run; typed tags as [(register, encoded data)]
+        self._dirty = {}
+        self._dirty_typed = {}
+
+    def poll(self):
+        written = ShardedServerModbus.poll(self)
+        for tag_id, value in written.items():
+            self._values[tag_id] = value
+            # a client write overrides a value the PLC has not published yet
+            self._dirty.pop(tag_id, None)
+            self._dirty_typed.pop(tag_id, None)
+        return written
+
+    def publish(self):
+        if not self._dirty and not self._dirty_typed:
+            return
+        dirty, self._dirty = self._dirty, {}
+        dirty_typed, self._dirty_typed = self._dirty_typed, {}
+        with self.bank.writing():
+            for first, numbers in self.plan_writes(dirty, SharedRegisterBank.REGISTER_COUNT):
+                data = struct.pack('>{}{}'.format(len(numbers), self._integer_format), *numbers)
+                self.bank.write(self.get_registers(first), data)
+            for writes in dirty_typed.values():
+                for register, data in writes:
+                    self._write(register.table, register.address, data)
+
+    def set(self, tag_id, value):
+        register = self.register_map[tag_id]
+        if register.codec is self.register_map.fixed_point:
+            scaled = self._scale(value)
+            value = scaled / self._precision_factor
+            self._dirty[tag_id] = scaled
+        else:
+            data = register.codec.encode(value)
+            value = register.codec.decode(data)
+            writes = [(register, data)]
+            alias = self.register_map.alias(tag_id)
+            if alias is not None:
+                writes.append((alias, alias.codec.encode(value)))
+            self._dirty_typed[tag_id] = writes
+        self._values[tag_id] = value
+        self.changes.record(tag_id, value)
+
+    def get(self, tag_id):
+        if tag_id in self._values:
+            return self._values[tag_id]
+        # never set nor written by a client, whatever the bank holds
+        return self._load(tag_id)
 
 
 class ProtocolFactory:
+    ENGINE_THREADS = 'threads'
+    ENGINE_ASYNCIO = 'asyncio'
+    ENGINE_SHARDED = 'sharded'
+    ENGINE_PROCESS = 'process'
+
     @staticmethod
-    def create_client(protocol, ip, port):
+    def create_client(protocol, ip, port, pool=None, register_map=None):
         if protocol == 'ModbusWriteRequest-TCP':
-            return ClientModbus(ip, port)
+            return ClientModbus(ip, port, pool, register_map)
         else:
             raise TypeError()
 
     @staticmethod
-    def create_server(protocol, ip, port):
-        if protocol == 'ModbusWriteRequest-TCP':
-            return ServerModbus(ip, port)
-        else:
+    def create_server(protocol, ip, port, engine=ENGINE_THREADS, workers=None, cpu_affinity=None,
+                      register_map=None):
+        if protocol != 'ModbusWriteRequest-TCP':
             raise TypeError()
+
+        if engine == ProtocolFactory.ENGINE_THREADS:
+            return ServerModbus(ip, port, register_map)
+        elif engine == ProtocolFactory.ENGINE_ASYNCIO:
+            return EventLoopServerModbus(ip, port, register_map=register_map)
+        elif engine == ProtocolFactory.ENGINE_SHARDED:
+            return ShardedServerModbus(ip, port, workers or 2, cpu_affinity, register_map=register_map)
+        elif engine == ProtocolFactory.ENGINE_PROCESS:
+            return ProcessServerModbus(ip, port, workers or 1, cpu_affinity, register_map=register_map)
+        else:
+            raise ValueError('{} is not a valid server engine'.format(engine))
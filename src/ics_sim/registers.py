@@ -0,0 +1,137 @@
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+
+def register_bank_path(name):
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, 'icssim-{}.registers'.format(name))
+
+
+class SharedRegisterBank:
+    """Modbus holding registers and bits in a memory mapped file with one writer process and any number of readers.
+
+    Registers are stored big-endian, exactly as they travel on the wire, so a
+    reader copies response bytes straight out of the map; coils and discrete
+    inputs take one byte (0 or 1) per bit. The header holds a
+    sequence counter used as a seqlock over the whole bank: the writer makes
+    it odd while it writes and even again afterwards, readers retry when it
+    was odd or moved during their copy. Writes nested in writing() share one
+    odd window, so a batch of registers becomes visible at once. The process
+    that creates the bank is its writer and reads under its write lock. A
+    reader gives up with TimeoutError after READ_RETRIES attempts, so a
+    writer that died mid-update does not hang its readers.
+
+    Layout: header (magic, sequence) | REGISTER_COUNT uint16 registers | REGISTER_COUNT coils |
+            REGISTER_COUNT discrete inputs
+    """
+    MAGIC = b'ICSREG02'
+    HEADER = struct.Struct('<8sQ')
+    SEQ_OFFSET = 8
+    REGISTER_COUNT = 0x10000
+    BIT_TABLES = ('coils', 'discrete_inputs')
+    SIZE = HEADER.size + 2 * REGISTER_COUNT + len(BIT_TABLES) * REGISTER_COUNT
+    READ_RETRIES = 10000
+
+    def __init__(self, path, create=False):
+        self.path = path
+        self.owner = create
+        if create:
+            temp_path = '{}.{}.tmp'.format(path, os.getpid())
+            with open(temp_path, 'wb') as f:
+                f.write(self.HEADER.pack(self.MAGIC, 0))
+                f.write(bytes(self.SIZE - self.HEADER.size))
+            os.replace(temp_path, path)
+
+        with open(path, 'r+b') as f:
+            self._mm = mmap.mmap(f.fileno(), self.SIZE)
+        if self._mm[:len(self.MAGIC)] != self.MAGIC:
+            self._mm.close()
+            raise ValueError('{} is not an ICSSIM register bank'.format(path))
+
+        buffer = memoryview(self._mm)
+        self._seq = buffer[self.SEQ_OFFSET:self.HEADER.size].cast('Q')
+        offset = self.HEADER.size + 2 * self.REGISTER_COUNT
+        self._registers = buffer[self.HEADER.size:offset]
+        self._bits = {}
+        for table in self.BIT_TABLES:
+            self._bits[table] = buffer[offset:offset + self.REGISTER_COUNT]
+            offset += self.REGISTER_COUNT
+        buffer.release()
+        self._depth = 0
+        self._write_lock = threading.RLock()
+
+    @property
+    def seq(self):
+        return self._seq[0]
+
+    @contextmanager
+    def writing(self):
+        with self._write_lock:
+            self._depth += 1
+            if self._depth == 1:
+                self._seq[0] += 1
+            try:
+                yield self
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._seq[0] += 1
+
+    def write(self, address, data):
+        """Store big-endian register bytes starting at register address."""
+        if address < 0 or address + len(data) // 2 > self.REGISTER_COUNT:
+            raise ValueError('registers {}..{} are out of range'.format(address, address + len(data) // 2 - 1))
+        with self.writing():
+            self._registers[2 * address:2 * address + len(data)] = data
+
+    def write_bits(self, table, address, data):
+        """Store one byte (0 or 1) per bit starting at address of table ('coils' or 'discrete_inputs')."""
+        if address < 0 or address + len(data) > self.REGISTER_COUNT:
+            raise ValueError('{} {}..{} are out of range'.format(table, address, address + len(data) - 1))
+        with self.writing():
+            self._bits[table][address:address + len(data)] = data
+
+    def read(self, address, count):
+        """Return count registers from address as big-endian bytes, a consistent snapshot of the bank."""
+        return self.__read(self._registers, 2 * address, 2 * (address + count))
+
+    def read_bits(self, table, address, count):
+        """Return count bits of table from address as one byte (0 or 1) per bit."""
+        return self.__read(self._bits[table], address, address + count)
+
+    def __read(self, view, start, end):
+        if self.owner:
+            with self._write_lock:
+                return bytes(view[start:end])
+
+        seq = self._seq
+        for _ in range(self.READ_RETRIES):
+            before = seq[0]
+            if before & 1:
+                # a write is in progress, let the writer run
+                time.sleep(0)
+                continue
+            data = bytes(view[start:end])
+            if seq[0] == before:
+                return data
+        raise TimeoutError('{} is still being written after {} reads'.format(self.path, self.READ_RETRIES))
+
+    def close(self):
+        if self._mm is None:
+            return
+        self._seq.release()
+        self._registers.release()
+        for view in self._bits.values():
+            view.release()
+        self._mm.close()
+        self._mm = self._seq = self._registers = self._bits = None
+
+    def unlink(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
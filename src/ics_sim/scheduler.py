@@ -0,0 +1,113 @@
+import time
+
+
+class ScanScheduler:
+    """Fixed-period scan timing on the monotonic clock with absolute deadlines.
+
+    Deadlines lie on a grid of period_ms from start(), so the error of one
+    wait never carries over into the next and wall clock steps (NTP,
+    container clock changes) have no effect. wait() sleeps until spin_us
+    before the deadline and busy-waits the rest, which keeps periods of a
+    few milliseconds accurate where time.sleep alone is not.
+
+    When a scan ends after the next deadline (it ran longer than a period
+    or started late) the overrun policy decides what happens to the
+    deadlines it ran over:
+
+    SKIP      drop them and continue at the next grid deadline (phase is kept)
+    CATCH_UP  run them back to back until the scan is on the grid again
+    STRETCH   run the next scan right away and continue the grid from there
+
+    Counters: cycles, late (started more than tolerance_us after the
+    deadline), overruns (ran longer than a period) and missed (deadlines
+    dropped by SKIP and STRETCH).
+    """
+    SKIP = 'skip'
+    CATCH_UP = 'catch-up'
+    STRETCH = 'stretch'
+    POLICIES = (SKIP, CATCH_UP, STRETCH)
+
+    SPIN_US = 100
+
+    def __init__(self, period_ms, overrun=SKIP, spin_us=SPIN_US, tolerance_us=None):
+        if period_ms <= 0:
+            raise ValueError('scan period must be positive, not {}'.format(period_ms))
+        if overrun not in self.POLICIES:
+            raise ValueError('overrun policy must be one of {}, not {}'.format(self.POLICIES, overrun))
+        self.period = int(period_ms * 1000000)
+        self.overrun = overrun
+        self.spin = int(spin_us * 1000)
+        # by default a scan starting a tenth of a period late counts as late
+        self.tolerance = self.period // 10 if tolerance_us is None else int(tolerance_us * 1000)
+        self.start()
+
+    def start(self, now=None):
+        """Anchor the grid at now: the first deadline is one period later."""
+        self.origin = time.monotonic_ns() if now is None else now
+        self.deadline = self.origin + self.period
+        self.due = self.origin
+        self.scan_start = self.scan_end = self.origin
+        self.lateness = 0
+        self.cycles = 0
+        self.late = 0
+        self.overruns = 0
+        self.missed = 0
+        self.max_lateness = 0
+
+    def remaining(self, now=None):
+        """Nanoseconds until the next deadline, negative when it has passed."""
+        return self.deadline - (time.monotonic_ns() if now is None else now)
+
+    def wait(self, stop_event=None):
+        """Block until the next deadline; returns False if stop_event was set meanwhile."""
+        remaining = self.remaining()
+        if remaining > self.spin:
+            timeout = (remaining - self.spin) / 1e9
+            if stop_event is not None:
+                if stop_event.wait(timeout):
+                    return False
+            else:
+                time.sleep(timeout)
+        deadline = self.deadline
+        while time.monotonic_ns() < deadline:
+            pass
+        return True
+
+    def begin(self, now=None):
+        """Mark the start of the scan due at the current deadline and return its lateness in nanoseconds."""
+        self.scan_start = time.monotonic_ns() if now is None else now
+        self.due = self.deadline
+        self.lateness = self.scan_start - self.due
+        self.cycles += 1
+        if self.lateness > self.tolerance:
+            self.late += 1
+        if self.lateness > self.max_lateness:
+            self.max_lateness = self.lateness
+        return self.lateness
+
+    def end(self, now=None):
+        """Mark the end of the scan and move the deadline on according to the overrun policy."""
+        self.scan_end = time.monotonic_ns() if now is None else now
+        if self.scan_end - self.scan_start > self.period:
+            self.overruns += 1
+        self.deadline = self.due + self.period
+        if self.scan_end <= self.deadline:
+            return
+        if self.overrun == self.SKIP:
+            skipped = (self.scan_end - self.deadline) // self.period + 1
+            self.deadline += skipped * self.period
+            self.missed += skipped
+        elif self.overrun == self.STRETCH:
+            self.missed += (self.scan_end - self.deadline) // self.period
+            self.deadline = self.scan_end
+
+    def stats(self):
+        return {
+            'period_us': self.period / 1000,
+            'policy': self.overrun,
+            'cycles': self.cycles,
+            'late': self.late,
+            'overruns': self.overruns,
+            'missed': self.missed,
+            'max_lateness_us': round(self.max_lateness / 1000, 1),
+        }
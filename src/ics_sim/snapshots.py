@@ -0,0 +1,226 @@
+"""Columnar binary recording of per-scan PLC values (see PLC.set_record_variables).
+
+A recording is a directory holding schema.json and one sub directory per
+chunk of rows, with one NumPy .npy file per column:
+
+    snapshots_PLC1/schema.json
+    snapshots_PLC1/chunk-00000/000.npy  (time)
+    snapshots_PLC1/chunk-00000/001.npy  (current_loop)
+    ...
+
+The .npy files are written without NumPy (format version 1.0, one
+dimension), so numpy.load() reads them directly. snapshots_to_csv()
+turns a recording into the CSV the recorder used to write:
+
+    python -m ics_sim.snapshots logs/snapshots_PLC1 [logs/snapshots_PLC1.csv]
+"""
+import argparse
+import ast
+import json
+import os
+import shutil
+import sys
+import threading
+from array import array
+from datetime import datetime
+
+SCHEMA_FILE = 'schema.json'
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+NPY_ALIGNMENT = 64
+
+_ORDER = '<' if sys.byteorder == 'little' else '>'
+# column format -> (array typecode, .npy descr, conversion of stored values)
+FORMATS = {
+    'float64': ('d', _ORDER + 'f8', float),
+    'float32': ('f', _ORDER + 'f4', float),
+    'int64': ('q', _ORDER + 'i8', int),
+    'int32': ('i', _ORDER + 'i4', int),
+    'int16': ('h', _ORDER + 'i2', int),
+    'bool': ('B', '|b1', bool),
+}
+STRING_PREFIX = 'string'
+
+
+def string_format(length):
+    """Column format of UTF-8 strings of up to length bytes."""
+    return '{}{}'.format(STRING_PREFIX, length)
+
+
+def _npy_header(descr, rows):
+    header = "{{'descr': '{}', 'fortran_order': False, 'shape': ({},), }}".format(descr, rows)
+    # magic, version and the 2 byte header length, then the header padded with spaces and ended by a newline
+    padding = -(len(NPY_MAGIC) + 2 + len(header) + 1) % NPY_ALIGNMENT
+    header = (header + ' ' * padding + '\n').encode('latin1')
+    return NPY_MAGIC + len(header).to_bytes(2, 'little') + header
+
+
+def write_npy(path, descr, rows, data):
+    with open(path, 'wb') as file:
+        file.write(_npy_header(descr, rows))
+        file.write(data)
+
+
+def read_npy(path):
+    """Return (descr, rows, raw data) of a one dimensional .npy file."""
+    with open(path, 'rb') as file:
+        content = file.read()
+    if content[:6] != NPY_MAGIC[:6]:
+        raise ValueError('{} is not a .npy file'.format(path))
+    if content[6] == 1:
+        length, start = int.from_bytes(content[8:10], 'little'), 10
+    else:
+        length, start = int.from_bytes(content[8:12], 'little'), 12
+    header = ast.literal_eval(content[start:start + length].decode('latin1'))
+    if header['fortran_order'] or len(header['shape']) != 1:
+        raise ValueError('{} is not a one dimensional column'.format(path))
+    return header['descr'], header['shape'][0], content[start + length:]
+
+
+class _Column:
+    def __init__(self, name, column_format, rows):
+        self.name = name
+        self.format = column_format
+        if column_format.startswith(STRING_PREFIX):
+            self.width = int(column_format[len(STRING_PREFIX):])
+            self.descr = '|S{}'.format(self.width)
+            self.buffer = bytearray(self.width * rows)
+        else:
+            typecode, self.descr, self.convert = FORMATS[column_format]
+            self.width = None
+            self.buffer = array(typecode, bytes(array(typecode).itemsize * rows))
+
+    def set(self, row, value):
+        if self.width is None:
+            self.buffer[row] = self.convert(value)
+        else:
+            data = str(value).encode('utf-8')[:self.width]
+            self.buffer[row * self.width:(row + 1) * self.width] = data.ljust(self.width, b'\0')
+
+    def data(self, rows):
+        if self.width is None:
+            return memoryview(self.buffer)[:rows].tobytes()
+        return bytes(self.buffer[:rows * self.width])
+
+
+class SnapshotRecorder:
+    """Appends one fixed-width row per scan into preallocated column buffers.
+
+    columns is a list of (name, format) with formats from FORMATS or
+    string_format(length). Every chunk_rows rows (and on flush() and
+    close()) the buffers are written as a chunk of .npy files, so a scan
+    only stores numbers into the buffers. Chunks appear atomically, a
+    recording can be read while it grows. Like the CSV it replaces, a new
+    recorder starts path over: chunks of an earlier recording are removed.
+    """
+    CHUNK_ROWS = 4096
+
+    def __init__(self, path, columns, chunk_rows=CHUNK_ROWS, name=None):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self._columns = [_Column(column, column_format, chunk_rows) for column, column_format in columns]
+        self._rows = 0
+        self._chunks = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+        os.makedirs(path, exist_ok=True)
+        for entry in os.listdir(path):
+            if entry.startswith(('chunk-', '.chunk-')):
+                shutil.rmtree(os.path.join(path, entry))
+        schema = {
+            'name': name,
+            'version': 1,
+            'chunk_rows': chunk_rows,
+            'columns': [{'name': column.name, 'format': column.format, 'descr': column.descr,
+                         'file': '{:03d}.npy'.format(i)} for i, column in enumerate(self._columns)],
+        }
+        with open(os.path.join(path, SCHEMA_FILE), 'w') as file:
+            json.dump(schema, file, indent=2)
+
+    def append(self, values):
+        with self._lock:
+            if self._closed:
+                return
+            row = self._rows
+            for column, value in zip(self._columns, values):
+                column.set(row, value)
+            self._rows = row + 1
+            if self._rows == self.chunk_rows:
+                self.__write_chunk()
+
+    def flush(self):
+        with self._lock:
+            if self._rows:
+                self.__write_chunk()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            if self._rows:
+                self.__write_chunk()
+            self._closed = True
+
+    def __write_chunk(self):
+        chunk = 'chunk-{:05d}'.format(self._chunks)
+        temp_path = os.path.join(self.path, '.' + chunk)
+        os.makedirs(temp_path, exist_ok=True)
+        for i, column in enumerate(self._columns):
+            write_npy(os.path.join(temp_path, '{:03d}.npy'.format(i)), column.descr, self._rows,
+                      column.data(self._rows))
+        os.replace(temp_path, os.path.join(self.path, chunk))
+        self._chunks += 1
+        self._rows = 0
+
+
+def read_snapshots(path):
+    """Yield the rows of a recording as lists of Python values, in column order of its schema."""
+    with open(os.path.join(path, SCHEMA_FILE)) as file:
+        schema = json.load(file)
+    columns = schema['columns']
+    chunks = sorted(entry for entry in os.listdir(path) if entry.startswith('chunk-'))
+    for chunk in chunks:
+        values = []
+        for column in columns:
+            descr, rows, data = read_npy(os.path.join(path, chunk, column['file']))
+            if descr.startswith('|S'):
+                width = int(descr[2:])
+                values.append([data[i * width:(i + 1) * width].rstrip(b'\0').decode('utf-8', 'replace')
+                               for i in range(rows)])
+            else:
+                typecode = FORMATS[column['format']][0]
+                items = array(typecode)
+                items.frombytes(data[:rows * items.itemsize])
+                if descr[0] in '<>' and descr[0] != _ORDER:
+                    items.byteswap()
+                values.append([bool(item) for item in items] if column['format'] == 'bool' else items.tolist())
+        for row in zip(*values):
+            yield list(row)
+
+
+def snapshots_to_csv(path, output=None):
+    """Write a recording as CSV in the layout of the former snapshots_<name>.csv and return the CSV path."""
+    if output is None:
+        output = path.rstrip(os.sep) + '.csv'
+    with open(os.path.join(path, SCHEMA_FILE)) as file:
+        names = [column['name'] for column in json.load(file)['columns']]
+    with open(output, 'w') as file:
+        file.write(''.join('{}, '.format(name) for name in names) + '\n')
+        for row in read_snapshots(path):
+            # the first column is a Unix timestamp, shown as datetime.now() used to be
+            row[0] = datetime.fromtimestamp(row[0])
+            file.write(''.join('{}, '.format(value) for value in row) + '\n')
+    return output
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert a PLC snapshot recording to CSV')
+    parser.add_argument('path', help='recording directory, e.g. logs/snapshots_PLC1')
+    parser.add_argument('output', nargs='?', help='CSV file (default: the directory name + .csv)')
+    args = parser.parse_args(argv)
+    print(snapshots_to_csv(args.path, args.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
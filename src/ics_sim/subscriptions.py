@@ -0,0 +1,216 @@
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+
+
+def change_feed_path(name):
+    return os.path.join(tempfile.gettempdir(), 'icssim-{}.changes'.format(name))
+
+
+class ChangeLog:
+    """Keeps the last value of every key with a monotonically increasing change sequence.
+
+    Only real changes advance the sequence, so get_changes_since() returns a
+    delta proportional to the activity since the caller's last sequence.
+    Subscribers are called synchronously with (seq, {key: value}) after every
+    recorded change.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._entries = {}
+        self._subscribers = []
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def record(self, key, value):
+        return self.record_many({key: value})
+
+    def record_many(self, mapping):
+        changes = {}
+        with self._lock:
+            for key, value in mapping.items():
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] == value:
+                    continue
+                self._seq += 1
+                self._entries[key] = (self._seq, value)
+                changes[key] = value
+            seq = self._seq
+            subscribers = list(self._subscribers)
+
+        if changes:
+            for callback in subscribers:
+                callback(seq, changes)
+        return changes
+
+    def get_changes_since(self, seq):
+        with self._lock:
+            changes = {key: value for key, (key_seq, value) in self._entries.items() if key_seq > seq}
+            return self._seq, changes
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers.remove(callback)
+
+
+class ChangePublisher:
+    """Pushes ChangeLog deltas to local subscribers over a Unix datagram socket.
+
+    Subscribers register by sending their own socket path; they get the full
+    state first and then every delta published after it. publish() is meant to
+    be called once per scan; it also sends an empty heartbeat when nothing
+    changed for HEARTBEAT seconds so subscribers can tell a quiet feed from a
+    dead one. Opening a path a live publisher owns raises FileExistsError; a
+    socket file left by a publisher that is gone is replaced.
+    """
+    HEARTBEAT = 1.0
+
+    def __init__(self, change_log, path):
+        self._change_log = change_log
+        self._path = path
+        # subscriber address -> [last sent seq, last send time]
+        self._subscribers = {}
+
+        if os.path.exists(path):
+            if self.__is_live(path):
+                raise FileExistsError('another change feed publishes on {}'.format(path))
+            os.remove(path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.bind(path)
+        self._socket.setblocking(False)
+
+    @staticmethod
+    def __is_live(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            probe.connect(path)
+            return True
+        except (ConnectionRefusedError, FileNotFoundError):
+            return False
+        finally:
+            probe.close()
+
+    def publish(self):
+        self.__accept_subscribers()
+        if not self._subscribers:
+            return
+
+        now = time.monotonic()
+        for address, (since, last_send) in list(self._subscribers.items()):
+            seq, changes = self._change_log.get_changes_since(since)
+            if changes or now - last_send >= self.HEARTBEAT:
+                self.__send(address, since, seq, changes, now)
+
+    def __accept_subscribers(self):
+        while True:
+            try:
+                data, address = self._socket.recvfrom(1024)
+            except (BlockingIOError, InterruptedError):
+                return
+            if address:
+                # (re)subscribing always starts with the full state
+                self._subscribers[address] = [0, 0]
+
+    def __send(self, address, since, seq, changes, now):
+        # changes are sent as pairs so non-string keys (tag ids) survive the JSON round-trip
+        message = json.dumps({'since': since, 'seq': seq, 'changes': list(changes.items())}).encode('utf-8')
+        try:
+            self._socket.sendto(message, address)
+            self._subscribers[address] = [seq, now]
+        except (FileNotFoundError, ConnectionRefusedError):
+            del self._subscribers[address]
+        except BlockingIOError:
+            # the subscriber is not draining its socket, it resubscribes when it notices the gap
+            pass
+
+    def close(self):
+        self._socket.close()
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+
+class ChangeSubscriber:
+    """Receives deltas from a ChangePublisher and keeps the latest value of every key."""
+    RESUBSCRIBE_INTERVAL = ChangePublisher.HEARTBEAT * 2
+
+    def __init__(self, publisher_path, callback=None, stale_after=ChangePublisher.HEARTBEAT * 3):
+        self._publisher_path = publisher_path
+        self._callback = callback
+        self._stale_after = stale_after
+        self._path = '{}.{}.{}'.format(publisher_path, os.getpid(), id(self))
+        self._values = {}
+        self._seq = None
+        self._last_message = 0
+        self._running = threading.Event()
+
+        if os.path.exists(self._path):
+            os.remove(self._path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.bind(self._path)
+        self._socket.settimeout(self.RESUBSCRIBE_INTERVAL)
+        self._thread = threading.Thread(target=self.__receive_loop, daemon=True)
+
+    def start(self):
+        self._running.set()
+        self._thread.start()
+
+    def stop(self):
+        self._running.clear()
+        self._socket.close()
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+    def is_fresh(self):
+        return self._seq is not None and time.monotonic() - self._last_message < self._stale_after
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+    def values(self):
+        return dict(self._values)
+
+    def __subscribe(self):
+        self._seq = None
+        try:
+            self._socket.sendto(b'subscribe', self._publisher_path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            pass
+
+    def __receive_loop(self):
+        self.__subscribe()
+        while self._running.is_set():
+            try:
+                data = self._socket.recv(1 << 20)
+            except socket.timeout:
+                self.__subscribe()
+                continue
+            except OSError:
+                return
+
+            message = json.loads(data.decode('utf-8'))
+            if self._seq is None:
+                if message['since'] != 0:
+                    # still waiting for the full state
+                    continue
+            elif message['since'] != self._seq:
+                logging.debug('change feed gap detected, resubscribing to %s', self._publisher_path)
+                self.__subscribe()
+                continue
+
+            changes = {key: value for key, value in message['changes']}
+            self._values.update(changes)
+            self._seq = message['seq']
+            self._last_message = time.monotonic()
+            if changes and self._callback:
+                self._callback(self._seq, changes)
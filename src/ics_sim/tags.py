@@ -0,0 +1,45 @@
+class TagTable:
+    """Tag metadata compiled once from a TAG_LIST style dict.
+
+    Every tag gets a dense integer index (in TAG_LIST order) and its
+    attributes are stored in plain lists indexed by it, so hot paths index
+    lists instead of walking nested dicts. Use resolve() (or ``index``) to go
+    from a tag name to its index at API boundaries.
+    """
+    INPUT = 'input'
+    OUTPUT = 'output'
+    STRING = 'string'
+
+    def __init__(self, tags):
+        self.names = list(tags)
+        self.index = {name: i for i, name in enumerate(self.names)}
+
+        self.ids = [tags[name]['id'] for name in self.names]
+        self.plcs = [tags[name]['plc'] for name in self.names]
+        self.inputs = [tags[name]['type'] == self.INPUT for name in self.names]
+        self.outputs = [tags[name]['type'] == self.OUTPUT for name in self.names]
+        self.faults = [tags[name].get('fault', 0.0) for name in self.names]
+        self.defaults = [tags[name].get('default', 0) for name in self.names]
+        self.datatypes = [tags[name].get('datatype') for name in self.names]
+        # the storage connectors hold numbers only, string tags live in their PLC's registers alone
+        self.stored = [datatype != self.STRING for datatype in self.datatypes]
+
+        self._by_id = {(plc, tag_id): i for i, (plc, tag_id) in enumerate(zip(self.plcs, self.ids))}
+
+    def __len__(self):
+        return len(self.names)
+
+    def resolve(self, tag):
+        return self.index[tag]
+
+    def resolve_id(self, plc_id, tag_id):
+        return self._by_id[(plc_id, tag_id)]
+
+    def local(self, plc_id):
+        return [i for i, plc in enumerate(self.plcs) if plc == plc_id]
+
+    def local_inputs(self, plc_id):
+        return [i for i in self.local(plc_id) if self.inputs[i]]
+
+    def local_outputs(self, plc_id):
+        return [i for i in self.local(plc_id) if self.outputs[i]]
@@ -1,42 +1,72 @@
-import random
+import argparse
+import logging
+import os
 import time
 
-from pyModbusTCP.server import ModbusServer
-
-from Configs import TAG
 from HMI1 import HMI1
 from FactorySimulation import FactorySimulation
 from PLC1 import PLC1
 
-
-import memcache
-from Configs import Connection, TAG
-
-from ics_sim.protocol import ProtocolFactory
-from ics_sim.connectors import FileConnector, ConnectorFactory
-
-factory = FactorySimulation()
-factory.start()
-
-
-
-plc1 = PLC1()
-# plc1.set_record_variables(True)
-plc1.start()
-
-
-
-
-hmi1 = HMI1()
-hmi1.start()
-
-"""
-
-connector = ConnectorFactory.build(Connection.File_CONNECTION)
-"""
-
-
-
-
-
-
+from ics_sim.Device import RunnableProcess
+from ics_sim.logs import configure_logging
+
+
+def setup_plc1(plc1):
+    # plc1.set_record_variables(True)
+    # when all devices share this host, HMI1 can follow PLC1's change feed (hmi1.follow_change_feed(1))
+    # instead of polling every tag
+    # plc1.enable_change_feed()
+    plc1.enable_server_metrics()
+
+
+DEVICES = [(FactorySimulation, None), (PLC1, setup_plc1), (HMI1, None)]
+
+
+def start_threads():
+    for factory, setup in DEVICES:
+        device = factory()
+        if setup is not None:
+            setup(device)
+        device.start()
+
+
+def start_processes(cpus):
+    """Run every device in a process of its own, device i pinned to cpus[i % len(cpus)], until Ctrl-C."""
+    processes = []
+    for i, (factory, setup) in enumerate(DEVICES):
+        process = RunnableProcess(factory, setup=setup, cpu_affinity=[cpus[i % len(cpus)]] if cpus else None)
+        process.start()
+        processes.append(process)
+
+    try:
+        while any(process.is_alive() for process in processes):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in reversed(processes):
+            process.stop()
+            if process.exitcode:
+                logging.error('%s exited with code %s', process.name, process.exitcode)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Run the factory simulation, PLC1 and HMI1 on this host')
+    parser.add_argument('--processes', action='store_true',
+                        help='run every device in its own process instead of a thread')
+    parser.add_argument('--cpus', type=lambda s: [int(cpu) for cpu in s.split(',')],
+                        help='comma separated CPUs the device processes are pinned to, one each in turn')
+    parser.add_argument('--headless', action='store_true', help='plain console output without colours')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    configure_logging(headless=args.headless or None)
+    if args.processes:
+        cpus = args.cpus
+        if cpus is None and hasattr(os, 'sched_getaffinity'):
+            cpus = sorted(os.sched_getaffinity(0))
+        start_processes(cpus)
+    else:
+        start_threads()
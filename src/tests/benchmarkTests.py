@@ -0,0 +1,30 @@
+import os
+import tempfile
+import unittest
+
+from benchmarks.connectorBenchmark import compare, make_connection, percentile, run_scenario
+
+
+class BenchmarkTests(unittest.TestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 1001))
+        self.assertEqual(percentile(values, 50), 500)
+        self.assertEqual(percentile(values, 99), 990)
+        self.assertEqual(percentile(values, 99.9), 999)
+        self.assertEqual(percentile([], 99), 0.0)
+
+    def test_compare(self):
+        baseline = {'results': {'shm/single': {'ops_per_sec': 1000.0, 'p99_us': 100.0}}}
+        self.assertEqual(compare({'shm/single': {'ops_per_sec': 900.0, 'p99_us': 110.0}}, baseline, 0.25), [])
+        regressions = compare({'shm/single': {'ops_per_sec': 500.0, 'p99_us': 200.0}}, baseline, 0.25)
+        self.assertEqual(len(regressions), 2)
+
+    def test_run_scenario(self):
+        with tempfile.TemporaryDirectory() as directory:
+            connection = make_connection('shm', directory, None)
+            result = run_scenario(connection, 8, 100, 0.5, 4, threads=2, processes=1)
+            self.assertEqual(result['ops'], 200)
+            self.assertGreater(result['ops_per_sec'], 0)
+            self.assertLessEqual(result['p50_us'], result['p999_us'])
+            self.assertTrue(os.path.exists(connection['path']))
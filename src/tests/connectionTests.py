@@ -1,8 +1,16 @@
+import asyncio
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
 import unittest
 from Configs import Connection
 
+from benchmarks.fakeMemcached import FakeMemcached
 
-from ics_sim.connectors import SQLiteConnector, MemcacheConnector, ConnectorFactory
+
+from ics_sim.connectors import SQLiteConnector, MemcacheConnector, FileConnector, ConnectorFactory, AsyncConnector
 
 
 class ConnectionTests(unittest.TestCase):
@@ -29,6 +37,140 @@ class ConnectionTests(unittest.TestCase):
         except Exception:
             self.fail("cannot init values in the connection!")
 
+    def test_sqlite_connection_lifecycle(self):
+        connection = SQLiteConnector(Connection.SQLITE_CONNECTION)
+        connection.initialize([('value1', 1)])
+
+        results = []
+        worker = threading.Thread(target=lambda: results.append(connection.get('value1')))
+        worker.start()
+        worker.join()
+        self.assertEqual(results, [1], 'sqliteConnection is not usable from another thread')
+
+        connection.close()
+        connection.set('value1', 5)
+        self.assertEqual(connection.get('value1'), 5, 'sqliteConnection is not reopened after close')
+        connection.close()
+
+    def test_sqlite_bulk_access(self):
+        connection = SQLiteConnector(Connection.SQLITE_CONNECTION)
+        connection.initialize([('value1', 1), ('value2', 2), ('value3', 3)])
+
+        connection.set_many({'value1': 10, 'value3': 30})
+        self.assertEqual(connection.get_many(['value1', 'value2', 'value3']),
+                         {'value1': 10, 'value2': 2, 'value3': 30},
+                         'get_many/set_many in sqliteConnection is not working correctly')
+        self.assertEqual(connection.get_many(['missing']), {'missing': None})
+        connection.close()
+
+    def test_sqlite_changes(self):
+        connection = SQLiteConnector(Connection.SQLITE_CONNECTION)
+        connection.initialize([('value1', 1), ('value2', 2)])
+
+        seq, changes = connection.get_changes_since(0)
+        self.assertEqual(changes, {'value1': 1, 'value2': 2})
+
+        notified = []
+        connection.subscribe(lambda new_seq, new_changes: notified.append(new_changes))
+        connection.poll_changes()
+        connection.set('value1', 1)
+        connection.set('value2', 20)
+        new_seq, changes = connection.get_changes_since(seq)
+        self.assertEqual(changes, {'value2': 20}, 'sqliteConnection change sequence reports unchanged tags')
+        self.assertGreater(new_seq, seq)
+
+        connection.poll_changes()
+        self.assertEqual(notified, [{'value1': 1, 'value2': 2}, {'value2': 20}])
+        connection.close()
+
+    def test_sqlite_old_schema(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'old.sqlite')
+            with sqlite3.connect(path) as conn:
+                conn.execute('CREATE TABLE fp_table (name TEXT NOT NULL, value REAL, PRIMARY KEY(name))')
+                conn.execute("INSERT INTO fp_table VALUES ('value1', 1)")
+            conn.close()
+
+            connection = SQLiteConnector({'type': 'sqlite', 'path': path, 'name': 'fp_table'})
+            connection.initialize([('value2', 2)], clear_old=False)
+            connection.set('value1', 10)
+            seq, changes = connection.get_changes_since(0)
+            self.assertEqual(changes, {'value1': 10, 'value2': 2}, 'a table without seq column is not migrated')
+            connection.close()
+
+    def test_shm_connection(self):
+        writer = ConnectorFactory.build(Connection.SHM_CONNECTION)
+        reader = ConnectorFactory.build(Connection.SHM_CONNECTION)
+        writer.initialize([('value1', 1), ('value2', 2)])
+
+        self.assertEqual(reader.get('value1'), 1, 'get function in SharedMemoryConnector is not working correctly')
+        reader.set('value2', 20.5)
+        self.assertEqual(writer.get('value2'), 20.5, 'set function in SharedMemoryConnector is not working correctly')
+
+        writer.initialize([('value1', 1), ('value2', 2), ('value3', 3)])
+        self.assertEqual(reader.get_many(['value2', 'value3']), {'value2': 2, 'value3': 3},
+                         'SharedMemoryConnector readers do not follow a re-initialized store')
+        writer.close()
+        reader.close()
+
+    def test_shm_writers(self):
+        writer = ConnectorFactory.build(Connection.SHM_CONNECTION)
+        writer.initialize([('value1', 0), ('value2', 0)])
+
+        def write(count):
+            connector = ConnectorFactory.build(Connection.SHM_CONNECTION)
+            for i in range(count):
+                connector.set_many({'value1': i, 'value2': -i})
+
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=write, args=(2000,)) for _ in range(2)]
+        for process in processes:
+            process.start()
+        write(2000)
+        for process in processes:
+            process.join()
+
+        slot = writer._slot('value1')
+        self.assertEqual(writer._seqs[slot], 2 * (3 * 2000 + 1), 'SharedMemoryConnector writes interleaved')
+        self.assertEqual(writer.get('value1'), 1999)
+
+        # a writer that died in the middle of an update
+        writer._seqs[slot] += 1
+        reader = ConnectorFactory.build(Connection.SHM_CONNECTION)
+        reader.READ_RETRIES = 10
+        with self.assertRaises(TimeoutError):
+            reader.get('value1')
+        writer.set('value1', 5)
+        self.assertEqual(reader.get('value1'), 5, 'SharedMemoryConnector does not repair an odd sequence')
+        writer.close()
+        reader.close()
+
+    def test_file_connection(self):
+        writer = FileConnector(Connection.File_CONNECTION, flush_interval=60)
+        reader = FileConnector(Connection.File_CONNECTION)
+        writer.initialize([('value1', 1), ('value2', 2)])
+        self.assertEqual(reader.get('value1'), 1, 'get function in FileConnector is not working correctly')
+
+        writer.set('value1', 10)
+        self.assertEqual(writer.get('value1'), 10, 'FileConnector does not read its own pending writes')
+        self.assertEqual(reader.get('value1'), 1, 'FileConnector flushed before the flush interval')
+
+        writer.flush()
+        self.assertEqual(reader.get('value1'), 10, 'FileConnector readers do not see flushed writes')
+        self.assertEqual(reader.get_many(['value1', 'value2']), {'value1': 10, 'value2': 2})
+
+    def test_async_connection(self):
+        async def scenario():
+            connection = AsyncConnector.build(Connection.SQLITE_CONNECTION)
+            await connection.initialize([('value1', 1), ('value2', 2)], clear_old=True)
+            await connection.set_many({'value1': 10})
+            values = await connection.get_many(['value1', 'value2'])
+            await connection.close()
+            return values
+
+        self.assertEqual(asyncio.run(scenario()), {'value1': 10, 'value2': 2},
+                         'AsyncConnector is not working correctly')
+
     def test_memcache_connection(self):
         try:
             connection = MemcacheConnector(Connection.MEMCACHE_LOCAL_CONNECTION)
@@ -48,6 +190,35 @@ class ConnectionTests(unittest.TestCase):
         except Exception:
             self.fail("cannot init values in the connection!")
 
+    def test_memcache_packed_values(self):
+        server = FakeMemcached(port=0).start()
+        try:
+            connection = {'type': 'memcache', 'path': server.address, 'name': 'packed'}
+            writer = MemcacheConnector(connection)
+            reader = MemcacheConnector(connection)
+            self.assertIs(writer.memcached_client, reader.memcached_client, 'MemcacheConnector clients are not shared')
+
+            writer.initialize([('value1', 1), ('value2', 2.5), ('value3', True)])
+            flags, data = server.data[b'packed:1:value2']
+            self.assertEqual(data, MemcacheConnector.FLOAT_FORMAT.pack(b'd', 2.5), 'numbers are not stored packed')
+            values = reader.get_many(['value1', 'value2', 'value3'])
+            self.assertEqual(values, {'value1': 1, 'value2': 2.5, 'value3': 1})
+            self.assertIs(type(values['value1']), int, 'MemcacheConnector returns int tags as floats')
+            self.assertIs(type(reader.get('value1')), int)
+            writer.set('message', 'text')
+            self.assertEqual(reader.get('message'), 'text')
+            reader.set_many({'value4': 4})
+            self.assertEqual(writer.keys(), ['message', 'value1', 'value2', 'value3', 'value4'],
+                             'keys written after initialize are missing from the directory')
+            self.assertEqual(reader.get_changes_since(0)[1]['message'], 'text')
+
+            writer.initialize([('value1', 10)], clear_old=True)
+            self.assertEqual(reader.get_many(['value1', 'value2']), {'value1': 10, 'value2': None},
+                             'MemcacheConnector readers do not follow a cleared namespace')
+            self.assertEqual(reader.keys(), ['value1'])
+        finally:
+            server.stop()
+
     def test_connection_factory(self):
         try:
             connection = ConnectorFactory.build(Connection.MEMCACHE_LOCAL_CONNECTION)
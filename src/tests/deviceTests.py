@@ -0,0 +1,413 @@
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from ics_sim import logs
+from ics_sim.connectors import ConnectorFactory
+from ics_sim.Device import (ProcessImage, HMI, PLC, Runnable, RunnableExecutor, RunnableProcess, SensorConnector,
+                            ActuatorConnector)
+from ics_sim.scheduler import ScanScheduler
+from ics_sim.snapshots import SnapshotRecorder, read_snapshots, snapshots_to_csv, string_format
+from ics_sim.tags import TagTable
+
+
+class ProcessCounter(Runnable):
+    def _before_start(self):
+        pass
+
+    def _logic(self):
+        pass
+
+    def _after_stop(self):
+        logging.getLogger('deviceTests.process').warning('pid %s policy %s', os.getpid(),
+                                                         self.get_scan_stats()['policy'])
+
+
+def setup_counter(counter):
+    counter.set_scan_timing(ScanScheduler.CATCH_UP)
+
+
+PLC_TAGS = {
+    'level': {'id': 0, 'plc': 1, 'type': 'input', 'fault': 0.0, 'default': 5},
+    'valve': {'id': 1, 'plc': 1, 'type': 'output', 'fault': 0.0, 'datatype': 'bool', 'default': 0},
+    'message': {'id': 2, 'plc': 1, 'type': 'output', 'fault': 0.0, 'datatype': 'string', 'length': 8, 'default': ''},
+}
+
+
+class StoragePLC(PLC):
+    def __init__(self, connection, engine='threads', port=5031):
+        plcs = {1: {'name': 'PLC', 'ip': '127.0.0.1', 'port': port, 'protocol': 'ModbusWriteRequest-TCP',
+                    'server_engine': engine}}
+        PLC.__init__(self, 1, SensorConnector(connection), ActuatorConnector(connection), PLC_TAGS, plcs)
+
+    def _logic(self):
+        pass
+
+
+class DeviceTests(unittest.TestCase):
+
+    def test_plc_server_close(self):
+        with tempfile.TemporaryDirectory() as directory:
+            connection = {'type': 'shm', 'path': os.path.join(directory, 'storage.shm'), 'name': 'storage'}
+            ConnectorFactory.build(connection).initialize([('level', 5), ('valve', 0)])
+            for engine, port in [('sharded', 5032), ('process', 5033)]:
+                with mock.patch('sys.stdin'):
+                    plc = StoragePLC(connection, engine, port)
+                path = plc.server.bank.path
+                self.assertTrue(os.path.exists(path))
+
+                plc.start()
+                time.sleep(0.5)
+                plc.stop()
+                self.assertFalse(os.path.exists(path), 'the shared register bank of {} outlives the PLC'.format(engine))
+
+    def test_plc_scan_image(self):
+        with tempfile.TemporaryDirectory() as directory:
+            connection = {'type': 'shm', 'path': os.path.join(directory, 'storage.shm'), 'name': 'storage'}
+            storage = ConnectorFactory.build(connection)
+            storage.initialize([('level', 5), ('valve', 0)])
+            with mock.patch('sys.stdin'):
+                plc = StoragePLC(connection)
+            plc.set_scan_image(True)
+            storage.set('level', 7)
+
+            sensors = plc._sensor_connector._connector
+            actuators = plc._actuator_connector._connector
+            with mock.patch.object(sensors, 'get_many', wraps=sensors.get_many) as reads, \
+                    mock.patch.object(actuators, 'set_many', wraps=actuators.set_many) as writes:
+                plc._pre_logic_update()
+                plc._set('valve', 1)
+                plc._post_logic_update()
+            self.assertEqual((reads.call_count, writes.call_count), (1, 1),
+                             'a scan with the image does more than one bulk read and one bulk write')
+            self.assertEqual(storage.get('valve'), 1)
+            self.assertEqual(plc.server.get(0), 7)
+            storage.close()
+
+    def test_process_image(self):
+        storage = {'tag1': 1, 'tag2': 2}
+        reads = []
+        writes = []
+
+        def reader(tags):
+            reads.append(list(tags))
+            return {tag: storage[tag] for tag in tags}
+
+        image = ProcessImage(reader, writes.append)
+        image.load(['tag1'])
+        self.assertEqual(image.get('tag1'), 1)
+        self.assertEqual(image.get('tag2'), 2, 'process image does not fetch unknown tags')
+
+        storage['tag1'] = 10
+        image.set('tag2', 20)
+        self.assertEqual(image.get_many(['tag1', 'tag2']), {'tag1': 1, 'tag2': 20},
+                         'process image is not stable during a scan')
+        self.assertEqual(writes, [], 'process image writes before commit')
+
+        image.commit()
+        self.assertEqual(writes, [{'tag2': 20}])
+
+        image.load()
+        self.assertEqual(reads[-1], ['tag1', 'tag2'], 'process image does not reload all known tags in bulk')
+        self.assertEqual(image.get('tag1'), 10)
+
+    def test_tag_table(self):
+        tags = {
+            'a': {'id': 0, 'plc': 1, 'type': 'input', 'fault': 0.1, 'default': 5},
+            'b': {'id': 1, 'plc': 1, 'type': 'output', 'fault': 0.0, 'default': 1},
+            'c': {'id': 0, 'plc': 2, 'type': 'output', 'fault': 0.0, 'default': 0},
+        }
+        table = TagTable(tags)
+        self.assertEqual(len(table), 3)
+        self.assertEqual(table.resolve('b'), 1)
+        self.assertEqual(table.resolve_id(2, 0), 2)
+        self.assertEqual(table.local(1), [0, 1])
+        self.assertEqual(table.local_inputs(1), [0])
+        self.assertEqual(table.local_outputs(2), [2])
+        self.assertEqual(table.faults[0], 0.1)
+        self.assertEqual(table.defaults[1], 1)
+
+    def test_write_batching(self):
+        class RecordingClient:
+            def __init__(self):
+                self.sent = []
+
+            def send(self, tag_id, value):
+                self.sent.append({tag_id: value})
+
+            def send_many(self, mapping):
+                self.sent.append(dict(mapping))
+
+        tags = {
+            'a': {'id': 0, 'plc': 1, 'type': 'output', 'fault': 0.0, 'default': 0},
+            'b': {'id': 1, 'plc': 1, 'type': 'output', 'fault': 0.0, 'default': 0},
+        }
+        plcs = {1: {'name': 'PLC1', 'ip': '127.0.0.1', 'port': 5001, 'protocol': 'ModbusWriteRequest-TCP'}}
+        with mock.patch('sys.stdin'):
+            hmi = HMI('HMI', tags, plcs)
+        client = hmi.clients[1] = RecordingClient()
+
+        hmi._send('a', 1)
+        self.assertEqual(client.sent, [{0: 1}])
+
+        hmi.set_write_batching(True)
+        hmi._send('a', 2)
+        hmi._send('b', 3)
+        self.assertEqual(hmi._receive('b'), 3, 'buffered writes are not visible to reads')
+        self.assertEqual(len(client.sent), 1, 'buffered writes are sent before the end of the scan')
+
+        hmi._post_logic_update()
+        self.assertEqual(client.sent[1:], [{0: 2, 1: 3}])
+        hmi._post_logic_update()
+        self.assertEqual(len(client.sent), 2, 'an empty buffer is flushed')
+
+    def test_write_batching_retries_failed_writes(self):
+        class FailingClient:
+            def __init__(self):
+                self.failures = 1
+                self.sent = []
+
+            def send_many(self, mapping):
+                if self.failures:
+                    self.failures -= 1
+                    raise ConnectionError('PLC1 is down')
+                self.sent.append(dict(mapping))
+
+        tags = {
+            'a': {'id': 0, 'plc': 1, 'type': 'output', 'fault': 0.0, 'default': 0},
+            'b': {'id': 1, 'plc': 1, 'type': 'output', 'fault': 0.0, 'default': 0},
+        }
+        plcs = {1: {'name': 'PLC1', 'ip': '127.0.0.1', 'port': 5001, 'protocol': 'ModbusWriteRequest-TCP'}}
+        with mock.patch('sys.stdin'):
+            hmi = HMI('HMI', tags, plcs)
+        client = hmi.clients[1] = FailingClient()
+
+        hmi.set_write_batching(True)
+        hmi._send('a', 1)
+        hmi._send('b', 2)
+        hmi._post_logic_update()
+        self.assertEqual(client.sent, [])
+        self.assertEqual(hmi._write_buffer, {'a': 1, 'b': 2}, 'failed writes are lost')
+
+        hmi.set_write_batching(True)
+        self.assertEqual(hmi._write_buffer, {'a': 1, 'b': 2}, 'enabling batching again resets the buffer')
+
+        hmi._send('a', 5)
+        hmi.set_write_batching(False)
+        self.assertEqual(client.sent, [{0: 5, 1: 2}], 'a retry overwrites a newer value or is not flushed')
+        self.assertIsNone(hmi._write_buffer)
+
+    def test_plc_unreachable_peer(self):
+        class PeerPLC(PLC):
+            def __init__(self, connection):
+                PLC.__init__(self, 1, SensorConnector(connection), ActuatorConnector(connection), tags, plcs, 10)
+
+            def _logic(self):
+                values.append(self._get('peer'))
+                self._set('peer', 1)
+
+        tags = dict(PLC_TAGS, peer={'id': 0, 'plc': 2, 'type': 'output', 'fault': 0.0, 'default': 0})
+        plcs = {1: {'name': 'PLC', 'ip': '127.0.0.1', 'port': 5034, 'protocol': 'ModbusWriteRequest-TCP'},
+                2: {'name': 'Peer', 'ip': '127.0.0.1', 'port': 5035, 'protocol': 'ModbusWriteRequest-TCP'}}
+        values = []
+        with tempfile.TemporaryDirectory() as directory:
+            connection = {'type': 'shm', 'path': os.path.join(directory, 'storage.shm'), 'name': 'storage'}
+            ConnectorFactory.build(connection).initialize([('level', 5), ('valve', 0)])
+            with mock.patch('sys.stdin'):
+                plc = PeerPLC(connection)
+            with mock.patch.object(plc, 'report') as report:
+                plc.start()
+                time.sleep(0.3)
+                scans = len(values)
+                time.sleep(0.3)
+                plc.stop()
+
+        self.assertGreater(scans, 0)
+        self.assertGreater(len(values), scans, 'an unreachable peer stops the scan loop')
+        self.assertEqual(set(values), {None})
+        self.assertTrue(any(call.args[1] == logging.ERROR for call in report.call_args_list))
+
+    def test_plc_storage(self):
+        with tempfile.TemporaryDirectory() as directory:
+            connection = {'type': 'shm', 'path': os.path.join(directory, 'storage.shm'), 'name': 'storage'}
+            storage = ConnectorFactory.build(connection)
+            storage.initialize([('level', 5), ('valve', 0)])
+            with mock.patch('sys.stdin'):
+                plc = StoragePLC(connection)
+
+            with mock.patch('ics_sim.connectors.error') as error:
+                plc._set('valve', 1)
+                plc._set('message', 'ready')
+                plc._store_received_values()
+            error.assert_not_called()
+            self.assertEqual(storage.get('valve'), 1)
+            self.assertEqual(storage.keys(), ['level', 'valve'], 'string tags are written to the storage')
+            self.assertEqual(plc.server.get(2), 'ready')
+            self.assertEqual(plc.server.get(0), 5)
+            storage.close()
+
+    def test_scan_scheduler(self):
+        ms = 1000000
+        expected = {ScanScheduler.SKIP: (40, 2), ScanScheduler.CATCH_UP: (20, 0), ScanScheduler.STRETCH: (35, 1)}
+        for policy, (deadline, missed) in expected.items():
+            scheduler = ScanScheduler(10, policy)
+            scheduler.start(0)
+            self.assertEqual(scheduler.begin(10 * ms + 1000), 1000)
+            scheduler.end(35 * ms)
+            self.assertEqual((scheduler.deadline, scheduler.missed, scheduler.overruns),
+                             (deadline * ms, missed, 1), policy)
+
+        scheduler = ScanScheduler(10, ScanScheduler.CATCH_UP)
+        scheduler.start(0)
+        for start in [10, 35, 36, 40, 50]:
+            scheduler.begin(start * ms)
+            scheduler.end((start + 1) * ms if start != 10 else 35 * ms)
+        self.assertEqual((scheduler.cycles, scheduler.late, scheduler.due), (5, 2, 50 * ms),
+                         'catch-up does not run the missed scans back to back')
+
+        with self.assertRaises(ValueError):
+            ScanScheduler(10, 'drop')
+
+    def test_scan_loop(self):
+        class Counter(Runnable):
+            def _before_start(self):
+                pass
+
+            def _logic(self):
+                scans.append(time.monotonic_ns())
+
+        scans = []
+        with mock.patch('sys.stdin'):
+            device = Counter('Counter', 2)
+        device.start()
+        time.sleep(0.1)
+        device.stop()
+        time.sleep(0.01)
+
+        stats = device.get_scan_stats()
+        self.assertGreaterEqual(stats['cycles'], 25)
+        self.assertEqual(stats['cycles'], len(scans))
+        # the median, so a single scan delayed by the machine does not fail the test
+        periods = sorted(b - a for a, b in zip(scans, scans[1:]))
+        self.assertLess(abs(periods[len(periods) // 2] - 2000000), 100000, 'scan period drifts')
+        self.assertLess(device.get_loop_latency(), 2)
+
+    def test_runnable_executor(self):
+        class Counter(Runnable):
+            def __init__(self, name, loop, fail=False):
+                Runnable.__init__(self, name, loop)
+                self.threads = set()
+                self.fail = fail
+
+            def _before_start(self):
+                pass
+
+            def _logic(self):
+                self.threads.add(threading.get_ident())
+                if self.fail:
+                    raise RuntimeError('scan failed')
+
+        executor = RunnableExecutor()
+        with mock.patch('sys.stdin'):
+            devices = [executor.add(Counter('Fast', 2)), executor.add(Counter('Slow', 5)),
+                       executor.add(Counter('Broken', 2, fail=True))]
+        executor.start()
+        time.sleep(0.1)
+        executor.stop()
+
+        fast, slow, broken = [device.get_scan_stats()['cycles'] for device in devices]
+        self.assertGreaterEqual(fast, 40)
+        self.assertGreaterEqual(slow, 16)
+        self.assertLessEqual(slow, 21)
+        self.assertEqual(broken, 1, 'a failing device is not dropped')
+        self.assertEqual(len(set.union(*[device.threads for device in devices])), 1)
+        self.assertTrue(all(device.stop_event.is_set() for device in devices))
+
+    def test_runnable_process(self):
+        process = RunnableProcess(ProcessCounter, ('Counter', 10), setup=setup_counter, cpu_affinity=[0])
+        process.start()
+        time.sleep(0.5)
+        self.assertTrue(process.is_alive())
+        # capture only after the fork, the child must inherit the logger unchanged
+        with self.assertLogs('deviceTests.process', logging.WARNING) as logs:
+            process.stop()
+        self.assertEqual(process.exitcode, 0)
+        pid, policy = logs.records[0].getMessage().split()[1::2]
+        self.assertEqual(policy, 'catch-up', 'setup is not applied')
+        self.assertNotEqual(int(pid), os.getpid(), 'device runs in this process')
+
+    def test_log_pipeline(self):
+        formatter = logging.Formatter('%(name)s %(message)s')
+        with tempfile.TemporaryDirectory() as directory:
+            first = logs.file_logger('pipeline', formatter, file_dir=directory)
+            self.assertIs(logs.file_logger('pipeline', formatter, file_dir=directory), first)
+            self.assertEqual(len(first.handlers), 1, 'the same file logger is set up twice')
+            # a second file of the same logger, e.g. an agent log shared with a csv
+            logs.file_logger('pipeline', formatter, file_dir=directory, file_ext='.txt', level=logging.DEBUG)
+
+            first.info('value %s', 1)
+            first.debug('debug %s', 2)
+            first.setLevel(logging.INFO)
+            first.debug('dropped %s', 3)
+            self.assertTrue(logs.flush_logging())
+
+            self.assertEqual(len(first.handlers), 2)
+            for ext in ['.log', '.txt']:
+                with open(os.path.join(directory, 'pipeline' + ext)) as file:
+                    self.assertEqual(file.read(), 'pipeline value 1\npipeline debug 2\n')
+            for handler in list(first.handlers):
+                first.removeHandler(handler)
+
+        # importing the module starts no listener thread
+        threads = subprocess.check_output(
+            [sys.executable, '-c', 'import threading; from ics_sim import logs; print(threading.active_count())'],
+            cwd=os.path.dirname(os.path.dirname(logs.__file__)))
+        self.assertEqual(threads.strip(), b'1')
+
+        with mock.patch.object(logs._get_pipeline(), 'headless', True):
+            self.assertEqual(Runnable._make_text('text', Runnable.COLOR_RED), 'text')
+        self.assertNotEqual(Runnable._make_text('text', Runnable.COLOR_RED), 'text')
+
+
+    def test_snapshot_recorder(self):
+        columns = [('time', 'float64'), ('LEVEL(0)', 'int16'), ('VALVE(1)', 'bool'), ('NAME(2)', string_format(4))]
+        rows = [[1700000000.5 + i, i * 10, i % 2, 'ab' * i] for i in range(7)]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'snapshots_PLC')
+            recorder = SnapshotRecorder(path, columns, chunk_rows=3, name='PLC')
+            for row in rows:
+                recorder.append(row)
+            recorder.close()
+            recorder.append(rows[0])
+
+            self.assertEqual(sorted(os.listdir(path)), ['chunk-00000', 'chunk-00001', 'chunk-00002', 'schema.json'])
+            with open(os.path.join(path, 'chunk-00002', '000.npy'), 'rb') as file:
+                content = file.read()
+            self.assertEqual(content[:8], b'\x93NUMPY\x01\x00')
+            self.assertEqual((len(content) - 8) % 64, 0, 'data is not aligned')
+
+            expected = [[row[0], row[1], bool(row[2]), row[3][:4]] for row in rows]
+            self.assertEqual(list(read_snapshots(path)), expected)
+
+            with open(snapshots_to_csv(path)) as file:
+                lines = file.read().splitlines()
+            self.assertEqual(lines[0], 'time, LEVEL(0), VALVE(1), NAME(2), ')
+            self.assertEqual(len(lines), 8)
+            self.assertTrue(lines[2].endswith(', 10, True, ab, '), lines[2])
+
+            # a second run into the same directory starts a new recording
+            recorder = SnapshotRecorder(path, columns[:2], chunk_rows=3, name='PLC')
+            recorder.append(rows[0][:2])
+            recorder.close()
+            self.assertEqual(sorted(os.listdir(path)), ['chunk-00000', 'schema.json'])
+            self.assertEqual(list(read_snapshots(path)), [rows[0][:2]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,18 @@
+import asyncio
+import json
+import os
+import tempfile
 import time
 import unittest
 from ics_sim.helper import debug
+from ics_sim.metrics import LatencyHistogram, MetricsLog
 from pyModbusTCP.server import ModbusServer, DataBank
 
-from ics_sim.protocol import ClientModbus, ServerModbus, ModbusBase
+from ics_sim.protocol import ClientModbus, ServerModbus, ModbusBase, AsyncClientModbus, AsyncServerModbus, \
+    ModbusError, ModbusFrame, ModbusConnectionPool, EventLoopServerModbus, ProtocolFactory, RegisterMap, \
+    SharedBankServerModbus
+from ics_sim.registers import SharedRegisterBank
+from ics_sim.subscriptions import ChangeLog, ChangePublisher
 
 
 class ProtocolTests(unittest.TestCase):
@@ -17,6 +26,26 @@ class ProtocolTests(unittest.TestCase):
         self.modbusBase_fuc(modbus_base, 1)
         self.modbusBase_fuc(modbus_base, 7654)
         self.modbusBase_fuc(modbus_base, 70000)
+        self.modbusBase_fuc(modbus_base, -1)
+        self.modbusBase_fuc(modbus_base, -70000.5)
+
+        self.assertEqual(modbus_base.encode(1.5), [0, 15000])
+        self.assertEqual(modbus_base.encode(-0.0001), [65535, 65535])
+        self.assertRaises(ValueError, modbus_base.encode, 214748.3648)
+        self.assertRaises(ValueError, modbus_base.encode, -214748.3649)
+        self.assertRaises(ValueError, modbus_base.decode, [1, 2, 3])
+
+    def test_ModbusBase_many(self):
+        modbus_base = ModbusBase()
+        numbers = [0, 1.5, -2.25, 7654, 214748.3647, -214748.3648]
+
+        words = modbus_base.encode_many(numbers)
+        self.assertEqual(words, [word for number in numbers for word in modbus_base.encode(number)])
+        self.assertEqual(modbus_base.decode_many(words), numbers)
+        self.assertEqual(modbus_base.encode_many([]), [])
+        self.assertRaises(ValueError, modbus_base.decode_many, [1, 2, 3])
+        self.assertRaises(ValueError, modbus_base.decode_many, [1, 65536])
+        self.assertRaises(ValueError, modbus_base.encode_many, [1, 1e9])
 
     def modbusBase_fuc(self, modbus_base, number):
         words = modbus_base.encode(number)
@@ -72,6 +101,438 @@ class ProtocolTests(unittest.TestCase):
         server.stop()
         client.close()
 
+    def test_plan_ranges(self):
+        modbus_base = ModbusBase()
+        self.assertEqual(modbus_base.plan_ranges([]), [])
+        self.assertEqual(modbus_base.plan_ranges([3, 1, 2, 3]), [(1, 3)])
+        self.assertEqual(modbus_base.plan_ranges([0, 10, 61, 62]), [(0, 62), (62, 1)],
+                         'ranges exceed the 125 register read limit')
+        self.assertEqual(modbus_base.plan_ranges([0, 3, 5, 9], max_registers=8), [(0, 4), (5, 1), (9, 1)])
+
+    def test_plan_writes(self):
+        modbus_base = ModbusBase()
+        self.assertEqual(modbus_base.plan_writes({}), [])
+        self.assertEqual(modbus_base.plan_writes({2: 'c', 0: 'a', 1: 'b', 5: 'f'}), [(0, ['a', 'b', 'c']), (5, ['f'])])
+        self.assertEqual(modbus_base.plan_writes({0: 0, 1: 1, 2: 2}, max_registers=4), [(0, [0, 1]), (2, [2])],
+                         'writes exceed the register limit')
+
+    def test_client_send_many(self):
+        client = ClientModbus('127.0.0.1', 5001)
+        server = ServerModbus('127.0.0.1', 5001)
+        server.start()
+
+        seq = server.changes.seq
+        values = {0: 1.5, 1: -2, 2: 3, 7: 7563.42}
+        client.send_many(values)
+        received = {tag_id: server.get(tag_id) for tag_id in values}
+        seq, changes = server.get_changes_since(seq)
+
+        server.stop()
+        client.close()
+        self.assertEqual(received, values)
+        self.assertEqual(changes, values, 'block writes are not tracked per tag')
+
+    def test_client_receive_many(self):
+        client = ClientModbus('127.0.0.1', 5001)
+        server = ServerModbus('127.0.0.1', 5001)
+        server.start()
+
+        values = {0: 1.5, 1: -2, 3: 7563.42, 100: 12}
+        for tag_id, value in values.items():
+            server.set(tag_id, value)
+        received = client.receive_many([100, 3, 1, 0])
+
+        server.stop()
+        client.close()
+        self.assertEqual(received, values)
+        self.assertEqual(list(received), [100, 3, 1, 0], 'receive_many does not keep the requested order')
+
+    def test_connection_pool(self):
+        pool = ModbusConnectionPool(max_connections=2, acquire_timeout=0.1)
+        server = ServerModbus('127.0.0.1', 5001)
+        server.start()
+
+        server.set(2, 4.5)
+        clients = [ClientModbus('127.0.0.1', 5001, pool) for _ in range(10)]
+        received = [client.receive(2) for client in clients]
+        stats = pool.stats()['127.0.0.1:5001']
+        self.assertEqual(received, [4.5] * 10)
+        self.assertEqual((stats['opened'], stats['reused']), (1, 9), 'clients of one endpoint do not share sockets')
+
+        first = pool.acquire('127.0.0.1', 5001)
+        second = pool.acquire('127.0.0.1', 5001)
+        with self.assertRaises(ConnectionError):
+            pool.acquire('127.0.0.1', 5001)
+        pool.release('127.0.0.1', 5001, first)
+        pool.release('127.0.0.1', 5001, second)
+
+        server.stop()
+        server = ServerModbus('127.0.0.1', 5001)
+        server.start()
+        server.set(2, 5.5)
+        self.assertEqual(clients[0].receive(2), 5.5, 'stale pooled connections are not replaced')
+        server.stop()
+
+        pool.idle_timeout = 0
+        time.sleep(0.01)
+        with self.assertRaises(ConnectionError):
+            clients[0].receive(2)
+        stats = pool.stats()['127.0.0.1:5001']
+        self.assertGreater(stats['evicted'], 0, 'idle connections are not evicted')
+        self.assertEqual(stats['failures'], 1)
+        with self.assertRaisesRegex(ConnectionError, 'unreachable'):
+            clients[0].receive(2)
+
+    def test_event_loop_server_modbus(self):
+        server = ProtocolFactory.create_server('ModbusWriteRequest-TCP', '127.0.0.1', 5001, ProtocolFactory.ENGINE_ASYNCIO)
+        self.assertIsInstance(server, EventLoopServerModbus)
+        server.engine.max_connections = 1
+        server.start()
+
+        client = ClientModbus('127.0.0.1', 5001, ModbusConnectionPool())
+        server.set(3, 7563.42)
+        received = client.receive(3)
+        seq = server.changes.seq
+        client.send_many({5: 1.2, 6: -3})
+        stored = [server.get(5), server.get(6)]
+        seq, changes = server.get_changes_since(seq)
+
+        rejected = ClientModbus('127.0.0.1', 5001, ModbusConnectionPool())
+        with self.assertRaises(ConnectionError):
+            rejected.receive(3)
+
+        client.close()
+        server.stop()
+        self.assertEqual(received, 7563.42)
+        self.assertEqual(stored, [1.2, -3])
+        self.assertEqual(changes, {5: 1.2, 6: -3})
+        self.assertGreater(server.engine.rejected_connections, 0, 'the connection cap is not applied')
+
+    def test_sharded_server_modbus(self):
+        server = ProtocolFactory.create_server('ModbusWriteRequest-TCP', '127.0.0.1', 5001,
+                                               ProtocolFactory.ENGINE_SHARDED, workers=2)
+        server.start()
+
+        clients = [ClientModbus('127.0.0.1', 5001, ModbusConnectionPool()) for _ in range(4)]
+        server.set(3, 7563.42)
+        received = [client.receive(3) for client in clients]
+
+        seq = server.changes.seq
+        clients[0].send_many({5: 1.2, 6: -3})
+        deadline = time.time() + 5
+        while server.get(5) != 1.2 and time.time() < deadline:
+            time.sleep(0.01)
+            server.poll()
+        stored = [server.get(5), server.get(6)]
+        seq, changes = server.get_changes_since(seq)
+
+        for client in clients:
+            client.close()
+        server.close()
+        self.assertEqual(server.stats()['requests'], 5, 'worker metrics are not collected')
+        self.assertEqual(received, [7563.42] * 4)
+        self.assertEqual(stored, [1.2, -3], 'client writes are not applied by poll()')
+        self.assertEqual(changes, {5: 1.2, 6: -3})
+
+    def test_register_bank_locked(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bank.registers')
+            bank = SharedRegisterBank(path, create=True)
+            reader = SharedRegisterBank(path)
+            bank.write(0, b'\x00\x07')
+            worker = SharedBankServerModbus('127.0.0.1', 5009, reader, None)
+            request = ModbusFrame.READ_REQUEST.pack(ModbusFrame.READ_HOLDING_REGISTERS, 0, 1)
+
+            with bank.writing():
+                # a writer that died mid-update leaves the sequence odd
+                with self.assertRaises(TimeoutError):
+                    reader.read(0, 1)
+                response = worker.handle_request(request)
+            self.assertEqual(response, ModbusFrame.exception(ModbusFrame.READ_HOLDING_REGISTERS,
+                                                             ModbusFrame.SERVER_DEVICE_FAILURE))
+            self.assertEqual(reader.read(0, 1), b'\x00\x07')
+            reader.close()
+            bank.unlink()
+
+    def test_process_server_modbus(self):
+        server = ProtocolFactory.create_server('ModbusWriteRequest-TCP', '127.0.0.1', 5001,
+                                               ProtocolFactory.ENGINE_PROCESS)
+        server.start()
+        client = ClientModbus('127.0.0.1', 5001, ModbusConnectionPool())
+
+        server.set(3, 12.345678)
+        server.set(4, -2)
+        local = server.get(3)
+        before_publish = client.receive(3)
+        server.publish()
+        published = client.receive_many([3, 4])
+
+        client.send(4, 9.5)
+        deadline = time.time() + 5
+        while server.get(4) != 9.5 and time.time() < deadline:
+            time.sleep(0.01)
+            server.poll()
+        stored = server.get(4)
+
+        client.close()
+        server.close()
+        self.assertEqual(local, 12.3456)
+        self.assertEqual(before_publish, 0, 'values must only reach clients through publish()')
+        self.assertEqual(published, {3: 12.3456, 4: -2})
+        self.assertEqual(stored, 9.5, 'client writes are not applied by poll()')
+
+    TYPED_TAGS = {
+        'level': {'id': 0, 'plc': 1, 'type': 'input'},
+        'flow': {'id': 3, 'plc': 1, 'type': 'output'},
+        'running': {'id': 1, 'plc': 1, 'type': 'output', 'datatype': 'bool'},
+        'full': {'id': 2, 'plc': 1, 'type': 'input', 'datatype': 'bool'},
+        'message': {'id': 4, 'plc': 1, 'type': 'output', 'datatype': 'string', 'length': 5},
+        'temperature': {'id': 5, 'plc': 1, 'type': 'output', 'datatype': 'float32'},
+        'status': {'id': 6, 'plc': 1, 'type': 'output', 'datatype': 'int16'},
+        'other': {'id': 7, 'plc': 2, 'type': 'output', 'datatype': 'int32'},
+    }
+
+    def test_register_map(self):
+        register_map = RegisterMap(self.TYPED_TAGS, 1)
+        layout = {tag_id: register_map[tag_id][1:4] for tag_id in range(8)}
+        self.assertEqual(layout, {
+            0: (RegisterMap.HOLDING_REGISTERS, 0, 2),
+            1: (RegisterMap.COILS, 0, 1),
+            2: (RegisterMap.DISCRETE_INPUTS, 0, 1),
+            3: (RegisterMap.HOLDING_REGISTERS, 6, 2),
+            4: (RegisterMap.HOLDING_REGISTERS, 14, 3),
+            5: (RegisterMap.HOLDING_REGISTERS, 17, 2),
+            6: (RegisterMap.HOLDING_REGISTERS, 19, 1),
+            7: (RegisterMap.HOLDING_REGISTERS, 14, 2),
+        }, 'typed tags are not laid out after the fixed point registers')
+        self.assertEqual(register_map.tags_at(RegisterMap.HOLDING_REGISTERS, 5, 12), [3, 4],
+                         'the old registers of typed tags are taken for fixed point tags')
+        self.assertEqual([alias.tag_id for alias in register_map.aliases_at(0, 14)], [1, 2, 6])
+        self.assertEqual(register_map.alias(6)[1:4], (RegisterMap.HOLDING_REGISTERS, 12, 2))
+        self.assertIsNone(register_map.alias(4), 'string tags have no fixed point alias')
+
+        reads = register_map.plan_reads([5, 0, 1, 6, 2])
+        self.assertEqual([read[:3] for read in reads], [
+            (RegisterMap.HOLDING_REGISTERS, 0, 20), (RegisterMap.COILS, 0, 1), (RegisterMap.DISCRETE_INPUTS, 0, 1)])
+        writes = register_map.plan_writes({6: -2, 4: 'ab', 3: 1.5, 1: True})
+        self.assertEqual(writes, [(RegisterMap.HOLDING_REGISTERS, 6, [0, 15000]),
+                                  (RegisterMap.HOLDING_REGISTERS, 14, [24930, 0, 0]),
+                                  (RegisterMap.HOLDING_REGISTERS, 19, [65534]), (RegisterMap.COILS, 0, [1])])
+        self.assertRaises(ValueError, register_map.plan_writes, {2: True})
+        self.assertRaises(ValueError, register_map.plan_writes, {4: 'too long'})
+        self.assertRaises(ValueError, register_map.plan_writes, {6: 40000})
+        self.assertRaises(ValueError, RegisterMap, {'x': {'id': 0, 'plc': 1, 'type': 'output', 'datatype': 'string'}})
+        self.assertRaises(ValueError, RegisterMap, {'x': {'id': 0, 'plc': 1, 'type': 'output', 'datatype': 'int8'}})
+
+    def test_typed_tags(self):
+        register_map = RegisterMap(self.TYPED_TAGS, 1)
+        for engine in [ProtocolFactory.ENGINE_THREADS, ProtocolFactory.ENGINE_ASYNCIO, ProtocolFactory.ENGINE_PROCESS]:
+            server = ProtocolFactory.create_server('ModbusWriteRequest-TCP', '127.0.0.1', 5001, engine,
+                                                   register_map=register_map)
+            server.start()
+            client = ClientModbus('127.0.0.1', 5001, ModbusConnectionPool(), register_map)
+
+            for tag_id, value in {0: 1.5, 1: True, 2: True, 3: -4, 4: 'héé', 5: 21.5, 6: -300}.items():
+                server.set(tag_id, value)
+            server.publish()
+            received = client.receive_many([0, 1, 2, 3, 4, 5, 6])
+
+            seq = server.changes.seq
+            client.send_many({1: False, 4: 'ok', 5: 0.1, 6: 7})
+            deadline = time.time() + 5
+            while server.get(6) != 7 and time.time() < deadline:
+                time.sleep(0.01)
+                server.poll()
+            stored = [server.get(tag_id) for tag_id in [1, 4, 5, 6]]
+            seq, changes = server.get_changes_since(seq)
+
+            # a client that only knows tag ids reaches bool and int16 tags through their old registers
+            legacy = ClientModbus('127.0.0.1', 5001, ModbusConnectionPool())
+            aliased = legacy.receive_many([1, 6])
+            legacy.send_many({1: 1, 4: 3})
+            deadline = time.time() + 5
+            while server.get(1) is not True and time.time() < deadline:
+                time.sleep(0.01)
+                server.poll()
+            self.assertEqual(aliased, {1: 0.0, 6: 7.0}, engine)
+            self.assertIs(server.get(1), True, engine)
+            self.assertEqual(server.get(4), 'ok', engine)
+            self.assertEqual(server.get_changes_since(seq)[1], {1: True},
+                             '{}: a write to the old register of a string tag is recorded'.format(engine))
+
+            legacy.close()
+            client.close()
+            server.stop()
+            server.close()
+            self.assertEqual(received, {0: 1.5, 1: True, 2: True, 3: -4, 4: 'héé', 5: 21.5, 6: -300}, engine)
+            self.assertEqual(stored[:2] + stored[3:], [False, 'ok', 7], engine)
+            self.assertAlmostEqual(stored[2], 0.1, places=6, msg=engine)
+            self.assertEqual(sorted(changes), [1, 4, 5, 6], engine)
+
+    def test_latency_histogram(self):
+        histogram = LatencyHistogram()
+        for value in range(1, 100001):
+            histogram.record(value)
+        self.assertEqual((histogram.count, histogram.min, histogram.max), (100000, 1, 100000))
+        for percent in [50, 90, 99, 99.9]:
+            expected = percent * 1000
+            self.assertLessEqual(abs(histogram.percentile(percent) - expected) / expected, 1 / 32)
+        self.assertEqual(histogram.percentile(100), 100000)
+
+        small = LatencyHistogram()
+        for value in [3, 3, 5, 60]:
+            small.record(value)
+        self.assertEqual([small.percentile(50), small.percentile(75), small.percentile(100)], [3, 5, 60],
+                         'small values are not counted exactly')
+
+        merged = LatencyHistogram.from_export(small.export())
+        merged.merge(histogram)
+        self.assertEqual((merged.count, merged.min, merged.max), (100004, 1, 100000))
+        self.assertEqual(LatencyHistogram().summary(), {'count': 0})
+
+    def test_server_metrics(self):
+        server = ServerModbus('127.0.0.1', 5001)
+        server.start()
+        client = ClientModbus('127.0.0.1', 5001, ModbusConnectionPool())
+        server.set(1, 2.5)
+        client.receive(1)
+        client.receive_many([0, 60])
+        client.send(150, 1)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'logs', 'metrics.jsonl')
+            log = MetricsLog(server.stats, path, interval=60, name='PLC')
+            log.start()
+            log.stop()
+            with open(path) as file:
+                lines = [json.loads(line) for line in file]
+        client.close()
+        server.stop()
+
+        stats = lines[0]
+        self.assertEqual((len(lines), stats['name'], stats['requests'], stats['exceptions']), (1, 'PLC', 3, 0))
+        self.assertEqual({code: entry['requests'] for code, entry in stats['function_codes'].items()},
+                         {'3': 2, '16': 1})
+        self.assertEqual(stats['clients'], {'127.0.0.1': 3})
+        self.assertEqual(stats['ranges'], {'holding_registers:0-99': 2, 'holding_registers:100-199': 1,
+                                           'holding_registers:300-399': 1})
+        self.assertEqual(stats['latency_us']['count'], 3)
+        self.assertLessEqual(stats['latency_us']['p50'], stats['latency_us']['max'])
+
+    def test_server_changes(self):
+        client = ClientModbus('127.0.0.1', 5001)
+        server = ServerModbus('127.0.0.1', 5001)
+        server.start()
+
+        server.set(0, 10)
+        server.set(3, 1.5)
+        seq, changes = server.get_changes_since(0)
+        self.assertEqual(changes, {0: 10, 3: 1.5})
+
+        server.set(0, 10)
+        client.send(3, 2.5)
+        new_seq, changes = server.get_changes_since(seq)
+        self.assertEqual(changes, {3: 2.5}, 'register bank changes written by clients are not tracked')
+
+        server.stop()
+        client.close()
+
+    def test_change_publisher_owner(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'plc.changes')
+            publisher = ChangePublisher(ChangeLog(), path)
+            with self.assertRaises(FileExistsError):
+                ChangePublisher(ChangeLog(), path)
+
+            # a socket file left by a publisher that is gone
+            publisher._socket.close()
+            publisher = ChangePublisher(ChangeLog(), path)
+            publisher.close()
+            self.assertFalse(os.path.exists(path))
+
+    def test_async_client_server_modbus(self):
+        async def scenario():
+            server = AsyncServerModbus('127.0.0.1', 5002)
+            client = AsyncClientModbus('127.0.0.1', 5002)
+            await server.start()
+
+            server.set(3, 7563.42)
+            received = await client.receive(3)
+            self.assertEqual(await client.receive_many([3, 0]), {3: 7563.42, 0: 0})
+            await client.send(5, 1.2)
+            stored = server.get(5)
+
+            with self.assertRaises(ModbusError):
+                await client.read_holding_registers(0, 200)
+
+            await client.close()
+            await server.stop()
+            return received, stored
+
+        received, stored = asyncio.run(scenario())
+        self.assertEqual(received, 7563.42, 'async client cannot read from async server')
+        self.assertEqual(stored, 1.2, 'async client cannot write to async server')
+
+    def test_async_client_pipelining(self):
+        async def answer_pairs_reversed(reader, writer):
+            # answers requests two at a time in reverse order, never answers reads of address 99
+            waiting = []
+            while True:
+                try:
+                    transaction_id, protocol_id, length, unit_id = ModbusFrame.MBAP.unpack(
+                        await reader.readexactly(ModbusFrame.MBAP.size))
+                except asyncio.IncompleteReadError:
+                    return
+                function_code, address, count = ModbusFrame.READ_REQUEST.unpack(await reader.readexactly(length - 1))
+                if address == 99:
+                    continue
+                waiting.append((transaction_id, unit_id, address, count))
+                if len(waiting) == 2:
+                    for transaction_id, unit_id, address, count in reversed(waiting):
+                        data = ModbusFrame.words_to_bytes([address] * count)
+                        pdu = bytes([function_code, len(data)]) + data
+                        writer.write(ModbusFrame.MBAP.pack(transaction_id, 0, len(pdu) + 1, unit_id) + pdu)
+                    waiting = []
+
+        async def scenario():
+            server = await asyncio.start_server(answer_pairs_reversed, '127.0.0.1', 5003)
+            client = AsyncClientModbus('127.0.0.1', 5003)
+
+            first = await asyncio.gather(client.read_holding_registers(1, 1), client.read_holding_registers(2, 2))
+            writer = client._writer
+            with self.assertRaises(asyncio.TimeoutError):
+                await client.read_holding_registers(99, 1, timeout=0.1)
+            second = await asyncio.gather(client.read_holding_registers(3, 1), client.read_holding_registers(4, 1))
+            reused = client._writer is writer
+
+            await client.close()
+            server.close()
+            await server.wait_closed()
+            return first, second, reused
+
+        first, second, reused = asyncio.run(scenario())
+        self.assertEqual(first, [[1], [2, 2]], 'out of order responses are not matched by transaction id')
+        self.assertEqual(second, [[3], [4]])
+        self.assertTrue(reused, 'a request timeout closes the pipelined connection')
+
+    def test_async_client_concurrency(self):
+        async def scenario():
+            server = AsyncServerModbus('127.0.0.1', 5002)
+            client = AsyncClientModbus('127.0.0.1', 5002, max_in_flight=16)
+            await server.start()
+
+            await client.send_many({tag_id: tag_id / 10 for tag_id in range(100)})
+            values = await asyncio.gather(*[client.receive(tag_id) for tag_id in range(100)])
+            many = await client.receive_many(range(0, 100, 3))
+
+            await client.close()
+            await server.stop()
+            return values, many
+
+        values, many = asyncio.run(scenario())
+        self.assertEqual(values, [tag_id / 10 for tag_id in range(100)])
+        self.assertEqual(many, {tag_id: tag_id / 10 for tag_id in range(0, 100, 3)})
+
     def client_server_modbus_func(self, server, client, tag_id, value):
         server.set(tag_id, value)
         received = client.receive(tag_id)